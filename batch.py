@@ -0,0 +1,277 @@
+import argparse
+import asyncio
+import time
+from dataclasses import asdict, dataclass, fields, replace
+from pathlib import Path
+from typing import Any, Callable, Counter
+
+from binary_format import load_schedule_data
+from data import ScheduleData, SolveBudget
+from display_schedule import SaveSchedule
+from metrics import recorder_for
+from persistence import read_file, writer
+from schedule import SolutionEvent
+from solver_pool import SolverPool
+from solvers import create_schedule
+
+INPUT_SUFFIXES = (".json", ".gz", ".bin")
+
+
+@dataclass
+class BatchJob:
+    """Progress of one input of a batch, kept in the batch state file."""
+
+    name: str
+    path: str
+    status: str = "pending"  # pending, running, done or failed
+    objective: Any = None
+    num_solutions: int = 0
+    seconds: float | None = None
+    error: str | None = None
+
+
+BatchCallback = Callable[[BatchJob], Any]
+
+
+def find_inputs(paths: list[str], root: str | Path | None = None) -> list[Path]:
+    """Input files, with directories expanded to the inputs they contain.
+
+    With `root`, paths are taken relative to it and a ValueError is raised for
+    any input that resolves outside of it.
+    """
+    inputs = []
+    for path in map(Path, paths):
+        if root is not None:
+            path = Path(root, path)
+        if path.is_dir():
+            inputs.extend(
+                sorted(
+                    p
+                    for p in path.iterdir()
+                    if p.is_file() and p.suffix in INPUT_SUFFIXES
+                )
+            )
+        else:
+            inputs.append(path)
+    if root is not None:
+        base = Path(root).resolve()
+        for path in inputs:
+            if not path.resolve().is_relative_to(base):
+                raise ValueError(f"{path} is outside the batch input directory")
+    return inputs
+
+
+def load_input(path: Path) -> ScheduleData:
+    obj = read_file(path)
+    if path.suffix == ".bin":
+        return load_schedule_data(obj)
+    return ScheduleData(obj)
+
+
+def job_name(path: Path, taken: set[str]) -> str:
+    name = path.name.split(".")[0] or "input"
+    unique, n = name, 1
+    while unique in taken:
+        n += 1
+        unique = f"{name}_{n}"
+    taken.add(unique)
+    return unique
+
+
+class Batch:
+    """Solves many inputs in one process, sharing its cores and model cache.
+
+    Up to `concurrency` inputs are loaded at a time and all their solves go
+    through one SolverPool, which splits the cores between them. Each input
+    keeps its own budget, fields it leaves unset are taken from `budget`. The
+    latest solution of an input is written to `<output>/<name>.json` as it
+    improves, and its class timetable to `<output>/<name>.csv` once done.
+
+    Every job's progress is kept in `<output>/batch.json`. Running a batch
+    again with the same output skips the inputs already done and warm starts
+    the ones that were interrupted from their last solution.
+    """
+
+    def __init__(
+        self,
+        inputs: list[Path],
+        output: str | Path,
+        budget: SolveBudget | None = None,
+        pool: SolverPool | None = None,
+        concurrency: int | None = None,
+        retry_failed: bool = False,
+        on_progress: BatchCallback | None = None,
+    ):
+        self.output = Path(output)
+        self.budget = budget or SolveBudget()
+        self.pool = pool or SolverPool()
+        # Enough inputs loaded to keep every thread of the pool busy
+        self.concurrency = concurrency or max(
+            1, self.pool.max_threads // self.pool.max_job_threads
+        )
+        self.retry_failed = retry_failed
+        self.on_progress = on_progress
+        self.task: asyncio.Task[list[BatchJob]] | None = None
+
+        state = writer.read(self.state_path) or {}
+        saved = {job["path"]: BatchJob(**job) for job in state.get("jobs", [])}
+        taken = {job.name for job in saved.values()}
+        self.jobs = [
+            saved.get(str(path)) or BatchJob(job_name(path, taken), str(path))
+            for path in inputs
+        ]
+
+    @property
+    def state_path(self):
+        return self.output / "batch.json"
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self) -> list[BatchJob]:
+        skipped = ("done", "failed") if not self.retry_failed else ("done",)
+        queue = [job for job in self.jobs if job.status not in skipped]
+
+        async def worker():
+            while queue:
+                await self.solve(queue.pop(0))
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        # Results and state must be on disk once the batch is reported done
+        await asyncio.to_thread(writer.flush)
+        return self.jobs
+
+    async def cancel(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                print("Batch was cancelled.")
+
+    async def solve(self, job: BatchJob):
+        start = time.perf_counter()
+        interrupted = job.status == "running"
+        job.status, job.num_solutions, job.error = "running", 0, None
+        self.report(job)
+        try:
+            data = await asyncio.to_thread(load_input, Path(job.path))
+        except (OSError, KeyError, TypeError, ValueError) as e:
+            job.status, job.error = "failed", f"Invalid input: {e}"
+            self.report(job)
+            return
+
+        solution_path = self.output / f"{job.name}.json"
+        previous = None
+        if interrupted:
+            saved = writer.read(solution_path)
+            if saved is not None:
+                previous = SolutionEvent(data, saved["variables"], saved["objective"])
+
+        latest: list[SolutionEvent] = []
+        finished = asyncio.Event()
+
+        def callback(event: SolutionEvent | None):
+            if event is None:
+                finished.set()
+                return
+            latest[:] = [event]
+            job.objective = event.objective
+            job.num_solutions += 1
+            writer.submit(
+                solution_path,
+                {"variables": event.variables, "objective": event.objective},
+            )
+            self.report(job)
+
+        runner = None
+        try:
+            runner = create_schedule(
+                data,
+                budget=self.job_budget(data.budget),
+                previous=previous,
+                recorder=recorder_for(data, job.name),
+            )
+            await runner.solve_async(callback, self.pool)
+            await finished.wait()
+        except asyncio.CancelledError:
+            if runner is not None:
+                await runner.cancel()
+            raise
+        except Exception as e:
+            # One bad input must not abort the rest of the batch
+            job.status, job.error = "failed", f"{type(e).__name__}: {e}"
+            job.seconds = time.perf_counter() - start
+            self.report(job)
+            return
+
+        job.seconds = time.perf_counter() - start
+        if latest:
+            job.status = "done"
+            csv = SaveSchedule(data, latest[0].variables).schedule_csv()
+            writer.submit(self.output / f"{job.name}.csv", csv.encode())
+        else:
+            job.status, job.error = "failed", "No solution within budget"
+        self.report(job)
+
+    def job_budget(self, budget: SolveBudget) -> SolveBudget:
+        """The input's budget, with unset fields taken from the batch."""
+        own = {
+            f.name: getattr(budget, f.name)
+            for f in fields(budget)
+            if getattr(budget, f.name) is not None
+        }
+        return replace(self.budget, **own)
+
+    def report(self, job: BatchJob):
+        writer.submit(self.state_path, self.state())
+        if self.on_progress is not None:
+            self.on_progress(job)
+
+    def state(self) -> dict[str, Any]:
+        return {"jobs": [asdict(job) for job in self.jobs], **self.stats()}
+
+    def stats(self):
+        counts = Counter(job.status for job in self.jobs)
+        return {
+            status: counts[status]
+            for status in ("pending", "running", "done", "failed")
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python batch.py")
+    parser.add_argument("inputs", nargs="+", help="input files or directories")
+    parser.add_argument("--output", default="generated/batch")
+    parser.add_argument(
+        "--time-limit", type=float, help="per input, unless it sets one"
+    )
+    parser.add_argument("--threads", type=int, help="per input, unless it sets one")
+    parser.add_argument("--max-threads", type=int, help="shared by all inputs")
+    parser.add_argument("--concurrency", type=int, help="inputs loaded at a time")
+    parser.add_argument("--retry-failed", action="store_true")
+    args = parser.parse_args()
+
+    def progress(job: BatchJob):
+        counts = batch.stats()
+        print(
+            f"[{counts['done'] + counts['failed']}/{len(batch.jobs)}] {job.name}: "
+            f"{job.status}, objective {job.objective}"
+            + (f", {job.error}" if job.error else "")
+        )
+
+    batch = Batch(
+        find_inputs(args.inputs),
+        args.output,
+        SolveBudget(time_limit=args.time_limit, threads=args.threads),
+        SolverPool(args.max_threads),
+        concurrency=args.concurrency,
+        retry_failed=args.retry_failed,
+        on_progress=progress,
+    )
+    asyncio.run(batch.run())
+    print(batch.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+from benchmark.generator import SCALES, GeneratorConfig, generate
+from benchmark.runner import BenchmarkResult, run_case
+
+__all__ = ["SCALES", "BenchmarkResult", "GeneratorConfig", "generate", "run_case"]
@@ -0,0 +1,105 @@
+import argparse
+import json
+import platform
+import subprocess
+from dataclasses import asdict, replace
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+from benchmark.generator import SCALES, generate
+from benchmark.runner import run_case
+from utils import create_file
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(old: dict[str, Any], new: dict[str, Any]):
+    """Prints the ratio new/old of every timing both runs have."""
+    previous = {(r["name"], r["backend"]): r for r in old["results"]}
+    for result in new["results"]:
+        base = previous.get((result["name"], result["backend"]))
+        if base is None:
+            continue
+        print(f"{result['name']} ({result['backend']})")
+        for key, value in result.items():
+            if key.endswith("_seconds") and value and base.get(key):
+                print(
+                    f"  {key:<26} {base[key]:10.4f} {value:10.4f} {value / base[key]:6.2f}x"
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmark")
+    parser.add_argument("--scale", nargs="+", choices=SCALES, default=["small"])
+    parser.add_argument("--backend", nargs="+", default=["minizinc"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sparsity", type=float, default=0.0)
+    parser.add_argument("--alternating-weeks", action="store_true")
+    parser.add_argument("--optimize-distance", action="store_true")
+    parser.add_argument("--teacher-distribution", action="store_true")
+    parser.add_argument(
+        "--pool-size", type=int, default=1, help="interchangeable teachers and rooms"
+    )
+    parser.add_argument("--symmetry-breaking", action="store_true")
+    parser.add_argument(
+        "--distance-encoding", choices=["element", "transition"], default="element"
+    )
+    parser.add_argument("--heuristic-start", action="store_true")
+    parser.add_argument("--time-limit", type=float, default=30)
+    parser.add_argument("--threads", type=int)
+    parser.add_argument("--output", default="benchmark/results")
+    parser.add_argument("--compare", help="earlier results file to compare with")
+    args = parser.parse_args()
+
+    results = []
+    for scale in args.scale:
+        config = replace(
+            SCALES[scale],
+            seed=args.seed,
+            sparsity=args.sparsity,
+            alternating_weeks=args.alternating_weeks,
+            optimize_distance=args.optimize_distance,
+            teacher_distribution=args.teacher_distribution,
+            pool_size=args.pool_size,
+            symmetry_breaking=args.symmetry_breaking,
+            distance_encoding=args.distance_encoding,
+            heuristic_start=args.heuristic_start,
+        )
+        if config.alternating_weeks:
+            config = replace(config, days=config.days * 2)
+        obj = generate(config)
+        for backend in args.backend:
+            print(f"Running {scale} on {backend}")
+            result = run_case(scale, obj, backend, args.time_limit, args.threads)
+            results.append(asdict(result))
+
+    report = {
+        "commit": commit(),
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "options": vars(args),
+        "results": results,
+    }
+    path = Path(args.output) / f"{report['commit']}.json"
+    with create_file(str(path)) as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {path}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import math
+import random
+from dataclasses import dataclass
+from typing import Any
+
+SUBJECT_NAMES = [
+    "Math",
+    "English",
+    "Science",
+    "History",
+    "Geography",
+    "Art",
+    "Music",
+    "PE",
+    "French",
+    "German",
+    "Biology",
+    "Chemistry",
+    "Physics",
+    "Computing",
+    "Religion",
+    "Economics",
+]
+
+
+@dataclass
+class GeneratorConfig:
+    """Size and shape of a synthetic school.
+
+    `load` is the share of each class's week that is filled with lessons and
+    `sparsity` the share of periods each teacher and room is unavailable.
+    With `pool_size` above 1, teachers and rooms come in pools of that size
+    that share availability and are always eligible together, which makes
+    them interchangeable.
+    """
+
+    classes: int = 10
+    teachers: int = 20
+    rooms: int = 12
+    days: int = 5
+    periods: int = 8
+    load: float = 0.75
+    sparsity: float = 0.0
+    shared: float = 0.1
+    alternating_weeks: bool = False
+    optimize_distance: bool = False
+    teacher_distribution: bool = False
+    pool_size: int = 1
+    symmetry_breaking: bool = False
+    distance_encoding: str = "element"
+    heuristic_start: bool = False
+    seed: int = 0
+
+
+SCALES = {
+    "tiny": GeneratorConfig(classes=3, teachers=6, rooms=4, days=5, periods=5),
+    "small": GeneratorConfig(classes=8, teachers=16, rooms=10, days=5, periods=6),
+    "medium": GeneratorConfig(classes=20, teachers=40, rooms=24, days=5, periods=8),
+    "large": GeneratorConfig(classes=50, teachers=90, rooms=55, days=5, periods=9),
+}
+
+
+def generate(config: GeneratorConfig) -> dict[str, Any]:
+    """Builds schedule input JSON for a synthetic school.
+
+    The same config and seed always give the same input. Lessons are spread so
+    that no teacher or room is asked for more periods than it has available,
+    which keeps most generated inputs feasible.
+    """
+    if config.alternating_weeks and config.days % 2:
+        raise ValueError("Alternating weeks need an even number of days")
+
+    rnd = random.Random(config.seed)
+    slots = [(d, p) for d in range(config.days) for p in range(config.periods)]
+
+    size = max(1, config.pool_size)
+
+    def availability(count: int):
+        entities: list[list[list[int]] | None] = []
+        for i in range(count):
+            if i % size:
+                # Pool members share the availability of the first member
+                entities.append(entities[-1])
+                continue
+            blocked = int(config.sparsity * len(slots))
+            # Keep every entity available on at least one period
+            blocked = min(blocked, len(slots) - 1)
+            if blocked == 0:
+                entities.append(None)
+                continue
+            free = sorted(rnd.sample(slots, len(slots) - blocked))
+            entities.append([[d, p] for d, p in free])
+        return entities
+
+    teacher_periods = availability(config.teachers)
+    room_periods = availability(config.rooms)
+    teacher_capacity = [
+        len(periods) if periods else len(slots) for periods in teacher_periods
+    ]
+    room_capacity = [
+        len(periods) if periods else len(slots) for periods in room_periods
+    ]
+
+    def pick(capacity: list[int], periods: int, extra: int):
+        # The entity with most capacity left teaches the lesson, a few others
+        # are eligible as well
+        order = sorted(range(len(capacity)), key=lambda i: (-capacity[i], rnd.random()))
+        primary = order[0]
+        capacity[primary] -= periods
+        others = rnd.sample(order[1:], min(extra, len(order) - 1))
+        if size == 1:
+            return sorted([primary, *others])
+        pools = {i // size for i in (primary, *others)}
+        return [i for i in range(len(capacity)) if i // size in pools]
+
+    # Lessons are given at most once per day
+    max_periods = config.days
+    subjects: list[dict[str, Any]] = []
+    courses: dict[str, list[int]] = {}
+    free = [int(config.load * len(slots)) for _ in range(config.classes)]
+
+    for c in range(config.classes):
+        names = rnd.sample(SUBJECT_NAMES, len(SUBJECT_NAMES))
+        for name in names:
+            if free[c] <= 0:
+                break
+            periods = min(rnd.randint(1, max_periods), free[c])
+            classes = [c]
+            # Some lessons are taught to two classes at once
+            partners = [o for o in range(c + 1, config.classes) if free[o] >= periods]
+            if partners and rnd.random() < config.shared:
+                classes.append(rnd.choice(partners))
+            for o in classes:
+                free[o] -= periods
+
+            courses.setdefault(name, []).append(len(subjects))
+            subjects.append(
+                {
+                    "classes": classes,
+                    "periods_per_week": periods,
+                    "teachers": pick(teacher_capacity, periods, rnd.randint(0, 2)),
+                    "teachers_per_period": 1,
+                    "available_rooms": pick(room_capacity, periods, rnd.randint(0, 2)),
+                    "rooms_per_period": 1,
+                    "name": f"{name} {'/'.join(str(o + 1) for o in classes)}",
+                    "course": list(courses).index(name),
+                }
+            )
+
+    course_list: list[dict[str, Any]] = []
+    for name, members in courses.items():
+        distribution = None
+        if config.teacher_distribution:
+            teachers = sorted({t for s in members for t in subjects[s]["teachers"]})
+            at_most = math.ceil(len(members) / len(teachers)) + 1
+            distribution = [
+                {"teacher": t, "at_least": 0, "at_most": at_most} for t in teachers
+            ]
+        course_list.append(
+            {"name": name, "subjects": members, "teacher_distribution": distribution}
+        )
+
+    # Rooms sit on the floors of one building, distance counts floors and doors
+    positions = [(rnd.randint(0, 3), rnd.randint(0, 20)) for _ in range(config.rooms)]
+    distances = [
+        [abs(fa - fb) * 10 + abs(da - db) for fb, db in positions]
+        for fa, da in positions
+    ]
+
+    return {
+        "config": {
+            "use_alternating_weeks": config.alternating_weeks,
+            "optimize_distance": config.optimize_distance,
+            "schedule_rooms": True,
+            "symmetry_breaking": config.symmetry_breaking,
+            "distance_encoding": config.distance_encoding,
+            "heuristic_start": config.heuristic_start,
+        },
+        "days": config.days,
+        "periods": config.periods,
+        "teachers": [
+            {"name": f"Teacher {t + 1}", "available_periods": periods}
+            for t, periods in enumerate(teacher_periods)
+        ],
+        "classes": [{"name": f"Class {c + 1}"} for c in range(config.classes)],
+        "rooms": [
+            {"name": f"Room {r + 1}", "available_periods": periods}
+            for r, periods in enumerate(room_periods)
+        ],
+        "room_distances": distances if config.optimize_distance else None,
+        "courses": course_list,
+        "subjects": subjects,
+    }
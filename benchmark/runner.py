@@ -0,0 +1,131 @@
+import asyncio
+import statistics
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+from data import ScheduleData
+from data_minizinc import minizinc_data
+from display_schedule import SaveSchedule
+from model_cache import ModelCache
+from schedule import SolutionEvent
+from schedule_stream import ScheduleStream
+from solvers import create_schedule
+
+
+@dataclass
+class BenchmarkResult:
+    """Timings of one input on one backend, in seconds.
+
+    Solution times are measured from the start of the solve call, so they
+    include the build. `build_seconds` covers data conversion and flattening
+    for MiniZinc and model construction for CP-SAT, `build_memory_bytes` how
+    much the benchmark process grew meanwhile. `solve_seconds` is the
+    whole run, it ends before the time limit when optimality is proven.
+    """
+
+    name: str
+    backend: str
+    size: dict[str, int]
+    parse_seconds: float
+    minizinc_data_seconds: float
+    build_seconds: float | None = None
+    build_memory_bytes: int | None = None
+    model_bytes: int | None = None
+    first_solution_seconds: float | None = None
+    best_solution_seconds: float | None = None
+    solve_seconds: float | None = None
+    best_objective: Any = None
+    num_solutions: int = 0
+    csv_seconds: float | None = None
+    sse: dict[str, dict[str, float]] = field(default_factory=dict)
+
+
+def timed(repeat: int, fn: Any, *args: Any):
+    """Median wall time of `repeat` calls, and the result of the last one."""
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def run_case(
+    name: str,
+    obj: dict[str, Any],
+    backend: str = "minizinc",
+    time_limit: float = 30,
+    threads: int | None = None,
+    repeat: int = 5,
+    min_events: int = 50,
+) -> BenchmarkResult:
+    obj = dict(
+        obj,
+        config=dict(obj["config"], backend=backend),
+        budget={"time_limit": time_limit, "threads": threads, "random_seed": 0},
+    )
+
+    parse_seconds, data = timed(repeat, ScheduleData, obj)
+    convert_seconds, _ = timed(repeat, minizinc_data, data)
+    result = BenchmarkResult(
+        name,
+        backend,
+        {
+            "classes": data.num_classes,
+            "teachers": data.num_teachers,
+            "rooms": data.num_rooms,
+            "subjects": data.num_subjects,
+            "days": data.num_days,
+            "periods": data.num_periods,
+        },
+        parse_seconds,
+        convert_seconds,
+    )
+
+    events: list[tuple[float, SolutionEvent]] = []
+    with tempfile.TemporaryDirectory() as directory:
+        # An empty cache, so every run measures a cold flatten
+        schedule = create_schedule(data, cache=ModelCache(directory))
+        start = time.perf_counter()
+
+        def callback(event: SolutionEvent | None):
+            if event is not None:
+                events.append((time.perf_counter() - start, event))
+
+        asyncio.run(schedule.iterate_solutions(callback, threads))
+        result.solve_seconds = time.perf_counter() - start
+
+    build_stats = getattr(schedule, "build_stats", {})
+    result.build_seconds = build_stats.get("build_seconds")
+    result.build_memory_bytes = build_stats.get("build_memory_bytes")
+    result.model_bytes = build_stats.get("model_bytes")
+    result.num_solutions = len(events)
+    if not events:
+        return result
+
+    result.first_solution_seconds = events[0][0]
+    result.best_solution_seconds, best = events[-1]
+    result.best_objective = best.objective
+
+    result.csv_seconds, _ = timed(
+        repeat, lambda: SaveSchedule(data, best.variables).schedule_csv()
+    )
+
+    solutions = [event.variables for _, event in events]
+    for mode in ("full", "delta"):
+        stream = ScheduleStream(mode)
+        count = max(min_events, len(solutions))
+        size = 0
+        start = time.perf_counter()
+        for i in range(count):
+            size += len(stream.event(SaveSchedule(data, solutions[i % len(solutions)])))
+        seconds = time.perf_counter() - start
+        result.sse[mode] = {
+            "events_per_second": count / seconds,
+            "bytes_per_event": size / count,
+        }
+
+    return result
@@ -0,0 +1,373 @@
+import json
+import struct
+from dataclasses import asdict, dataclass
+from typing import Any
+
+import numpy as np
+from numpy.typing import ArrayLike, NDArray
+
+from data import (
+    ClassData,
+    CourseData,
+    RoomData,
+    ScheduleConfig,
+    ScheduleData,
+    SolveBudget,
+    SubjectData,
+    TeacherData,
+    TeacherDistributionItem,
+)
+
+MAGIC = b"SCHB"
+VERSION = 1
+# Magic, format version, length of the JSON header that follows
+HEADER = struct.Struct("<4sHxxI")
+ALIGNMENT = 8
+
+
+class FormatError(ValueError):
+    pass
+
+
+@dataclass
+class Container:
+    """Decoded file: a JSON header and arrays viewing the original buffer.
+
+    Plain arrays are zero-copy views, so a memory-mapped file is only read
+    when its arrays are used. Bit-packed arrays are unpacked on access.
+    """
+
+    kind: str
+    meta: dict[str, Any]
+    sections: dict[str, dict[str, Any]]
+    buffer: Any
+
+    def __contains__(self, name: str):
+        return name in self.sections
+
+    def array(self, name: str) -> NDArray[Any]:
+        section = self.sections[name]
+        shape = tuple(section["shape"])
+        if section["bits"]:
+            packed = np.frombuffer(
+                self.buffer, np.uint8, section["nbytes"], section["offset"]
+            )
+            count = int(np.prod(shape))
+            bits = np.unpackbits(packed, count=count).reshape(shape)
+            return bits.astype(section["dtype"], copy=False)
+        dtype = np.dtype(section["dtype"])
+        count = section["nbytes"] // dtype.itemsize
+        return np.frombuffer(self.buffer, dtype, count, section["offset"]).reshape(
+            shape
+        )
+
+    def lists(self, name: str) -> list[list[int]]:
+        """Rows of a sparse index list stored with `sparse()`."""
+        offsets = self.array(f"{name}.offsets")
+        indices = self.array(f"{name}.indices").tolist()
+        return [indices[a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+
+
+def encode(
+    kind: str, meta: dict[str, Any], arrays: dict[str, ArrayLike], bits: set[str]
+) -> bytes:
+    """Packs arrays into one buffer, bit-packing the arrays named in `bits`."""
+    sections: dict[str, dict[str, Any]] = {}
+    blobs: list[bytes] = []
+    offset = 0
+    for name, value in arrays.items():
+        array = np.ascontiguousarray(value)
+        if name in bits:
+            blob = np.packbits(array.astype(np.bool_, copy=False).ravel()).tobytes()
+        else:
+            blob = array.tobytes()
+        sections[name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "bits": name in bits,
+            "offset": offset,
+            "nbytes": len(blob),
+        }
+        padding = -len(blob) % ALIGNMENT
+        blobs.append(blob + b"\0" * padding)
+        offset += len(blob) + padding
+
+    header = json.dumps(
+        {"kind": kind, "meta": meta, "sections": sections}, separators=(",", ":")
+    ).encode()
+    # Section offsets count from the end of the header, which is padded so
+    # that every array stays aligned
+    header += b" " * (-(HEADER.size + len(header)) % ALIGNMENT)
+    return b"".join([HEADER.pack(MAGIC, VERSION, len(header)), header, *blobs])
+
+
+def decode(buffer: Any, kind: str | None = None) -> Container:
+    """Reads a buffer from `encode`, e.g. bytes or an mmap, without copying."""
+    view = memoryview(buffer)
+    if len(view) < HEADER.size:
+        raise FormatError("Buffer is too short")
+    magic, version, length = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise FormatError("Not a schedule binary file")
+    if version > VERSION:
+        raise FormatError(f"Unsupported format version {version}")
+    header = json.loads(bytes(view[HEADER.size : HEADER.size + length]))
+    if kind is not None and header["kind"] != kind:
+        raise FormatError(f"Expected {kind}, got {header['kind']}")
+    start = HEADER.size + length
+    for section in header["sections"].values():
+        section["offset"] += start
+    return Container(header["kind"], header["meta"], header["sections"], buffer)
+
+
+def sparse(name: str, rows: list[list[int]]) -> dict[str, NDArray[Any]]:
+    """Stores variable length index lists as offsets into one index array."""
+    offsets = np.zeros(len(rows) + 1, dtype=np.uint32)
+    offsets[1:] = np.cumsum([len(row) for row in rows])
+    indices = np.fromiter(
+        (i for row in rows for i in row), dtype=np.uint32, count=int(offsets[-1])
+    )
+    return {f"{name}.offsets": offsets, f"{name}.indices": indices}
+
+
+def dump_schedule_data(data: ScheduleData) -> bytes:
+    # Names are interned, repeated names are stored once
+    table: dict[str, int] = {}
+
+    def names(entities: list[Any]):
+        return np.array(
+            [table.setdefault(e.name, len(table)) for e in entities], dtype=np.uint32
+        )
+
+    arrays: dict[str, ArrayLike] = {
+        "teachers.name": names(data.teachers_data),
+        "classes.name": names(data.classes_data),
+        "rooms.name": names(data.rooms_data),
+        "courses.name": names(data.courses_data),
+        "subjects.name": names(data.subjects_data),
+    }
+    encoded = [name.encode() for name in table]
+    arrays["names.offsets"] = np.concatenate(
+        [[0], np.cumsum([len(name) for name in encoded])]
+    ).astype(np.uint32)
+    arrays["names.bytes"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+    subjects = data.subjects_data
+    for field in ("periods_per_week", "teachers_per_period", "rooms_per_period"):
+        arrays[f"subjects.{field}"] = np.array(
+            [getattr(s, field) for s in subjects], dtype=np.int32
+        )
+    arrays["subjects.course"] = np.array(
+        [-1 if s.course is None else s.course for s in subjects], dtype=np.int32
+    )
+    arrays.update(sparse("subjects.classes", [s.classes for s in subjects]))
+    arrays.update(sparse("subjects.teachers", [s.teachers for s in subjects]))
+    arrays.update(sparse("subjects.rooms", [s.available_rooms for s in subjects]))
+
+    courses = data.courses_data
+    arrays.update(sparse("courses.subjects", [q.subjects for q in courses]))
+    arrays["courses.has_distribution"] = np.array(
+        [q.teacher_distribution is not None for q in courses], dtype=np.bool_
+    )
+    distribution = [
+        [
+            v
+            for td in q.teacher_distribution or []
+            for v in (td.teacher, td.at_least, td.at_most)
+        ]
+        for q in courses
+    ]
+    arrays.update(sparse("courses.distribution", distribution))
+
+    arrays["subjects.available"] = data.subjects_available
+    arrays["teachers.available"] = data.teachers_available
+    arrays["rooms.available"] = data.rooms_available
+    if data.room_distances is not None:
+        arrays["room_distances"] = smallest(np.array(data.room_distances))
+
+    meta = {
+        "config": asdict(data.config),
+        "budget": asdict(data.budget),
+        "days": data.num_days,
+        "periods": data.num_periods,
+    }
+    bits = {
+        "subjects.available",
+        "teachers.available",
+        "rooms.available",
+        "courses.has_distribution",
+    }
+    return encode("schedule_data", meta, arrays, bits)
+
+
+def load_schedule_data(buffer: Any) -> ScheduleData:
+    container = decode(buffer, "schedule_data")
+    meta = container.meta
+
+    offsets = container.array("names.offsets").tolist()
+    blob = container.array("names.bytes").tobytes()
+    table = [blob[a:b].decode() for a, b in zip(offsets[:-1], offsets[1:])]
+
+    def names(kind: str):
+        return [table[i] for i in container.array(f"{kind}.name").tolist()]
+
+    courses = [
+        CourseData(
+            name=name,
+            teacher_distribution=(
+                [
+                    TeacherDistributionItem(*values[i : i + 3])
+                    for i in range(0, len(values), 3)
+                ]
+                if has_distribution
+                else None
+            ),
+            subjects=subjects,
+        )
+        for name, subjects, values, has_distribution in zip(
+            names("courses"),
+            container.lists("courses.subjects"),
+            container.lists("courses.distribution"),
+            container.array("courses.has_distribution").tolist(),
+        )
+    ]
+    subjects = [
+        SubjectData(
+            classes=classes,
+            periods_per_week=ppw,
+            teachers=teachers,
+            teachers_per_period=tpp,
+            available_rooms=rooms,
+            rooms_per_period=rpp,
+            name=name,
+            available_periods=None,
+            course=None if course < 0 else course,
+        )
+        for name, classes, teachers, rooms, ppw, tpp, rpp, course in zip(
+            names("subjects"),
+            container.lists("subjects.classes"),
+            container.lists("subjects.teachers"),
+            container.lists("subjects.rooms"),
+            container.array("subjects.periods_per_week").tolist(),
+            container.array("subjects.teachers_per_period").tolist(),
+            container.array("subjects.rooms_per_period").tolist(),
+            container.array("subjects.course").tolist(),
+        )
+    ]
+
+    return ScheduleData.from_parts(
+        config=ScheduleConfig(**meta["config"]),
+        budget=SolveBudget(**meta["budget"]),
+        num_days=meta["days"],
+        num_periods=meta["periods"],
+        subjects_data=subjects,
+        teachers_data=[TeacherData(n, None) for n in names("teachers")],
+        classes_data=[ClassData(n) for n in names("classes")],
+        rooms_data=[RoomData(n, None) for n in names("rooms")],
+        courses_data=courses,
+        room_distances=(
+            container.array("room_distances").tolist()
+            if "room_distances" in container
+            else None
+        ),
+        subjects_available=container.array("subjects.available"),
+        teachers_available=container.array("teachers.available"),
+        rooms_available=container.array("rooms.available"),
+    )
+
+
+def dump_solution(variables: dict[str, Any], objective: Any = None) -> bytes:
+    """Packs solver variables, 0/1 arrays such as the schedule cube as bits."""
+    arrays: dict[str, NDArray[Any]] = {}
+    bits: set[str] = set()
+    values: dict[str, Any] = {}
+    for name, value in variables.items():
+        array = integer_array(value)
+        if array is None:
+            # Scalars and anything that is not a regular integer array
+            values[name] = value
+            continue
+        if array.size and ((array == 0) | (array == 1)).all():
+            bits.add(name)
+        arrays[name] = smallest(array)
+    return encode("solution", {"objective": objective, "values": values}, arrays, bits)
+
+
+def load_solution(buffer: Any) -> tuple[dict[str, Any], Any]:
+    """Returns the variables as nested lists, like the JSON output, and objective."""
+    container = decode(buffer, "solution")
+    variables = dict(container.meta["values"])
+    for name in container.sections:
+        variables[name] = container.array(name).tolist()
+    return variables, container.meta["objective"]
+
+
+def dump_cells(meta: dict[str, Any], cells: dict[tuple[int, int, int], Any]) -> bytes:
+    """Packs rendered (class, day, period) cells, cell texts are interned.
+
+    Cells hold a text and optionally a distance, missing distances are -1.
+    """
+    keys = sorted(cells)
+    texts: dict[str, int] = {}
+    text = [texts.setdefault(cells[key][0], len(texts)) for key in keys]
+    distance = [cells[key][1] if len(cells[key]) > 1 else -1 for key in keys]
+    arrays = {
+        "cells.key": smallest(np.array(keys, dtype=np.int64).reshape(-1, 3)),
+        "cells.text": smallest(np.array(text, dtype=np.int64)),
+        "cells.distance": smallest(np.array(distance, dtype=np.int64)),
+    }
+    return encode("cells", {**meta, "texts": list(texts)}, arrays, set())
+
+
+def load_cells(buffer: Any) -> tuple[dict[str, Any], dict[tuple[int, int, int], Any]]:
+    container = decode(buffer, "cells")
+    meta = dict(container.meta)
+    texts = meta.pop("texts")
+    cells: dict[tuple[int, int, int], Any] = {}
+    for key, text, distance in zip(
+        container.array("cells.key").tolist(),
+        container.array("cells.text").tolist(),
+        container.array("cells.distance").tolist(),
+    ):
+        cells[tuple(key)] = (texts[text],) if distance < 0 else (texts[text], distance)
+    return meta, cells
+
+
+def update_digest(digest: Any, data: dict[str, Any]):
+    """Feeds `data` to a hashlib digest, hashing regular arrays as raw bytes.
+
+    Much faster than hashing the JSON text of large nested lists.
+    """
+    for name in sorted(data):
+        value = data[name]
+        digest.update(f"{name}\0".encode())
+        array = integer_array(value)
+        if array is not None:
+            digest.update(f"{array.dtype.str}{array.shape}\0".encode())
+            digest.update(np.ascontiguousarray(array).tobytes())
+        else:
+            digest.update(json.dumps(value, sort_keys=True).encode())
+
+
+def smallest(array: NDArray[Any]) -> NDArray[Any]:
+    """Casts an integer array to the narrowest type that holds its values."""
+    if not array.size or array.dtype == np.bool_:
+        return array
+    low, high = int(array.min()), int(array.max())
+    for dtype in (np.int8, np.int16, np.int32, np.int64):
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return array.astype(dtype, copy=False)
+    return array
+
+
+def integer_array(value: Any) -> NDArray[Any] | None:
+    """`value` as an array if it is a regular nested list of integers."""
+    if not isinstance(value, (list, np.ndarray)):
+        return None
+    try:
+        array = np.asarray(value)
+    except ValueError:
+        # Ragged lists
+        return None
+    return array if array.dtype.kind in "biu" else None
@@ -1,7 +1,9 @@
-from dataclasses import asdict, dataclass, is_dataclass
-from itertools import product
+from dataclasses import Field, asdict, dataclass, field, fields, is_dataclass
 from typing import Any
 
+import numpy as np
+from numpy.typing import NDArray
+
 
 @dataclass
 class SubjectData:
@@ -12,14 +14,14 @@ class SubjectData:
     available_rooms: list[int]
     rooms_per_period: int
     name: str
-    available_periods: list[list[int]]
+    available_periods: list[list[int]] | None
     course: int | None
 
 
 @dataclass
 class TeacherData:
     name: str
-    available_periods: list[list[int]]
+    available_periods: list[list[int]] | None
 
 
 @dataclass
@@ -30,7 +32,7 @@ class ClassData:
 @dataclass
 class RoomData:
     name: str
-    available_periods: list[list[int]]
+    available_periods: list[list[int]] | None
 
 
 @dataclass
@@ -52,17 +54,170 @@ class ScheduleConfig:
     use_alternating_weeks: bool = False
     optimize_distance: bool = False
     schedule_rooms: bool = True
+    presolve: bool = True
+    decompose: bool = False
+    # The solving strategies of solvers.BACKENDS
+    backend: str = field(
+        default="minizinc",
+        metadata={"choices": ("minizinc", "cp-sat", "portfolio")},
+    )
+    symmetry_breaking: bool = False
+    distance_encoding: str = field(
+        default="element", metadata={"choices": ("element", "transition")}
+    )
+    heuristic_start: bool = False
+
+    def __post_init__(self):
+        check_options(self)
+
+
+@dataclass
+class SolveBudget:
+    time_limit: float | None = field(default=None, metadata={"above": 0})
+    threads: int | None = field(default=None, metadata={"minimum": 1})
+    random_seed: int | None = None
+    max_solutions: int | None = field(default=None, metadata={"minimum": 1})
+    no_improvement_timeout: float | None = field(default=None, metadata={"above": 0})
+    relative_gap: float | None = field(default=None, metadata={"minimum": 0})
+
+    def __post_init__(self):
+        check_options(self)
+
+
+def option_problem(option: Field[Any], value: Any) -> str | None:
+    """Why `value` is not allowed for an options field, None if it is."""
+    if value is None:
+        return None
+    choices = option.metadata.get("choices")
+    if choices is not None and value not in choices:
+        return f"expected one of {', '.join(choices)}"
+    minimum = option.metadata.get("minimum")
+    if minimum is not None and value < minimum:
+        return f"{value} is out of range, expected at least {minimum}"
+    above = option.metadata.get("above")
+    if above is not None and value <= above:
+        return f"{value} is out of range, expected more than {above}"
+    return None
+
+
+def check_options(obj: Any):
+    for option in fields(obj):
+        problem = option_problem(option, getattr(obj, option.name))
+        if problem is not None:
+            raise ValueError(f"{option.name}: {problem}")
+
+
+@dataclass
+class SubsetIndex:
+    """Global indices of the entities kept in a subset, by local index."""
+
+    subjects: list[int]
+    classes: list[int]
+    teachers: list[int]
+    rooms: list[int]
 
 
 class ScheduleData:
     def __init__(self, data: Any):
-        self.num_days: int = data["days"]
-        self.num_periods: int = data["periods"]
-        self.num_teachers: int = len(data["teachers"])
-        self.num_classes: int = len(data["classes"])
-        self.num_rooms: int = len(data["rooms"])
-        self.num_subjects = len(data["subjects"])
-        self.num_courses = len(data["courses"])
+        self.setup(
+            config=ScheduleConfig(**data["config"]),
+            budget=SolveBudget(**(data.get("budget") or {})),
+            num_days=data["days"],
+            num_periods=data["periods"],
+            subjects_data=[
+                SubjectData(
+                    classes=s["classes"],
+                    periods_per_week=s["periods_per_week"],
+                    teachers=s["teachers"],
+                    teachers_per_period=s["teachers_per_period"],
+                    available_rooms=s["available_rooms"],
+                    rooms_per_period=s["rooms_per_period"],
+                    name=s["name"],
+                    available_periods=s.get("available_periods"),
+                    course=s.get("course", None),
+                )
+                for s in data["subjects"]
+            ],
+            teachers_data=[
+                TeacherData(
+                    name=t["name"],
+                    available_periods=t.get("available_periods"),
+                )
+                for t in data["teachers"]
+            ],
+            classes_data=[ClassData(name=c["name"]) for c in data["classes"]],
+            rooms_data=[
+                RoomData(
+                    name=r["name"],
+                    available_periods=r.get("available_periods"),
+                )
+                for r in data["rooms"]
+            ],
+            courses_data=[
+                CourseData(
+                    name=q["name"],
+                    teacher_distribution=self.parse_teacher_distribution(
+                        q.get("teacher_distribution", None)
+                    ),
+                    subjects=q["subjects"],
+                )
+                for q in data["courses"]
+            ],
+            room_distances=data.get("room_distances"),
+        )
+
+        # Availability cubes indexed [entity, day, period]
+        self.subjects_available = self.parse_available_periods(
+            [s.available_periods for s in self.subjects_data]
+        )
+        self.teachers_available = self.parse_available_periods(
+            [t.available_periods for t in self.teachers_data]
+        )
+        self.rooms_available = self.parse_available_periods(
+            [r.available_periods for r in self.rooms_data]
+        )
+
+    @classmethod
+    def from_parts(
+        cls,
+        *,
+        subjects_available: NDArray[np.bool_],
+        teachers_available: NDArray[np.bool_],
+        rooms_available: NDArray[np.bool_],
+        **parts: Any,
+    ) -> "ScheduleData":
+        """Builds schedule data from parsed entities and availability cubes.
+
+        The cubes are authoritative, `available_periods` of the entities may be
+        left as None.
+        """
+        data = cls.__new__(cls)
+        data.setup(**parts)
+        data.subjects_available = subjects_available
+        data.teachers_available = teachers_available
+        data.rooms_available = rooms_available
+        return data
+
+    def setup(
+        self,
+        config: ScheduleConfig,
+        budget: SolveBudget,
+        num_days: int,
+        num_periods: int,
+        subjects_data: list[SubjectData],
+        teachers_data: list[TeacherData],
+        classes_data: list[ClassData],
+        rooms_data: list[RoomData],
+        courses_data: list[CourseData],
+        room_distances: list[list[int]] | None,
+    ):
+        self.num_days = num_days
+        self.num_periods = num_periods
+        self.num_teachers = len(teachers_data)
+        self.num_classes = len(classes_data)
+        self.num_rooms = len(rooms_data)
+        self.num_subjects = len(subjects_data)
+        self.num_courses = len(courses_data)
 
         self.days = range(self.num_days)
         self.periods = range(self.num_periods)
@@ -71,56 +226,31 @@ class ScheduleData:
         self.rooms = range(self.num_rooms)
         self.subjects = range(self.num_subjects)
 
-        self.config = ScheduleConfig(**data["config"])
-
-        self.subjects_data = [
-            SubjectData(
-                classes=s["classes"],
-                periods_per_week=s["periods_per_week"],
-                teachers=s["teachers"],
-                teachers_per_period=s["teachers_per_period"],
-                available_rooms=s["available_rooms"],
-                rooms_per_period=s["rooms_per_period"],
-                name=s["name"],
-                available_periods=s.get("available_periods")
-                or self.default_available_periods(),
-                course=s.get("course", None),
-            )
-            for s in data["subjects"]
-        ]
-        self.teachers_data = [
-            TeacherData(
-                name=t["name"],
-                available_periods=t.get("available_periods")
-                or self.default_available_periods(),
-            )
-            for t in data["teachers"]
-        ]
-        self.classes_data = [ClassData(name=c["name"]) for c in data["classes"]]
-        self.rooms_data = [
-            RoomData(
-                name=r["name"],
-                available_periods=r.get("available_periods")
-                or self.default_available_periods(),
-            )
-            for r in data["rooms"]
-        ]
+        self.config = config
+        self.budget = budget
 
-        self.courses_data = [
-            CourseData(
-                name=q["name"],
-                teacher_distribution=self.parse_teacher_distribution(
-                    q.get("teacher_distribution", None)
-                ),
-                subjects=q["subjects"],
-            )
-            for q in data["courses"]
-        ]
+        self.subjects_data = subjects_data
+        self.teachers_data = teachers_data
+        self.classes_data = classes_data
+        self.rooms_data = rooms_data
+        self.courses_data = courses_data
 
-        self.room_distances: list[list[int]] | None = data.get("room_distances")
+        self.room_distances = room_distances
 
-    def default_available_periods(self):
-        return [list(p) for p in product(self.days, self.periods)]
+    def parse_available_periods(
+        self, entities: list[list[list[int]] | None]
+    ) -> NDArray[np.bool_]:
+        available = np.ones(
+            (len(entities), self.num_days, self.num_periods), dtype=np.bool_
+        )
+        for i, periods in enumerate(entities):
+            # Missing or empty availability means available everywhere
+            if not periods:
+                continue
+            available[i] = False
+            index = np.asarray(periods, dtype=np.intp).reshape(-1, 2)
+            available[i, index[:, 0], index[:, 1]] = True
+        return available
 
     def parse_teacher_distribution(self, distribution: Any):
         if distribution is None:
@@ -130,10 +260,111 @@ class ScheduleData:
             for td in distribution
         ]
 
+    def components(self) -> list[list[int]]:
+        """Groups subjects that can be solved independently of each other.
+
+        Two subjects are connected when they share a class, an eligible teacher,
+        an eligible room or a course with a teacher distribution.
+        """
+        parent = list(self.subjects)
+
+        def find(s: int):
+            while parent[s] != s:
+                parent[s] = parent[parent[s]]
+                s = parent[s]
+            return s
+
+        def union(groups: dict[Any, int], key: Any, s: int):
+            if key in groups:
+                parent[find(s)] = find(groups[key])
+            else:
+                groups[key] = s
+
+        groups: dict[Any, int] = {}
+        for s, subject in enumerate(self.subjects_data):
+            for c in subject.classes:
+                union(groups, ("class", c), s)
+            for t in subject.teachers:
+                union(groups, ("teacher", t), s)
+            if self.config.schedule_rooms:
+                for r in subject.available_rooms:
+                    union(groups, ("room", r), s)
+        for q, course in enumerate(self.courses_data):
+            if course.teacher_distribution is not None:
+                for s in course.subjects:
+                    union(groups, ("course", q), s)
+
+        components: dict[int, list[int]] = {}
+        for s in self.subjects:
+            components.setdefault(find(s), []).append(s)
+        return list(components.values())
+
+    def subset(self, subjects: list[int]) -> tuple["ScheduleData", SubsetIndex]:
+        """Builds the instance made of `subjects` and the entities they use."""
+        courses = [
+            q
+            for q, course in enumerate(self.courses_data)
+            if set(course.subjects) & set(subjects)
+        ]
+        classes = sorted({c for s in subjects for c in self.subjects_data[s].classes})
+        teachers = sorted(
+            {t for s in subjects for t in self.subjects_data[s].teachers}
+            | {
+                td.teacher
+                for q in courses
+                for td in self.courses_data[q].teacher_distribution or []
+            }
+        )
+        rooms = sorted(
+            {r for s in subjects for r in self.subjects_data[s].available_rooms}
+        )
+
+        subject_map = {s: i for i, s in enumerate(subjects)}
+        class_map = {c: i for i, c in enumerate(classes)}
+        teacher_map = {t: i for i, t in enumerate(teachers)}
+        room_map = {r: i for i, r in enumerate(rooms)}
+        course_map = {q: i for i, q in enumerate(courses)}
+
+        obj = self.to_json_object()
+        subjects_obj = []
+        for s in subjects:
+            subject = obj["subjects"][s]
+            subject["classes"] = [class_map[c] for c in subject["classes"]]
+            subject["teachers"] = [teacher_map[t] for t in subject["teachers"]]
+            subject["available_rooms"] = [
+                room_map[r] for r in subject["available_rooms"]
+            ]
+            subject["course"] = course_map.get(subject["course"])
+            subjects_obj.append(subject)
+        courses_obj = []
+        for q in courses:
+            course = obj["courses"][q]
+            course["subjects"] = [
+                subject_map[s] for s in course["subjects"] if s in subject_map
+            ]
+            for td in course["teacher_distribution"] or []:
+                td["teacher"] = teacher_map[td["teacher"]]
+            courses_obj.append(course)
+
+        obj.update(
+            subjects=subjects_obj,
+            courses=courses_obj,
+            classes=[obj["classes"][c] for c in classes],
+            teachers=[obj["teachers"][t] for t in teachers],
+            rooms=[obj["rooms"][r] for r in rooms],
+            room_distances=(
+                [[self.room_distances[a][b] for b in rooms] for a in rooms]
+                if self.room_distances is not None
+                else None
+            ),
+        )
+        return ScheduleData(obj), SubsetIndex(subjects, classes, teachers, rooms)
+
     def to_json_object(self):
-        return to_json_compatible(
+        obj = to_json_compatible(
             {
                 "config": self.config,
+                "budget": self.budget,
                 "days": self.num_days,
                 "periods": self.num_periods,
                 "teachers": self.teachers_data,
@@ -144,6 +375,18 @@ class ScheduleData:
                 "subjects": self.subjects_data,
             }
         )
+        # Written from the cubes, which hold availability even when the entities
+        # were parsed without their period lists
+        for key, available in (
+            ("subjects", self.subjects_available),
+            ("teachers", self.teachers_available),
+            ("rooms", self.rooms_available),
+        ):
+            for entity, periods in zip(obj[key], available):
+                entity["available_periods"] = (
+                    None if periods.all() else np.argwhere(periods).tolist()
+                )
+        return obj
 
 
 def to_json_compatible(data: Any) -> Any:
@@ -1,11 +1,25 @@
+from dataclasses import dataclass
 from typing import Any, TypeVar
 
+import numpy as np
+from numpy.typing import NDArray
+
 from data import CourseData, ScheduleData
+from symmetry import Symmetries, find_symmetries, pairs
 
 T = TypeVar("T")
 
 
-def minizinc_data(data: ScheduleData) -> dict[str, Any]:
+def minizinc_data(
+    data: ScheduleData,
+    previous: tuple[ScheduleData, dict[str, Any]] | None = None,
+) -> dict[str, Any]:
+    domains = presolve(data) if data.config.presolve else Domains.initial(data)
+    symmetries = symmetries_for(data, domains, previous)
+    teacher_pairs = pairs(symmetries.teachers)
+    room_pairs = pairs(symmetries.rooms)
+    day_pairs = pairs(symmetries.days)
+    base, once = base_week(data, domains)
     return {
         "do_schedule_rooms": data.config.schedule_rooms,
         "optimize_distances": data.config.optimize_distance,
@@ -28,40 +42,28 @@ def minizinc_data(data: ScheduleData) -> dict[str, Any]:
                     "teachers": json_set(s.teachers),
                     "rooms_per_period": s.rooms_per_period,
                     "rooms": json_set(s.available_rooms),
-                    "available_periods": [
-                        [[d, p] in s.available_periods for p in data.periods]
-                        for d in data.days
-                    ],
                     "course": s.course,
                 }
                 for s in data.subjects_data
             ],
             "subjects__",
         ),
-        **pivot_to_lists(
-            [
-                {
-                    "available_periods": [
-                        [[d, p] in t.available_periods for p in data.periods]
-                        for d in data.days
-                    ],
-                }
-                for t in data.teachers_data
-            ],
-            "teachers__",
-        ),
-        **pivot_to_lists(
-            [
-                {
-                    "available_periods": [
-                        [[d, p] in r.available_periods for p in data.periods]
-                        for d in data.days
-                    ],
-                }
-                for r in data.rooms_data
-            ],
-            "rooms__",
-        ),
+        "subjects__available_periods": data.subjects_available.tolist(),
+        "teachers__available_periods": data.teachers_available.tolist(),
+        "rooms__available_periods": data.rooms_available.tolist(),
+        "subjects__feasible_periods": domains.periods.tolist(),
+        "subjects__feasible_teachers": domains.teachers.tolist(),
+        "subjects__feasible_rooms": domains.rooms.tolist(),
+        "subjects__feasible_base": base.tolist(),
+        "subjects__feasible_once": once.tolist(),
+        "teacher_pairs__first": teacher_pairs[0],
+        "teacher_pairs__second": teacher_pairs[1],
+        "room_pairs__first": room_pairs[0],
+        "room_pairs__second": room_pairs[1],
+        "day_pairs__first": day_pairs[0],
+        "day_pairs__second": day_pairs[1],
+        **transitions(data, domains),
+        **warm_start(data, previous),
         **pivot_to_lists(
             [course(q, data) for q in data.courses_data],
             "courses__",
@@ -69,6 +71,210 @@ def minizinc_data(data: ScheduleData) -> dict[str, Any]:
     }
 
 
+@dataclass
+class Domains:
+    """Where each subject may be scheduled and who or what may be assigned to it."""
+
+    periods: NDArray[np.bool_]
+    teachers: NDArray[np.bool_]
+    rooms: NDArray[np.bool_]
+
+    @classmethod
+    def initial(cls, data: ScheduleData):
+        teachers = np.zeros((data.num_subjects, data.num_teachers), dtype=np.bool_)
+        rooms = np.zeros((data.num_subjects, data.num_rooms), dtype=np.bool_)
+        for s, subject in enumerate(data.subjects_data):
+            teachers[s, subject.teachers] = True
+            if data.config.schedule_rooms:
+                rooms[s, subject.available_rooms] = True
+        return cls(data.subjects_available.copy(), teachers, rooms)
+
+
+def presolve(data: ScheduleData) -> Domains:
+    """Narrows the initial domains until no more values can be removed.
+
+    A teacher or room stays eligible for a subject only if it is free on enough
+    distinct days within the subject's slots. A slot stays open only if enough
+    eligible teachers and rooms are free in it.
+    """
+    domains = Domains.initial(data)
+    changed = True
+    while changed:
+        changed = False
+        for s, subject in enumerate(data.subjects_data):
+            slots = domains.periods[s]
+            candidates = [(domains.teachers[s], data.teachers_available)]
+            if data.config.schedule_rooms:
+                candidates.append((domains.rooms[s], data.rooms_available))
+
+            for eligible, available in candidates:
+                (index,) = np.nonzero(eligible)
+                free = available[index] & slots
+                days_free = free.any(axis=2).sum(axis=1)
+                keep = days_free >= subject.periods_per_week
+                if not keep.all():
+                    eligible[index[~keep]] = False
+                    changed = True
+
+            open_slots = slots & (
+                data.teachers_available[domains.teachers[s]].sum(axis=0)
+                >= subject.teachers_per_period
+            )
+            if data.config.schedule_rooms:
+                open_slots &= (
+                    data.rooms_available[domains.rooms[s]].sum(axis=0)
+                    >= subject.rooms_per_period
+                )
+            if data.config.use_alternating_weeks and subject.periods_per_week % 2 == 0:
+                # Even subjects repeat in both weeks, so both days must be open
+                half = data.num_days // 2
+                both = open_slots[:half] & open_slots[half : 2 * half]
+                open_slots[:half] = both
+                open_slots[half : 2 * half] = both
+            if (open_slots != slots).any():
+                domains.periods[s] = open_slots
+                changed = True
+
+    return domains
+
+
+def base_week(
+    data: ScheduleData, domains: Domains
+) -> tuple[NDArray[np.bool_], NDArray[np.bool_]]:
+    """Slots of the base week and of lessons taught in one week only.
+
+    Without alternating weeks the base week is the whole horizon. With them a
+    base slot repeats in both weeks, so it must be open in both, and only
+    subjects with an odd number of periods get one-week slots.
+    """
+    once = np.zeros_like(domains.periods)
+    if not data.config.use_alternating_weeks:
+        return domains.periods, once
+    half = data.num_days // 2
+    base = domains.periods[:, :half] & domains.periods[:, half : 2 * half]
+    odd = np.array([s.periods_per_week % 2 == 1 for s in data.subjects_data], bool)
+    once[odd, : 2 * half] = domains.periods[odd, : 2 * half]
+    return base, once
+
+
+def transitions(data: ScheduleData, domains: Domains) -> dict[str, Any]:
+    """Room changes each class can make between consecutive periods.
+
+    Used by the transition distance encoding. Only single-room subjects place a
+    class in a room. A pair of rooms is kept if the class has two such subjects
+    that can be scheduled back to back, one in each room, and the rooms are a
+    nonzero distance apart.
+    """
+    enabled = (
+        data.config.optimize_distance
+        and data.config.distance_encoding == "transition"
+        and data.room_distances is not None
+    )
+    result: dict[str, Any] = {
+        "use_transition_distances": bool(enabled),
+        "classes__room_subjects": [json_set() for _ in data.classes],
+        "classes__rooms": [json_set() for _ in data.classes],
+        "classes__first_transition": [1] * data.num_classes,
+        "classes__last_transition": [0] * data.num_classes,
+        "transitions__from": [],
+        "transitions__to": [],
+        "transitions__distance": [],
+    }
+    if not enabled:
+        return result
+
+    distances = np.asarray(data.room_distances)
+    slots = domains.periods.reshape(data.num_subjects, data.num_days, -1)
+    # follows[s1, s2] is true when s2 can be scheduled right after s1
+    before = slots[:, :, :-1].reshape(data.num_subjects, -1).astype(np.int64)
+    after = slots[:, :, 1:].reshape(data.num_subjects, -1).astype(np.int64)
+    follows = before @ after.T > 0
+    # A subject is taught at most once a day, so never follows itself
+    np.fill_diagonal(follows, False)
+
+    for c in data.classes:
+        subjects = [
+            s
+            for s, subject in enumerate(data.subjects_data)
+            if c in subject.classes and subject.rooms_per_period == 1
+        ]
+        rooms = domains.rooms[subjects].astype(np.int64)
+        moves = rooms.T @ follows[np.ix_(subjects, subjects)] @ rooms > 0
+        moves &= distances > 0
+
+        result["classes__room_subjects"][c] = json_set(subjects)
+        result["classes__rooms"][c] = json_set(
+            np.flatnonzero(rooms.any(axis=0)).tolist()
+        )
+        # 1-based positions in the MiniZinc transition arrays
+        result["classes__first_transition"][c] = len(result["transitions__from"]) + 1
+        for r1, r2 in np.argwhere(moves).tolist():
+            result["transitions__from"].append(r1)
+            result["transitions__to"].append(r2)
+            result["transitions__distance"].append(int(distances[r1, r2]))
+        result["classes__last_transition"][c] = len(result["transitions__from"])
+    return result
+
+
+def symmetries_for(
+    data: ScheduleData,
+    domains: Domains,
+    previous: tuple[ScheduleData, dict[str, Any]] | None,
+) -> Symmetries:
+    """Symmetries to break, none unless enabled in the config.
+
+    A previous solution makes entities distinguishable again, since changes
+    from it are counted, so warm starts keep the full search space.
+    """
+    if not data.config.symmetry_breaking or previous is not None:
+        return Symmetries.none()
+    return find_symmetries(data, domains.periods, domains.teachers, domains.rooms)
+
+
+def warm_start(
+    data: ScheduleData, previous: tuple[ScheduleData, dict[str, Any]] | None
+) -> dict[str, Any]:
+    """Aligns a previous solution to `data`, matching entities by name.
+
+    Subjects, teachers and rooms that are new in `data` start unassigned.
+    """
+    schedule = np.zeros((data.num_days, data.num_periods, data.num_subjects), int)
+    teachers = np.zeros((data.num_subjects, data.num_teachers), int)
+    rooms = np.zeros((data.num_subjects, data.num_rooms), int)
+
+    if previous is not None:
+        old, variables = previous
+        s_new, s_old = matching(data.subjects_data, old.subjects_data)
+        t_new, t_old = matching(data.teachers_data, old.teachers_data)
+        r_new, r_old = matching(data.rooms_data, old.rooms_data)
+        days = min(data.num_days, old.num_days)
+        periods = min(data.num_periods, old.num_periods)
+
+        old_schedule = np.asarray(variables["schedule_subjects"], dtype=int)
+        schedule[:days, :periods, s_new] = old_schedule[:days, :periods, s_old]
+        old_teachers = np.asarray(variables["teacher_assignments"], dtype=int)
+        teachers[np.ix_(s_new, t_new)] = old_teachers[np.ix_(s_old, t_old)]
+        if "room_assignments" in variables:
+            old_rooms = np.asarray(variables["room_assignments"], dtype=int)
+            rooms[np.ix_(s_new, r_new)] = old_rooms[np.ix_(s_old, r_old)]
+
+    return {
+        "use_warm_start": previous is not None,
+        "previous__schedule_subjects": schedule.tolist(),
+        "previous__teacher_assignments": teachers.tolist(),
+        "previous__room_assignments": rooms.tolist(),
+    }
+
+
+def matching(new: list[Any], old: list[Any]) -> tuple[list[int], list[int]]:
+    """Index pairs of entities with the same name in `new` and `old`."""
+    old_index: dict[str, int] = {}
+    for i, entity in enumerate(old):
+        old_index.setdefault(entity.name, i)
+    pairs = [(i, old_index[e.name]) for i, e in enumerate(new) if e.name in old_index]
+    return [i for i, _ in pairs], [j for _, j in pairs]
+
+
 def course(q: CourseData, data: ScheduleData) -> dict[str, Any]:
     at_least = [0] * data.num_teachers
     at_most = [0] * data.num_teachers
@@ -0,0 +1,190 @@
+import asyncio
+import time
+from concurrent.futures import Executor
+from dataclasses import replace
+from functools import partial
+from typing import Any
+
+import numpy as np
+
+from data import ScheduleData, SolveBudget, SubsetIndex
+from portfolio import ImprovingStream, PortfolioSchedule
+from schedule import Schedule, SolutionCallback, SolutionEvent
+from schedule_cpsat import CpSatSchedule
+from solver_pool import PositionCallback, SolverPool
+
+
+class DecomposedSchedule:
+    """Solves independent components of a schedule as separate instances.
+
+    Each component from `ScheduleData.components()` runs as its own solver
+    instance, at most as many at once as the job has threads. All components
+    are first solved to their first solution, so a merged solution for the
+    full input is streamed after one short wave. Only then are they optimized,
+    with what is left of the time limit shared between the waves, and each
+    improvement of any component is merged again.
+    """
+
+    def __init__(
+        self,
+        schedule_data: ScheduleData,
+        backend: (
+            type[Schedule] | type[CpSatSchedule] | type[PortfolioSchedule]
+        ) = Schedule,
+        **kwargs: Any,
+    ):
+        self.schedule_data = schedule_data
+        self.backend = backend
+        self.budget: SolveBudget = kwargs.pop("budget", None) or schedule_data.budget
+        self.previous: SolutionEvent | None = kwargs.get("previous")
+        # Data, index and solver arguments of each part
+        self.parts: list[tuple[ScheduleData, SubsetIndex, dict[str, Any]]] = []
+        dump_directory = kwargs.pop("dump_directory", None)
+        for i, subjects in enumerate(schedule_data.components()):
+            data, index = schedule_data.subset(subjects)
+            part_kwargs = dict(kwargs)
+            if dump_directory is not None:
+                # Keep the parts from overwriting each other's dumps
+                part_kwargs["dump_directory"] = f"{dump_directory}/part_{i}"
+            self.parts.append((data, index, part_kwargs))
+
+        self.solutions: list[SolutionEvent | None] = [None] * len(self.parts)
+        # Ranks merged solutions by the objective of the full input
+        self.ranking = ImprovingStream(schedule_data, self.previous, None)
+        self.task: asyncio.Task[None] | None = None
+
+    def solve(self, callback: SolutionCallback | None = None):
+        asyncio.run(self.iterate_solutions(callback))
+
+    async def solve_async(
+        self,
+        callback: SolutionCallback | None = None,
+        pool: SolverPool | None = None,
+        on_position: PositionCallback | None = None,
+    ):
+        if pool is None:
+            self.task = asyncio.create_task(self.iterate_solutions(callback))
+            return
+
+        self.task = asyncio.create_task(
+            pool.run(
+                lambda threads: self.iterate_solutions(
+                    callback, threads, pool.executor
+                ),
+                on_position,
+            )
+        )
+
+    async def iterate_solutions(
+        self,
+        callback: SolutionCallback | None = None,
+        processes: int | None = None,
+        executor: Executor | None = None,
+    ):
+        # No more parts run at once than there are threads in the allowance
+        allowance = processes or 8
+        running = max(1, min(allowance, len(self.parts)))
+        threads = allowance // running
+        slots = asyncio.Semaphore(running)
+        start = time.monotonic()
+
+        def improved(i: int, event: SolutionEvent):
+            self.solutions[i] = event
+            if callback is not None and all(self.solutions):
+                callback(self.merge())
+
+        # A part's solutions only count when they improve on its best so far
+        streams = [
+            ImprovingStream(data, self.previous, partial(improved, i))
+            for i, (data, _, _) in enumerate(self.parts)
+        ]
+
+        async def run_phase(budget: SolveBudget):
+            waiting = len(self.parts)
+
+            async def solve_part(i: int):
+                nonlocal waiting
+                data, _, kwargs = self.parts[i]
+                async with slots:
+                    waves, waiting = -(-waiting // running), waiting - 1
+                    part_budget = budget
+                    if budget.time_limit is not None:
+                        # Later waves get their share of the time that's left
+                        left = budget.time_limit - (time.monotonic() - start)
+                        if left <= 0:
+                            return
+                        part_budget = replace(budget, time_limit=left / waves)
+                    schedule = self.backend(data, budget=part_budget, **kwargs)
+                    await schedule.iterate_solutions(
+                        lambda event: event is not None and streams[i].offer(event),
+                        threads,
+                        executor,
+                    )
+
+            await asyncio.gather(*(solve_part(i) for i in range(len(self.parts))))
+
+        await run_phase(replace(self.budget, max_solutions=1))
+        if not all(self.solutions):
+            print("A component has no solution")
+        elif (
+            self.schedule_data.config.optimize_distance or self.previous is not None
+        ) and self.budget.max_solutions != 1:
+            await run_phase(self.budget)
+        if callback is not None:
+            callback(None)
+
+    async def cancel(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                print("Solver was cancelled.")
+
+    def merge(self) -> SolutionEvent:
+        data = self.schedule_data
+        schedule = np.zeros((data.num_days, data.num_periods, data.num_subjects), int)
+        teachers = np.zeros((data.num_subjects, data.num_teachers), int)
+        rooms = np.zeros((data.num_subjects, data.num_rooms), int)
+        distances: list[Any] = [
+            [[0] * max(0, data.num_periods - 1) for _ in data.days]
+            for _ in data.classes
+        ]
+        for event, (_, index, _) in zip(self.solutions, self.parts):
+            assert event is not None
+            variables = event.variables
+            schedule[:, :, index.subjects] = variables["schedule_subjects"]
+            teachers[np.ix_(index.subjects, index.teachers)] = variables[
+                "teacher_assignments"
+            ]
+            if index.rooms:
+                rooms[np.ix_(index.subjects, index.rooms)] = variables[
+                    "room_assignments"
+                ]
+            for local, c in enumerate(index.classes):
+                if "distances" in variables:
+                    distances[c] = variables["distances"][local]
+
+        variables = {
+            "schedule_subjects": schedule.tolist(),
+            "teacher_assignments": teachers.tolist(),
+            "room_assignments": rooms.tolist(),
+            "distances": distances,
+        }
+        return SolutionEvent(data, variables, self.objective(variables))
+
+    def objective(self, variables: dict[str, Any]) -> int:
+        """The model.mzn objective of a merged solution for the full input.
+
+        Parts scale their objectives by their own number of possible changes,
+        so the objective is recomputed from the merged variables instead.
+        """
+        data = self.schedule_data
+        distance, changes = self.ranking.rank(variables)
+        if not data.config.optimize_distance:
+            return changes
+        max_changes = 0
+        if self.previous is not None:
+            max_changes = data.num_days * data.num_periods * data.num_subjects
+            max_changes += data.num_subjects * (data.num_teachers + data.num_rooms)
+        return distance * (max_changes + 1) + changes
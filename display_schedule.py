@@ -1,10 +1,11 @@
 import csv
 import io
 import json
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Any, Counter
 
 from data import ScheduleData
+from solution_decoder import SolutionDecoder
 from utils import create_file
 
 
@@ -12,6 +13,11 @@ from utils import create_file
 class SaveSchedule:
     data: ScheduleData
     variables: dict[str, Any]
+    decoder: SolutionDecoder = field(init=False, repr=False)
+    texts: dict[int, str] = field(init=False, repr=False, default_factory=dict)
+
+    def __post_init__(self):
+        self.decoder = SolutionDecoder(self.data, self.variables)
 
     def save_teacher_assignments(self, path: str):
         with create_file(path) as f:
@@ -24,7 +30,7 @@ class SaveSchedule:
             json.dump(obj, f, ensure_ascii=False)
 
     def get_teachers_for_subject(self, s: int):
-        return [t for t in self.data.teachers if variables["teacher_assignments"][s][t]]
+        return self.get_teachers(s)
 
     def schedule_csv(self):
         f = io.StringIO()
@@ -87,12 +93,28 @@ class SaveSchedule:
 
         return f.getvalue()
 
+    def schedule_cells(self):
+        """Returns the filled (class, day, period) cells across the full horizon."""
+        cells: dict[tuple[int, int, int], tuple[Any, ...]] = {}
+        for c, d, p, s in self.decoder.filled_slots():
+            info = {"s": s, "t": self.get_teachers(s), "r": self.get_rooms(s)}
+            if self.data.config.optimize_distance and p != self.data.num_periods - 1:
+                cells[c, d, p] = (self.period_text(info), self.get_distance(c, d, p))
+            else:
+                cells[c, d, p] = (self.period_text(info),)
+        return cells
+
     def period_text(
         self,
         p: dict[str, Any],
     ):
         if p["s"] is None:
             return "-"
+        if p["s"] not in self.texts:
+            self.texts[p["s"]] = self.subject_text(p)
+        return self.texts[p["s"]]
+
+    def subject_text(self, p: dict[str, Any]):
         if self.data.config.schedule_rooms and p["r"] is not None:
             return f"""{self.data.subjects_data[p["s"]].name}
 {", ".join(self.data.teachers_data[t].name for t in p["t"])}
@@ -101,15 +123,7 @@ class SaveSchedule:
         return f'{self.data.subjects_data[p["s"]].name}\n{", ".join(self.data.teachers_data[t].name for t in p["t"])}'
 
     def get_period_info(self, c: int, d: int, p: int):
-        s = next(
-            (
-                s
-                for s in self.data.subjects
-                if c in self.data.subjects_data[s].classes
-                if self.variables["schedule_subjects"][d][p][s]
-            ),
-            None,
-        )
+        s = self.decoder.subject_at(c, d, p)
         if s is None:
             return {"s": None, "t": None, "r": None}
 
@@ -118,14 +132,10 @@ class SaveSchedule:
         return {"s": s, "t": t, "r": r}
 
     def get_teachers(self, s: int):
-        teachers = [
-            t for t in self.data.teachers if self.variables["teacher_assignments"][s][t]
-        ]
-        return teachers
+        return self.decoder.subject_teachers[s]
 
     def get_rooms(self, s: int):
-        rooms = [r for r in self.data.rooms if self.variables["room_assignments"][s][r]]
-        return rooms
+        return self.decoder.subject_rooms[s]
 
     def get_distance(self, c: int, d: int, p: int):
         distance = self.variables["distances"][c][d][p]
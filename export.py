@@ -0,0 +1,276 @@
+import asyncio
+import csv
+import io
+import json
+import re
+import zipfile
+from concurrent.futures import Executor
+from typing import IO, Any, Iterable, Iterator
+from xml.sax.saxutils import escape
+
+from data import ScheduleData
+from solution_decoder import SolutionDecoder
+
+VIEWS = ("class", "teacher", "room", "course")
+FORMATS = ("csv", "json", "xlsx")
+
+# A lesson as seen from a timetable, names of its subject, classes, teachers, rooms
+Lesson = dict[str, Any]
+
+
+class ScheduleExport:
+    """Every class, teacher, room and course timetable of one solution.
+
+    The solution is decoded once and each lesson is then placed into all the
+    timetables it belongs to in a single pass, so the cost doesn't grow with
+    the number of views or entities. Timetables are written one at a time
+    into a zip: a CSV per entity, a JSON document and an XLSX workbook with a
+    sheet per entity for each view.
+    """
+
+    def __init__(
+        self,
+        data: ScheduleData,
+        variables: dict[str, Any],
+        views: Iterable[str] = VIEWS,
+    ):
+        self.data = data
+        self.views = [
+            view for view in views if view != "room" or data.config.schedule_rooms
+        ]
+        decoder = SolutionDecoder(data, variables)
+
+        names = {
+            "class": [c.name for c in data.classes_data],
+            "teacher": [t.name for t in data.teachers_data],
+            "room": [r.name for r in data.rooms_data],
+            "course": [q.name for q in data.courses_data],
+        }
+        self.names = {view: names[view] for view in self.views}
+        # Lessons at [view][entity][day][period]
+        self.timetables: dict[str, list[list[list[list[Lesson]]]]] = {
+            view: [[[[] for _ in data.periods] for _ in data.days] for _ in names[view]]
+            for view in self.views
+        }
+
+        subject_courses: list[list[int]] = [[] for _ in data.subjects]
+        for q, course in enumerate(data.courses_data):
+            for s in course.subjects:
+                subject_courses[s].append(q)
+
+        for d, p, s in decoder.lessons:
+            subject = data.subjects_data[s]
+            entities = {
+                "class": subject.classes,
+                "teacher": decoder.subject_teachers[s],
+                "room": decoder.subject_rooms[s],
+                "course": subject_courses[s],
+            }
+            lesson = {
+                "subject": subject.name,
+                "classes": [names["class"][c] for c in subject.classes],
+                "teachers": [names["teacher"][t] for t in entities["teacher"]],
+                "rooms": [names["room"][r] for r in entities["room"]],
+            }
+            for view in self.views:
+                for e in entities[view]:
+                    self.timetables[view][e][d][p].append(lesson)
+
+    def day_names(self) -> list[str]:
+        """Day labels, 1A, 1B, ... with alternating weeks."""
+        if not self.data.config.use_alternating_weeks:
+            return [str(d + 1) for d in self.data.days]
+        half = max(1, self.data.num_days // 2)
+        return [f"{d % half + 1}{'AB'[min(d // half, 1)]}" for d in self.data.days]
+
+    def cell_text(self, view: str, lessons: list[Lesson]) -> str:
+        """A timetable cell, leaving out the entity the timetable belongs to."""
+        own = {"class": "classes", "teacher": "teachers", "room": "rooms"}.get(view)
+        shown = [key for key in ("classes", "teachers", "rooms") if key != own]
+        return "\n\n".join(
+            "\n".join(
+                [lesson["subject"]]
+                + [", ".join(lesson[key]) for key in shown if lesson[key]]
+            )
+            for lesson in lessons
+        )
+
+    def rows(self, view: str, e: int) -> Iterator[list[str]]:
+        """The timetable of one entity as a header and a row per day."""
+        yield ["Day"] + [str(p + 1) for p in self.data.periods]
+        for day, lessons in zip(self.day_names(), self.timetables[view][e]):
+            yield [day] + [self.cell_text(view, cell) for cell in lessons]
+
+    def write(self, archive: zipfile.ZipFile, formats: Iterable[str] = FORMATS):
+        formats = list(formats)
+        for view in self.views:
+            files = file_names(self.names[view])
+            if "csv" in formats:
+                for e, name in enumerate(files):
+                    with text_entry(archive, f"{view}/{name}.csv") as f:
+                        csv.writer(f, lineterminator="\n").writerows(self.rows(view, e))
+            if "json" in formats:
+                with text_entry(archive, f"{view}.json") as f:
+                    json.dump(self.json_object(view), f, ensure_ascii=False)
+            if "xlsx" in formats:
+                with archive.open(f"{view}.xlsx", "w") as f:
+                    write_workbook(
+                        f,
+                        [
+                            (name, self.rows(view, e))
+                            for e, name in enumerate(self.names[view])
+                        ],
+                    )
+
+    def json_object(self, view: str) -> list[dict[str, Any]]:
+        days = self.day_names()
+        return [
+            {
+                "name": name,
+                "days": [
+                    {"day": day, "periods": periods}
+                    for day, periods in zip(days, self.timetables[view][e])
+                ],
+            }
+            for e, name in enumerate(self.names[view])
+        ]
+
+    def zip(self, formats: Iterable[str] = FORMATS) -> bytes:
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            self.write(archive, formats)
+        return buffer.getvalue()
+
+
+def export_view(
+    data: ScheduleData,
+    variables: dict[str, Any],
+    view: str,
+    formats: list[str],
+) -> bytes:
+    """The zip of one view, run in a worker process for large districts."""
+    return ScheduleExport(data, variables, [view]).zip(formats)
+
+
+async def export_zip(
+    data: ScheduleData,
+    variables: dict[str, Any],
+    views: Iterable[str] = VIEWS,
+    formats: Iterable[str] = FORMATS,
+    executor: Executor | None = None,
+) -> bytes:
+    """All views of a solution as one zip.
+
+    Without an executor everything is exported from one decoding in a thread.
+    With one, e.g. a ProcessPoolExecutor, each view is exported in its own
+    worker, which decodes the solution for itself, and the parts are merged.
+    """
+    views, formats = list(views), list(formats)
+    if executor is None:
+        export = await asyncio.to_thread(ScheduleExport, data, variables, views)
+        return await asyncio.to_thread(export.zip, formats)
+
+    loop = asyncio.get_running_loop()
+    parts = await asyncio.gather(
+        *(
+            loop.run_in_executor(executor, export_view, data, variables, view, formats)
+            for view in views
+        )
+    )
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for part in parts:
+            with zipfile.ZipFile(io.BytesIO(part)) as source:
+                for info in source.infolist():
+                    archive.writestr(info, source.read(info))
+    return buffer.getvalue()
+
+
+def text_entry(archive: zipfile.ZipFile, name: str) -> io.TextIOWrapper:
+    return io.TextIOWrapper(archive.open(name, "w"), encoding="utf-8", newline="")
+
+
+def file_names(names: list[str], length: int = 100) -> list[str]:
+    """Names usable as file or sheet names, unique by numbering repeats."""
+    seen: set[str] = set()
+    result = []
+    for name in names:
+        safe = re.sub(r'[\\/:*?"<>|\[\]]', "_", name).strip()[:length] or "_"
+        unique, n = safe, 1
+        while unique in seen:
+            n += 1
+            unique = f"{safe[: length - len(str(n)) - 3]} ({n})"
+        seen.add(unique)
+        result.append(unique)
+    return result
+
+
+WORKBOOK_FILES = {
+    "[Content_Types].xml": """<?xml version="1.0" encoding="UTF-8"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+{sheets}
+</Types>""",
+    "_rels/.rels": """<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>""",
+    "xl/workbook.xml": """<?xml version="1.0" encoding="UTF-8"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets>{sheets}</sheets>
+</workbook>""",
+    "xl/_rels/workbook.xml.rels": """<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+{sheets}
+</Relationships>""",
+}
+
+
+def write_workbook(f: IO[bytes], sheets: list[tuple[str, Iterable[list[str]]]]):
+    """Writes a minimal XLSX workbook of text cells, one sheet at a time.
+
+    Only the standard library is needed, so exports work without an Excel
+    writer installed.
+    """
+    # Excel limits sheet names to 31 characters
+    titles = file_names([name for name, _ in sheets], 31)
+    count = len(sheets)
+    parts = {
+        "[Content_Types].xml": "".join(
+            f'<Override PartName="/xl/worksheets/sheet{i + 1}.xml" ContentType='
+            '"application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+            for i in range(count)
+        ),
+        "_rels/.rels": "",
+        "xl/workbook.xml": "".join(
+            f'<sheet name="{escape(title, {chr(34): "&quot;"})}" '
+            f'sheetId="{i + 1}" r:id="rId{i + 1}"/>'
+            for i, title in enumerate(titles)
+        ),
+        "xl/_rels/workbook.xml.rels": "".join(
+            f'<Relationship Id="rId{i + 1}" Type="http://schemas.openxmlformats.org/'
+            f'officeDocument/2006/relationships/worksheet" '
+            f'Target="worksheets/sheet{i + 1}.xml"/>'
+            for i in range(count)
+        ),
+    }
+    with zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED) as workbook:
+        for name, template in WORKBOOK_FILES.items():
+            workbook.writestr(name, template.format(sheets=parts[name]))
+        for i, (_, rows) in enumerate(sheets):
+            with workbook.open(f"xl/worksheets/sheet{i + 1}.xml", "w") as sheet:
+                sheet.write(
+                    b'<?xml version="1.0" encoding="UTF-8"?>\n<worksheet xmlns='
+                    b'"http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                    b"<sheetData>"
+                )
+                for row in rows:
+                    cells = "".join(
+                        f'<c t="inlineStr"><is><t xml:space="preserve">{escape(value)}'
+                        "</t></is></c>"
+                        for value in row
+                    )
+                    sheet.write(f"<row>{cells}</row>".encode())
+                sheet.write(b"</sheetData></worksheet>")
@@ -0,0 +1,550 @@
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import Executor
+from typing import Any
+
+import numpy as np
+
+from data import ScheduleData
+from data_minizinc import Domains, presolve, warm_start
+from metrics import Recorder, recorder_for
+from portfolio import ImprovingStream
+from schedule import SolutionCallback, SolutionEvent
+from solver_pool import PositionCallback, SolverPool
+
+# Seconds the local search may take, at most the solve time limit
+TIME_LIMIT = 30.0
+
+CLASSES, TEACHERS, ROOMS = range(3)
+
+Cell = tuple[int, int]
+Unit = tuple[Cell, ...]
+Move = tuple[Any, ...]
+
+
+class LocalSearch:
+    """Builds a timetable greedily, then repairs its conflicts with tabu search.
+
+    Placements always keep a subject in its presolved slots, at most once a
+    day, with as many eligible teachers and rooms as it needs. Clashes of
+    classes, teachers and rooms, lessons with unavailable teachers or rooms
+    and violated teacher distributions are conflicts, counted incrementally
+    as lessons move. With alternating weeks a lesson taught in both weeks
+    moves as one unit of two cells. Distances and changes from the previous
+    solution are left to the exact solver, the previous solution only breaks
+    ties.
+    """
+
+    def __init__(
+        self,
+        data: ScheduleData,
+        previous: SolutionEvent | None = None,
+        seed: int | None = None,
+    ):
+        self.data = data
+        self.random = random.Random(seed)
+        self.domains = presolve(data) if data.config.presolve else Domains.initial(data)
+        half = data.num_days // 2
+
+        # Cells a unit of each size can take, per subject
+        self.positions: list[dict[int, list[Unit]]] = []
+        # Unit sizes to place per subject, pairs first
+        self.sizes: list[list[int]] = []
+        for s, subject in enumerate(data.subjects_data):
+            slots = self.domains.periods[s]
+            singles = [((d, p),) for d, p in np.argwhere(slots).tolist()]
+            pairs = [
+                ((d, p), (d + half, p))
+                for d, p in np.argwhere(slots[:half] & slots[half : 2 * half]).tolist()
+            ]
+            self.positions.append({1: singles, 2: pairs})
+            n = subject.periods_per_week
+            if not data.config.use_alternating_weeks:
+                self.sizes.append([1] * n)
+            elif n % 2 == 0:
+                self.sizes.append([2] * (n // 2))
+            else:
+                self.sizes.append([2] * (n // 2) + [1])
+
+        def nested(available: Any) -> list[list[list[bool]]]:
+            return np.asarray(available, dtype=bool).tolist()
+
+        self.available = [
+            nested(np.ones((data.num_classes, data.num_days, data.num_periods))),
+            nested(data.teachers_available),
+            nested(data.rooms_available),
+        ]
+        self.loads = [
+            [[[0] * data.num_periods for _ in data.days] for _ in range(n)]
+            for n in (data.num_classes, data.num_teachers, data.num_rooms)
+        ]
+        # Entity cells with a clash or an unavailable entity, as (kind, e, d, p)
+        self.clashes: set[tuple[int, int, int, int]] = set()
+        self.at: list[list[set[int]]] = [
+            [set() for _ in data.periods] for _ in data.days
+        ]
+
+        self.at_least = np.zeros((data.num_courses, data.num_teachers), dtype=int)
+        self.at_most = np.zeros((data.num_courses, data.num_teachers), dtype=int)
+        self.distributed = [
+            q.teacher_distribution is not None for q in data.courses_data
+        ]
+        for q, course in enumerate(data.courses_data):
+            for td in course.teacher_distribution or []:
+                self.at_least[q, td.teacher] = td.at_least
+                self.at_most[q, td.teacher] = td.at_most
+        self.assigned = np.zeros((data.num_courses, data.num_teachers), dtype=int)
+
+        self.use_warm_start = previous is not None
+        hints = warm_start(
+            data, (previous.data, previous.variables) if previous else None
+        )
+        self.previous_cells = np.asarray(hints["previous__schedule_subjects"], bool)
+        self.previous_teachers = np.asarray(
+            hints["previous__teacher_assignments"], bool
+        )
+        self.previous_rooms = np.asarray(hints["previous__room_assignments"], bool)
+
+        self.units: list[list[Unit]] = [[] for _ in data.subjects]
+        self.teachers: list[list[int]] = [[] for _ in data.subjects]
+        self.rooms: list[list[int]] = [[] for _ in data.subjects]
+        self.conflicts = 0
+        self.deviation = 0
+        self.tabu: dict[Move, int] = {}
+        self.iterations = 0
+
+    def run(self, time_limit: float, stop: threading.Event) -> dict[str, Any] | None:
+        """Variables of a feasible timetable, or None if none was found in time."""
+        deadline = time.perf_counter() + time_limit
+        if not self.construct():
+            return None
+        best = self.conflicts + self.deviation
+        while self.conflicts + self.deviation > 0:
+            if stop.is_set() or time.perf_counter() > deadline:
+                return None
+            self.iterations += 1
+            self.step(best)
+            best = min(best, self.conflicts + self.deviation)
+        return self.variables()
+
+    def uses(self, s: int) -> tuple[tuple[int, list[int]], ...]:
+        return (
+            (CLASSES, self.data.subjects_data[s].classes),
+            (TEACHERS, self.teachers[s]),
+            (ROOMS, self.rooms[s]),
+        )
+
+    def occupy(self, kind: int, e: int, d: int, p: int, sign: int):
+        loads, available = self.loads[kind][e][d], self.available[kind][e][d][p]
+        if sign > 0:
+            self.conflicts += (loads[p] >= 1) + (not available)
+        loads[p] += sign
+        if sign < 0:
+            self.conflicts -= (loads[p] >= 1) + (not available)
+        if loads[p] > 1 or (loads[p] and not available):
+            self.clashes.add((kind, e, d, p))
+        else:
+            self.clashes.discard((kind, e, d, p))
+
+    def cost(self, kind: int, e: int, cells: Unit, sign: int) -> int:
+        """Change in conflicts from adding or removing `e` in `cells`."""
+        loads, available = self.loads[kind][e], self.available[kind][e]
+        if sign > 0:
+            return sum((loads[d][p] >= 1) + (not available[d][p]) for d, p in cells)
+        return -sum((loads[d][p] >= 2) + (not available[d][p]) for d, p in cells)
+
+    def unit_cost(self, s: int, cells: Unit, sign: int) -> int:
+        return sum(
+            self.cost(kind, e, cells, sign)
+            for kind, entities in self.uses(s)
+            for e in entities
+        )
+
+    def place(self, s: int, unit: Unit, sign: int):
+        for kind, entities in self.uses(s):
+            for e in entities:
+                for d, p in unit:
+                    self.occupy(kind, e, d, p, sign)
+        for d, p in unit:
+            if sign > 0:
+                self.at[d][p].add(s)
+            else:
+                self.at[d][p].discard(s)
+
+    def cells(self, s: int) -> Unit:
+        return tuple(cell for unit in self.units[s] for cell in unit)
+
+    def assign(self, kind: int, s: int, e: int, sign: int):
+        """Adds or removes teacher or room `e` from subject `s` and its lessons."""
+        for d, p in self.cells(s):
+            self.occupy(kind, e, d, p, sign)
+        entities = self.teachers[s] if kind == TEACHERS else self.rooms[s]
+        if sign > 0:
+            entities.append(e)
+        else:
+            entities.remove(e)
+        q = self.data.subjects_data[s].course
+        if kind == TEACHERS and q is not None and self.distributed[q]:
+            self.deviation += self.course_cost(q, e, sign)
+            self.assigned[q, e] += sign
+
+    def course_cost(self, q: int, t: int, sign: int) -> int:
+        def deviation(n: int) -> int:
+            return max(0, self.at_least[q, t] - n) + max(0, n - self.at_most[q, t])
+
+        n = self.assigned[q, t]
+        return deviation(n + sign) - deviation(n)
+
+    def construct(self):
+        """Places the most constrained subjects first, each where it clashes least."""
+        data = self.data
+
+        def slack(s: int):
+            sizes = self.sizes[s]
+            options = sum(len(self.positions[s][size]) for size in set(sizes))
+            return options / max(1, len(sizes)), -len(data.subjects_data[s].classes)
+
+        for s in sorted(data.subjects, key=slack):
+            subject = data.subjects_data[s]
+            for kind, eligible, needed, previous in (
+                (
+                    TEACHERS,
+                    self.domains.teachers,
+                    subject.teachers_per_period,
+                    self.previous_teachers,
+                ),
+                (
+                    ROOMS,
+                    self.domains.rooms,
+                    subject.rooms_per_period,
+                    self.previous_rooms,
+                ),
+            ):
+                if kind == ROOMS and not data.config.schedule_rooms:
+                    continue
+                candidates = np.flatnonzero(eligible[s]).tolist()
+                if len(candidates) < needed:
+                    return False
+                for _ in range(needed):
+                    e = min(
+                        candidates,
+                        key=lambda e: (
+                            self.entity_need(kind, s, e),
+                            not previous[s, e],
+                            -self.free_cells(kind, s, e),
+                            self.random.random(),
+                        ),
+                    )
+                    candidates.remove(e)
+                    self.assign(kind, s, e, 1)
+
+            for size in self.sizes[s]:
+                used = {d for d, _ in self.cells(s)}
+                options = [
+                    unit
+                    for unit in self.positions[s][size]
+                    if not used & {d for d, _ in unit}
+                ]
+                if not options:
+                    return False
+                unit = min(
+                    options,
+                    key=lambda unit: (
+                        self.unit_cost(s, unit, 1),
+                        not all(self.previous_cells[d, p, s] for d, p in unit),
+                        self.random.random(),
+                    ),
+                )
+                self.units[s].append(unit)
+                self.place(s, unit, 1)
+        return True
+
+    def entity_need(self, kind: int, s: int, e: int):
+        q = self.data.subjects_data[s].course
+        if kind == ROOMS or q is None or not self.distributed[q]:
+            return 0
+        return self.course_cost(q, e, 1)
+
+    def free_cells(self, kind: int, s: int, e: int):
+        """Slots of `s` where `e` is available and still unused."""
+        loads, available = self.loads[kind][e], self.available[kind][e]
+        return sum(
+            available[d][p] and not loads[d][p]
+            for d, p in np.argwhere(self.domains.periods[s]).tolist()
+        )
+
+    def step(self, best: int):
+        """Makes the best move that is not tabu for the subjects of one conflict."""
+        current = self.conflicts + self.deviation
+        chosen: Move | None = None
+        chosen_delta = 0
+        ties = 0
+        subjects, kinds = self.conflict()
+        for s in subjects:
+            for move, delta in self.moves(s, kinds):
+                if self.tabu.get(tabu_key(move), 0) > self.iterations:
+                    # Aspiration, a tabu move is fine if it beats the best so far
+                    if current + delta >= best:
+                        continue
+                if chosen is None or delta < chosen_delta:
+                    chosen, chosen_delta, ties = move, delta, 1
+                elif delta == chosen_delta:
+                    ties += 1
+                    if self.random.randrange(ties) == 0:
+                        chosen = move
+        if chosen is not None:
+            self.apply(chosen)
+
+    def conflict(self) -> tuple[list[int], tuple[Any, ...]]:
+        """Subjects involved in a random conflict and the kinds of moves to try."""
+        if self.clashes and (not self.deviation or self.random.random() < 0.9):
+            kind, e, d, p = self.random.choice(tuple(self.clashes))
+            subjects = [s for s in self.at[d][p] if e in self.uses(s)[kind][1]]
+            return subjects, ("unit", TEACHERS, ROOMS)
+
+        # A violated teacher distribution. Only reassigning a teacher fixes it,
+        # moving lessons would just wander across equally good timetables.
+        violations = [
+            (q, t)
+            for q, distributed in enumerate(self.distributed)
+            if distributed
+            for t in self.data.teachers
+            if not self.at_least[q, t] <= self.assigned[q, t] <= self.at_most[q, t]
+        ]
+        q, t = self.random.choice(violations)
+        subjects = [
+            s for s in self.data.courses_data[q].subjects if self.domains.teachers[s, t]
+        ]
+        return subjects, (TEACHERS,)
+
+    def moves(self, s: int, kinds: tuple[Any, ...]):
+        """Possible moves of `kinds` for `s` with their change in conflicts."""
+        units = self.units[s] if "unit" in kinds else []
+        for i, unit in enumerate(units):
+            used = {d for j, other in enumerate(units) if j != i for d, _ in other}
+            removed = self.unit_cost(s, unit, -1)
+            for target in self.positions[s][len(unit)]:
+                if target == unit or used & {d for d, _ in target}:
+                    continue
+                yield ("unit", s, i, target), removed + self.unit_cost(s, target, 1)
+
+        cells = self.cells(s)
+        q = self.data.subjects_data[s].course
+        for kind, eligible, current in (
+            (TEACHERS, self.domains.teachers[s], self.teachers[s]),
+            (ROOMS, self.domains.rooms[s], self.rooms[s]),
+        ):
+            if not current or kind not in kinds:
+                continue
+            candidates = [e for e in np.flatnonzero(eligible) if e not in current]
+            distributed = kind == TEACHERS and q is not None and self.distributed[q]
+            for old in current:
+                removed = self.cost(kind, old, cells, -1)
+                if distributed:
+                    removed += self.course_cost(q, old, -1)
+                for new in candidates:
+                    delta = removed + self.cost(kind, new, cells, 1)
+                    if distributed:
+                        delta += self.course_cost(q, new, 1)
+                    yield (kind, s, old, int(new)), delta
+
+    def apply(self, move: Move):
+        tenure = 7 + self.random.randrange(10)
+        if move[0] == "unit":
+            _, s, i, target = move
+            unit = self.units[s][i]
+            self.place(s, unit, -1)
+            self.units[s][i] = target
+            self.place(s, target, 1)
+            # Moving a lesson of s back where it came from is tabu
+            self.tabu["unit", s, unit] = self.iterations + tenure
+        else:
+            kind, s, old, new = move
+            self.assign(kind, s, old, -1)
+            self.assign(kind, s, new, 1)
+            # So is assigning the released teacher or room again
+            self.tabu[kind, s, old] = self.iterations + tenure
+
+    def variables(self) -> dict[str, Any]:
+        data = self.data
+        schedule = np.zeros((data.num_days, data.num_periods, data.num_subjects), int)
+        teachers = np.zeros((data.num_subjects, data.num_teachers), int)
+        rooms = np.zeros((data.num_subjects, data.num_rooms), int)
+        for s in data.subjects:
+            for d, p in self.cells(s):
+                schedule[d, p, s] = 1
+            teachers[s, self.teachers[s]] = 1
+            rooms[s, self.rooms[s]] = 1
+
+        distances = np.zeros(
+            (data.num_classes, data.num_days, max(0, data.num_periods - 1)), int
+        )
+        if (
+            data.config.optimize_distance
+            and data.config.schedule_rooms
+            and data.room_distances is not None
+        ):
+            for c in data.classes:
+                for d in data.days:
+                    # The room of the class in each period, if it is in one
+                    here = [None] * data.num_periods
+                    for p in data.periods:
+                        for s in self.at[d][p]:
+                            subject = data.subjects_data[s]
+                            if c in subject.classes and subject.rooms_per_period == 1:
+                                here[p] = self.rooms[s][0]
+                    for p in range(data.num_periods - 1):
+                        if here[p] is not None and here[p + 1] is not None:
+                            distances[c, d, p] = data.room_distances[here[p]][
+                                here[p + 1]
+                            ]
+        days = distances.sum(axis=2)
+        return {
+            "schedule_subjects": schedule.tolist(),
+            "teacher_assignments": teachers.tolist(),
+            "room_assignments": rooms.tolist(),
+            "distances": distances.tolist(),
+            "max_distance": int(days.max(initial=0)),
+            "sum_distances": int(days.sum()),
+        }
+
+    def objective(self, variables: dict[str, Any]):
+        """The objective of model.mzn for `variables`."""
+        data = self.data
+        changes = 0
+        max_changes = 0
+        if self.use_warm_start:
+            changes = int(
+                (
+                    np.asarray(variables["schedule_subjects"]).astype(bool)
+                    != self.previous_cells
+                )[self.domains.periods.transpose(1, 2, 0)].sum()
+                + (
+                    np.asarray(variables["teacher_assignments"]).astype(bool)
+                    != self.previous_teachers
+                )[self.domains.teachers].sum()
+                + (
+                    np.asarray(variables["room_assignments"]).astype(bool)
+                    != self.previous_rooms
+                )[self.domains.rooms].sum()
+            )
+            max_changes = data.num_days * data.num_periods * data.num_subjects
+            max_changes += data.num_subjects * (data.num_teachers + data.num_rooms)
+        if data.config.optimize_distance:
+            return variables["max_distance"] * (max_changes + 1) + changes
+        return changes
+
+
+def tabu_key(move: Move) -> Move:
+    """What a move brings in, the kind, the subject and the cells or entity."""
+    return move[0], move[1], move[-1]
+
+
+class HeuristicStart:
+    """Races a local search for a first timetable against an exact runner.
+
+    The exact runner solves as usual. Next to it, `LocalSearch` looks for any
+    feasible timetable, which usually takes seconds where the exact solver
+    first has to build its model. Both feed one stream that only passes on
+    improvements, so the exact solutions replace the heuristic one once they
+    rank better. The search stops at the first exact solution. It runs on one
+    thread outside the solver pool allowance.
+    """
+
+    def __init__(
+        self,
+        schedule_data: ScheduleData,
+        exact: Any,
+        previous: SolutionEvent | None = None,
+        recorder: Recorder | None = None,
+        **_: Any,
+    ):
+        self.schedule_data = schedule_data
+        self.exact = exact
+        self.previous = previous
+        self.recorder = (recorder or recorder_for(schedule_data)).bind(
+            backend="heuristic"
+        )
+        self.task: asyncio.Task[None] | None = None
+
+    @property
+    def build_stats(self) -> dict[str, Any]:
+        return getattr(self.exact, "build_stats", {})
+
+    def solve(self, callback: SolutionCallback | None = None):
+        asyncio.run(self.iterate_solutions(callback))
+
+    async def solve_async(
+        self,
+        callback: SolutionCallback | None = None,
+        pool: SolverPool | None = None,
+        on_position: PositionCallback | None = None,
+    ):
+        if pool is None:
+            self.task = asyncio.create_task(self.iterate_solutions(callback))
+            return
+
+        self.task = asyncio.create_task(
+            pool.run(
+                lambda threads: self.iterate_solutions(
+                    callback, threads, pool.executor
+                ),
+                on_position,
+            )
+        )
+
+    def search(self, stop: threading.Event):
+        budget = self.schedule_data.budget
+        time_limit = min(TIME_LIMIT, budget.time_limit or TIME_LIMIT)
+        local_search = LocalSearch(
+            self.schedule_data, self.previous, budget.random_seed
+        )
+        variables = local_search.run(time_limit, stop)
+        if variables is None:
+            return None
+        return SolutionEvent(
+            self.schedule_data, variables, local_search.objective(variables)
+        )
+
+    async def iterate_solutions(
+        self,
+        callback: SolutionCallback | None = None,
+        processes: int | None = None,
+        executor: Executor | None = None,
+    ):
+        stream = ImprovingStream(self.schedule_data, self.previous, callback)
+        stop = threading.Event()
+        start = time.perf_counter()
+
+        def on_exact(event: SolutionEvent | None):
+            if event is not None:
+                stop.set()
+                stream.offer(event)
+
+        async def heuristic():
+            event = await asyncio.to_thread(self.search, stop)
+            if event is None:
+                self.recorder.count("schedule_heuristic_failures")
+                return
+            self.recorder.stage("heuristic_solution", time.perf_counter() - start)
+            if stream.offer(event):
+                self.recorder.count("schedule_heuristic_solutions")
+
+        task = asyncio.create_task(heuristic())
+        try:
+            await self.exact.iterate_solutions(on_exact, processes, executor)
+        finally:
+            stop.set()
+            await asyncio.gather(task, return_exceptions=True)
+        if callback is not None:
+            callback(None)
+
+    async def cancel(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                print("Solver was cancelled.")
@@ -0,0 +1,419 @@
+import array
+import types
+from collections.abc import AsyncIterable
+from dataclasses import fields
+from typing import Any, get_args
+
+import ijson
+import numpy as np
+
+from data import (
+    ClassData,
+    CourseData,
+    RoomData,
+    ScheduleConfig,
+    ScheduleData,
+    SolveBudget,
+    SubjectData,
+    TeacherData,
+    TeacherDistributionItem,
+    option_problem,
+)
+
+COLLECTIONS = ("teachers", "classes", "rooms", "courses", "subjects")
+SCALARS = ("config", "budget", "days", "periods")
+REQUIRED = object()
+PERIODS = ".item.available_periods"
+
+
+class InputError(ValueError):
+    """Input that does not follow the schema, with the JSON path of the problem."""
+
+    def __init__(self, path: str, message: str):
+        super().__init__(f"{path}: {message}")
+        self.path = path
+        self.message = message
+
+
+class InputParser:
+    """Builds `ScheduleData` from JSON fed in chunks, one entity at a time.
+
+    Entities are validated and converted as soon as their object ends, so the
+    raw document is never held in memory. Period lists go straight into flat
+    integer arrays and become the availability cubes once `days` and `periods`
+    are known. Indices are checked after the last chunk, when every collection
+    has its final length.
+    """
+
+    def __init__(self):
+        self.events = ijson.sendable_list()
+        self.parser = ijson.parse_coro(self.events, use_float=True)
+        self.key: str | None = None
+        self.values: dict[str, Any] = {}
+        self.entities: dict[str, list[Any]] = {}
+        self.periods: dict[str, list[array.array[int] | None]] = {}
+        self.builder: ijson.ObjectBuilder | None = None
+        self.item_periods: array.array[int] | None = None
+        self.pair_length = 0
+        self.distances: array.array[int] | None = None
+        self.distance_rows: list[int] = []
+
+    def feed(self, chunk: bytes):
+        # An empty chunk would end the parser early, it only ends in `finish`
+        if not chunk:
+            return
+        try:
+            self.parser.send(chunk)
+        except ijson.JSONError as e:
+            raise InputError("$", f"invalid JSON: {e}") from None
+        self.consume()
+
+    def finish(self) -> ScheduleData:
+        try:
+            self.parser.close()
+        except ijson.JSONError as e:
+            raise InputError("$", f"invalid JSON: {e}") from None
+        self.consume()
+        return self.build()
+
+    def consume(self):
+        for prefix, event, value in self.events:
+            self.event(prefix, event, value)
+        del self.events[:]
+
+    def event(self, prefix: str, event: str, value: Any):
+        if prefix == "":
+            if event == "map_key":
+                self.key = value
+            elif event not in ("start_map", "end_map"):
+                raise InputError("$", "expected an object")
+            return
+
+        assert self.key is not None
+        relative = prefix[len(self.key) :]
+        if self.key in COLLECTIONS:
+            self.collection_event(self.key, relative, event, value)
+        elif self.key == "room_distances":
+            self.distances_event(relative, event, value)
+        elif self.key in SCALARS:
+            if relative == "" and event in ("start_map", "start_array"):
+                self.builder = ijson.ObjectBuilder()
+            if self.builder is None:
+                self.values[self.key] = value
+                return
+            self.builder.event(event, value)
+            if relative == "" and event in ("end_map", "end_array"):
+                self.values[self.key] = self.builder.value
+                self.builder = None
+
+    def collection_event(self, key: str, relative: str, event: str, value: Any):
+        items = self.entities.setdefault(key, [])
+        index = len(items)
+        if relative == "":
+            if event not in ("start_array", "end_array"):
+                raise InputError(f"$.{key}", "expected an array")
+        elif relative == ".item":
+            if event == "start_map":
+                self.builder = ijson.ObjectBuilder()
+                self.item_periods = None
+                self.builder.event(event, value)
+            elif event == "end_map":
+                assert self.builder is not None
+                self.builder.event(event, value)
+                path = f"$.{key}[{index}]"
+                items.append(ENTITY_PARSERS[key](self.builder.value, path))
+                self.periods.setdefault(key, []).append(self.item_periods)
+                self.builder = None
+            elif event == "map_key" and value == "available_periods":
+                # Kept out of the builder, see `periods_event`
+                pass
+            elif self.builder is not None:
+                self.builder.event(event, value)
+            else:
+                raise InputError(f"$.{key}[{index}]", "expected an object")
+        elif relative == PERIODS or relative.startswith(PERIODS + "."):
+            path = f"$.{key}[{index}].available_periods"
+            self.periods_event(relative[len(PERIODS) :], path, event, value)
+        else:
+            assert self.builder is not None
+            self.builder.event(event, value)
+
+    def periods_event(self, relative: str, path: str, event: str, value: Any):
+        if relative == "":
+            if event == "start_array":
+                self.item_periods = array.array("i")
+            elif event not in ("end_array", "null"):
+                raise InputError(path, "expected a list of [day, period] pairs")
+            return
+
+        assert self.item_periods is not None
+        pair = f"{path}[{len(self.item_periods) // 2}]"
+        if relative == ".item":
+            if event == "start_array":
+                self.pair_length = 0
+            elif event != "end_array" or self.pair_length != 2:
+                raise InputError(pair, "expected a [day, period] pair")
+        elif relative == ".item.item" and self.pair_length < 2:
+            self.item_periods.append(integer(value, pair))
+            self.pair_length += 1
+        else:
+            raise InputError(pair, "expected a [day, period] pair")
+
+    def distances_event(self, relative: str, event: str, value: Any):
+        row = f"$.room_distances[{max(0, len(self.distance_rows) - 1)}]"
+        if relative == "":
+            if event == "start_array":
+                self.distances = array.array("i")
+            elif event not in ("end_array", "null"):
+                raise InputError("$.room_distances", "expected a matrix")
+        elif relative == ".item":
+            if event == "start_array":
+                self.distance_rows.append(0)
+            elif event != "end_array":
+                row = f"$.room_distances[{len(self.distance_rows)}]"
+                raise InputError(row, "expected a list of distances")
+        elif relative == ".item.item" and self.distances is not None:
+            self.distances.append(integer(value, f"{row}[{self.distance_rows[-1]}]"))
+            self.distance_rows[-1] += 1
+        else:
+            raise InputError(row, "expected a list of distances")
+
+    def build(self) -> ScheduleData:
+        config = options(ScheduleConfig, get(self.values, "config", "$"), "$.config")
+        budget = options(SolveBudget, self.values.get("budget") or {}, "$.budget")
+        days = integer(get(self.values, "days", "$"), "$.days", minimum=1)
+        periods = integer(get(self.values, "periods", "$"), "$.periods", minimum=1)
+        for key in ("teachers", "classes", "subjects", "courses"):
+            if key not in self.entities:
+                raise InputError(f"$.{key}", "is required")
+
+        teachers = self.entities["teachers"]
+        classes = self.entities["classes"]
+        rooms = self.entities.get("rooms", [])
+        courses = self.entities["courses"]
+        subjects = self.entities["subjects"]
+        counts = {
+            "class": len(classes),
+            "teacher": len(teachers),
+            "room": len(rooms),
+            "course": len(courses),
+            "subject": len(subjects),
+        }
+
+        for s, subject in enumerate(subjects):
+            path = f"$.subjects[{s}]"
+            check_indices(subject.classes, "class", counts, f"{path}.classes")
+            check_indices(subject.teachers, "teacher", counts, f"{path}.teachers")
+            check_indices(
+                subject.available_rooms, "room", counts, f"{path}.available_rooms"
+            )
+            if subject.course is not None:
+                check_index(subject.course, "course", counts, f"{path}.course")
+        for q, course in enumerate(courses):
+            path = f"$.courses[{q}]"
+            check_indices(course.subjects, "subject", counts, f"{path}.subjects")
+            for i, td in enumerate(course.teacher_distribution or []):
+                item = f"{path}.teacher_distribution[{i}]"
+                check_index(td.teacher, "teacher", counts, f"{item}.teacher")
+
+        room_distances = None
+        if self.distances is not None:
+            size = len(rooms)
+            if len(self.distance_rows) != size or any(
+                n != size for n in self.distance_rows
+            ):
+                raise InputError("$.room_distances", f"expected a {size}x{size} matrix")
+            room_distances = (
+                np.frombuffer(self.distances, dtype=np.int32)
+                .reshape(size, size)
+                .tolist()
+            )
+        elif config.optimize_distance:
+            raise InputError(
+                "$.room_distances", "is required when optimize_distance is set"
+            )
+
+        def cube(key: str, count: int):
+            available = np.ones((count, days, periods), dtype=np.bool_)
+            for i, flat in enumerate(self.periods.get(key, [])):
+                # Missing or empty availability means available everywhere
+                if not flat:
+                    continue
+                pairs = np.frombuffer(flat, dtype=np.int32).reshape(-1, 2)
+                for axis, limit, name in ((0, days, "day"), (1, periods, "period")):
+                    bad = np.flatnonzero(pairs[:, axis] >= limit)
+                    if len(bad):
+                        raise InputError(
+                            f"$.{key}[{i}].available_periods[{bad[0]}]",
+                            f"{name} {pairs[bad[0], axis]} is out of range, "
+                            f"there are {limit}",
+                        )
+                available[i] = False
+                available[i, pairs[:, 0], pairs[:, 1]] = True
+            return available
+
+        return ScheduleData.from_parts(
+            config=config,
+            budget=budget,
+            num_days=days,
+            num_periods=periods,
+            subjects_data=subjects,
+            teachers_data=teachers,
+            classes_data=classes,
+            rooms_data=rooms,
+            courses_data=courses,
+            room_distances=room_distances,
+            subjects_available=cube("subjects", len(subjects)),
+            teachers_available=cube("teachers", len(teachers)),
+            rooms_available=cube("rooms", len(rooms)),
+        )
+
+
+async def parse_stream(chunks: AsyncIterable[bytes]) -> ScheduleData:
+    parser = InputParser()
+    async for chunk in chunks:
+        parser.feed(chunk)
+    return parser.finish()
+
+
+def parse_bytes(data: bytes) -> ScheduleData:
+    parser = InputParser()
+    parser.feed(data)
+    return parser.finish()
+
+
+def get(obj: Any, key: str, path: str, default: Any = REQUIRED) -> Any:
+    if not isinstance(obj, dict):
+        raise InputError(path, "expected an object")
+    if key in obj:
+        return obj[key]
+    if default is REQUIRED:
+        raise InputError(f"{path}.{key}", "is required")
+    return default
+
+
+def integer(value: Any, path: str, minimum: int = 0) -> int:
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise InputError(path, "expected an integer")
+    if value < minimum or value >= 2**31:
+        raise InputError(path, f"{value} is out of range")
+    return value
+
+
+def integers(value: Any, path: str) -> list[int]:
+    if not isinstance(value, list):
+        raise InputError(path, "expected a list of integers")
+    return [integer(v, f"{path}[{i}]") for i, v in enumerate(value)]
+
+
+def string(value: Any, path: str) -> str:
+    if not isinstance(value, str):
+        raise InputError(path, "expected a string")
+    return value
+
+
+def options(cls: Any, obj: Any, path: str):
+    """Checks an options object against the fields of dataclass `cls`."""
+    if not isinstance(obj, dict):
+        raise InputError(path, "expected an object")
+    known = {f.name: f for f in fields(cls)}
+    for key, value in obj.items():
+        if key not in known:
+            raise InputError(f"{path}.{key}", "unknown option")
+        option = known[key]
+        allowed = (
+            get_args(option.type)
+            if isinstance(option.type, types.UnionType)
+            else (option.type,)
+        )
+        if value is None and type(None) in allowed:
+            continue
+        if float in allowed and isinstance(value, int) and not isinstance(value, bool):
+            pass
+        # Older clients send flags as 0 and 1
+        elif bool in allowed and type(value) is int and value in (0, 1):
+            obj[key] = bool(value)
+        elif not any(type(value) is t for t in allowed):
+            names = " or ".join(t.__name__ for t in allowed if t is not type(None))
+            raise InputError(f"{path}.{key}", f"expected {names}")
+        problem = option_problem(option, obj[key])
+        if problem is not None:
+            raise InputError(f"{path}.{key}", problem)
+    return cls(**obj)
+
+
+def check_indices(indices: list[int], kind: str, counts: dict[str, int], path: str):
+    for i, index in enumerate(indices):
+        check_index(index, kind, counts, f"{path}[{i}]")
+
+
+def check_index(index: int, kind: str, counts: dict[str, int], path: str):
+    if index >= counts[kind]:
+        raise InputError(
+            path, f"{kind} index {index} is out of range, there are {counts[kind]}"
+        )
+
+
+def parse_subject(obj: Any, path: str):
+    course = get(obj, "course", path, None)
+    return SubjectData(
+        classes=integers(get(obj, "classes", path), f"{path}.classes"),
+        periods_per_week=integer(
+            get(obj, "periods_per_week", path), f"{path}.periods_per_week"
+        ),
+        teachers=integers(get(obj, "teachers", path), f"{path}.teachers"),
+        teachers_per_period=integer(
+            get(obj, "teachers_per_period", path), f"{path}.teachers_per_period"
+        ),
+        # Only required when rooms are scheduled
+        available_rooms=integers(
+            get(obj, "available_rooms", path, []), f"{path}.available_rooms"
+        ),
+        rooms_per_period=integer(
+            get(obj, "rooms_per_period", path, 0), f"{path}.rooms_per_period"
+        ),
+        name=string(get(obj, "name", path), f"{path}.name"),
+        available_periods=None,
+        course=integer(course, f"{path}.course") if course is not None else None,
+    )
+
+
+def parse_course(obj: Any, path: str):
+    distribution = get(obj, "teacher_distribution", path, None)
+    items = None
+    if distribution is not None:
+        if not isinstance(distribution, list):
+            raise InputError(f"{path}.teacher_distribution", "expected a list")
+        items = []
+        for i, td in enumerate(distribution):
+            item = f"{path}.teacher_distribution[{i}]"
+            at_least = integer(get(td, "at_least", item), f"{item}.at_least")
+            items.append(
+                TeacherDistributionItem(
+                    teacher=integer(get(td, "teacher", item), f"{item}.teacher"),
+                    at_least=at_least,
+                    at_most=integer(
+                        get(td, "at_most", item), f"{item}.at_most", at_least
+                    ),
+                )
+            )
+    return CourseData(
+        name=string(get(obj, "name", path), f"{path}.name"),
+        teacher_distribution=items,
+        subjects=integers(get(obj, "subjects", path), f"{path}.subjects"),
+    )
+
+
+ENTITY_PARSERS = {
+    "teachers": lambda obj, path: TeacherData(
+        name=string(get(obj, "name", path), f"{path}.name"), available_periods=None
+    ),
+    "classes": lambda obj, path: ClassData(
+        name=string(get(obj, "name", path), f"{path}.name")
+    ),
+    "rooms": lambda obj, path: RoomData(
+        name=string(get(obj, "name", path), f"{path}.name"), available_periods=None
+    ),
+    "courses": parse_course,
+    "subjects": parse_subject,
+}
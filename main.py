@@ -1,18 +1,51 @@
 import asyncio
-import json
+import re
+import time
 import uuid
-from typing import Any, Dict
+from concurrent.futures import Executor
+from contextlib import asynccontextmanager
+from dataclasses import asdict
 
+import psutil
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 
-from data import ScheduleData
+from batch import Batch, BatchJob, find_inputs
+from binary_format import dump_solution
+from data import SolveBudget
 from display_schedule import SaveSchedule
-from schedule import Schedule
-from utils import create_file
-
-app = FastAPI()
+from export import FORMATS, VIEWS, export_zip
+from input_parser import InputError, parse_stream
+from metrics import Recorder, metrics, recorder_for
+from model_cache import model_cache
+from persistence import writer
+from precheck import precheck
+from schedule import SolutionEvent
+from schedule_stream import MODES, SNAPSHOT_FORMATS, ScheduleStream, sse
+from session_store import DiskSessionStore, Session, SessionStoreFull
+from solver_pool import QueuePosition, SolverPool
+from solvers import create_schedule
+
+session_store = DiskSessionStore()  # Stores sessions, swap for MemorySessionStore
+solver_pool = SolverPool()  # Shares the machine's cores between solve jobs
+debug_dumps = False  # Write each session's solver input and output to generated/
+# Runs exports in worker processes when set, e.g. for very large districts
+export_executor: Executor | None = None
+batches: dict[str, Batch] = {}  # Running batches by id
+batch_inputs = "inputs"  # /batch only reads inputs from this directory
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    expiry = asyncio.create_task(session_store.run_expiry())
+    yield
+    expiry.cancel()
+    # Let the last solutions reach the disk before exiting
+    await asyncio.to_thread(writer.flush)
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -22,114 +55,327 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-session_data: Dict[str, ScheduleData] = {}  # Stores JSON input
-data_queues: Dict[str, asyncio.Queue[Any]] = {}  # Stores message queues
-session_schedules: Dict[str, Schedule] = {}  # Stores schedules
-
-
-async def event_stream(session_id: str):
-    """SSE event stream for a given session ID."""
-    queue = data_queues.get(session_id)
-    if queue is None:
-        yield "event: error\ndata: Session not found\n\n"
-        return
-
-    while True:
-        result = await queue.get()
-        if result is None:
-            yield "event: cancel\n\n"
-            print("Scheduling process cancelled.")
-            break
-
-        obj = json.loads(result)
-        data = ScheduleData(obj["input"])
-        variables = obj["output"]
-
-        saver = SaveSchedule(data, variables)
-        csv_string = saver.schedule_csv()
-        yield f"data: {json.dumps(csv_string)}\n\n"
 
-
-def data_callback(session_id: str, data: Any):
+async def event_stream(session: Session, stream: ScheduleStream, recorder: Recorder):
+    """SSE event stream for a given session."""
+    finished = False
+    session.streaming = True
+    try:
+        while True:
+            result = await session.queue.get()
+            session.touch()
+            if result is None:
+                finished = True
+                yield "event: cancel\n\n"
+                print("Scheduling process cancelled.")
+                break
+
+            if isinstance(result, QueuePosition):
+                yield stream.notice("queue", asdict(result))
+                continue
+
+            with recorder.timer("render"):
+                saver = SaveSchedule(result.data, result.variables)
+                event = stream.event(saver)
+            yield event
+    finally:
+        session.streaming = False
+        # The client went away mid-stream, don't leave the solver running
+        if not finished and session.schedule is not None:
+            await session.schedule.cancel()
+
+
+def data_callback(session: Session, data: SolutionEvent | QueuePosition | None):
     """Callback function to send data to the client's SSE connection."""
-
-    async def put_data():
-        if session_id in data_queues:
-            await data_queues[session_id].put(data)
-
-    asyncio.create_task(put_data())
-
-
-async def test_async_function(session_id: str):
-    """Simulate an async function that streams results over time."""
-    for i in range(5):
-        await asyncio.sleep(1)  # Simulate delay
-        data = {"message": f"Message {i+1} from async function", "index": i + 1}
-        data_callback(session_id, data)  # Pass data to the callback
+    if isinstance(data, SolutionEvent):
+        session.solution = data
+        session_store.save_solution(session)
+    asyncio.create_task(session.queue.put(data))
 
 
 @app.post("/upload-data")
-async def upload_data(request: Request):
-    """Receives large JSON input via POST and stores it with a session ID."""
-    data = await request.json()
+async def upload_data(request: Request, resolve_from: str | None = None):
+    """Receives large JSON input via POST and stores it with a session ID.
+
+    With `resolve_from`, solving starts from that session's latest solution and
+    keeps the timetable as close to it as possible.
+    """
+    previous = None
+    if resolve_from is not None:
+        source = await session_store.get(resolve_from)
+        if source is None or source.solution is None:
+            raise HTTPException(
+                status_code=404, detail="No solution found for resolve_from"
+            )
+        previous = source.solution
 
     # Generate a unique session ID
     session_id = str(uuid.uuid4())
 
-    with create_file(f"sessions/{session_id}.json") as f:
-        json.dump(data, f)
-
-    schedule_data = ScheduleData(data)
-
-    # Store the data in memory
-    session_data[session_id] = schedule_data
-    data_queues[session_id] = asyncio.Queue()
+    start = time.perf_counter()
+    # Parsed as the body arrives, without holding the raw document
+    try:
+        schedule_data = await parse_stream(request.stream())
+    except InputError as e:
+        raise HTTPException(
+            status_code=422,
+            detail={"message": "Invalid input", "path": e.path, "error": e.message},
+        )
+    recorder = recorder_for(schedule_data, session_id)
+    recorder.stage("parse", time.perf_counter() - start)
+
+    # Reject inputs that can never be scheduled before any solver time is spent
+    with recorder.timer("precheck"):
+        # Presolving large schools is slow, keep it off the event loop
+        issues = await asyncio.to_thread(precheck, schedule_data)
+    if issues:
+        raise HTTPException(
+            status_code=422,
+            detail={
+                "message": "Input is infeasible",
+                "issues": [{**asdict(i), "message": i.message} for i in issues],
+            },
+        )
+
+    try:
+        await session_store.add(Session(session_id, schedule_data, previous=previous))
+    except SessionStoreFull:
+        raise HTTPException(status_code=503, detail="Too many sessions are solving")
 
     return {"session_id": session_id}
 
 
 @app.get("/solve/{session_id}")
-async def solve(session_id: str):
-    """Starts the scheduling process for a given session and streams updates."""
-    if session_id not in session_data:
+async def solve(session_id: str, mode: str = "full", snapshot: str = "json"):
+    """Starts the scheduling process for a given session and streams updates.
+
+    `mode=delta` sends a snapshot followed by changed cells only,
+    `snapshot=binary` sends snapshots in the compact binary format.
+    """
+    session = await session_store.get(session_id)
+    if session is None:
         raise HTTPException(status_code=404, detail="Session ID not found")
-
-    # Fetch stored data
-    data = session_data[session_id]
-    schedule = Schedule(data)
-    session_schedules[session_id] = schedule
+    if mode not in MODES or snapshot not in SNAPSHOT_FORMATS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Unknown mode or snapshot format: {mode}, {snapshot}",
+        )
+    if session.solving:
+        raise HTTPException(status_code=409, detail="Session is already solving")
+    # A finished solve or one cancelled by a disconnect can be started again
+    session.reset()
+
+    recorder = recorder_for(session.data, session_id)
+    schedule = create_schedule(
+        session.data,
+        previous=session.previous,
+        recorder=recorder,
+        dump_directory=f"generated/{session_id}" if debug_dumps else None,
+    )
+    session.schedule = schedule
 
     # Run the scheduling function asynchronously
     asyncio.create_task(
-        # test_async_function(session_id)
-        schedule.solve_async(lambda data: data_callback(session_id, data))
+        schedule.solve_async(
+            lambda data: data_callback(session, data),
+            solver_pool,
+            lambda position: data_callback(session, position),
+        )
     )
 
-    del session_data[session_id]
+    stream = ScheduleStream(mode=mode, snapshot_format=snapshot)
+    session.stream = stream
 
     # Return SSE response
-    return StreamingResponse(event_stream(session_id), media_type="text/event-stream")
+    return StreamingResponse(
+        event_stream(session, stream, recorder), media_type="text/event-stream"
+    )
+
+
+@app.get("/resync/{session_id}")
+async def resync(session_id: str):
+    """Makes the next delta-mode event a full snapshot."""
+    session = await session_store.get(session_id)
+    if session is None or session.stream is None:
+        raise HTTPException(status_code=404, detail="Session ID not found")
+
+    session.stream.request_resync()
+
+    return {"message": "Resync requested"}
+
+
+@app.get("/solution/{session_id}")
+async def solution(session_id: str, format: str = "json"):
+    """Returns the latest solution's variables as JSON or, with `format=binary`,
+    in the compact binary format."""
+    session = await session_store.get(session_id)
+    if session is None or session.solution is None:
+        raise HTTPException(status_code=404, detail="No solution found")
+    if format not in ("json", "binary"):
+        raise HTTPException(status_code=422, detail=f"Unknown format: {format}")
+
+    variables, objective = session.solution.variables, session.solution.objective
+    if format == "binary":
+        return Response(
+            dump_solution(variables, objective),
+            media_type="application/octet-stream",
+        )
+    return {"variables": variables, "objective": objective}
+
+
+@app.get("/export/{session_id}")
+async def export(
+    session_id: str,
+    views: str = ",".join(VIEWS),
+    formats: str = ",".join(FORMATS),
+):
+    """Returns the class, teacher, room and course timetables of the latest
+    solution as a zip of CSV, JSON and XLSX files.
+
+    `views` and `formats` are comma separated subsets, e.g. `views=teacher`.
+    """
+    session = await session_store.get(session_id)
+    if session is None or session.solution is None:
+        raise HTTPException(status_code=404, detail="No solution found")
+
+    selected_views, selected_formats = views.split(","), formats.split(",")
+    unknown = set(selected_views) - set(VIEWS) | set(selected_formats) - set(FORMATS)
+    if unknown:
+        raise HTTPException(
+            status_code=422, detail=f"Unknown views or formats: {sorted(unknown)}"
+        )
+
+    data, variables = session.solution.data, session.solution.variables
+    with recorder_for(data, session_id).timer("export"):
+        archive = await export_zip(
+            data, variables, selected_views, selected_formats, export_executor
+        )
+    return Response(
+        archive,
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{session_id}.zip"'},
+    )
+
+
+@app.post("/batch")
+async def batch(request: Request):
+    """Solves many inputs and streams the progress of each of them.
+
+    The body lists `inputs`, files or directories relative to `batch_inputs`,
+    an optional default `budget` for each input and a `batch_id`. Results are
+    written to generated/batch/<batch_id>/, and posting an earlier `batch_id`
+    again resumes that batch. The batch keeps running if the client goes away.
+    """
+    try:
+        body = await request.json()
+        batch_id = body.get("batch_id") or str(uuid.uuid4())
+        budget = SolveBudget(**(body.get("budget") or {}))
+    except (ValueError, TypeError, AttributeError) as e:
+        raise HTTPException(status_code=422, detail=f"Invalid batch: {e}")
+    if not re.fullmatch(r"[\w-]+", batch_id):
+        raise HTTPException(status_code=422, detail="Invalid batch_id")
+    if batch_id in batches:
+        raise HTTPException(status_code=409, detail="Batch is already running")
+    try:
+        inputs = find_inputs(body.get("inputs") or [], batch_inputs)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    missing = [str(path) for path in inputs if not path.is_file()]
+    if not inputs or missing:
+        raise HTTPException(
+            status_code=422, detail={"message": "No inputs found", "missing": missing}
+        )
+
+    queue: asyncio.Queue[BatchJob | None] = asyncio.Queue()
+    batch = Batch(
+        inputs,
+        f"generated/batch/{batch_id}",
+        budget,
+        solver_pool,
+        on_progress=lambda job: queue.put_nowait(BatchJob(**asdict(job))),
+    )
+    batches[batch_id] = batch
+    batch.start()
+    assert batch.task is not None
+    batch.task.add_done_callback(
+        lambda _: (batches.pop(batch_id, None), queue.put_nowait(None))
+    )
+
+    async def progress():
+        seq = 0
+        yield sse("batch", seq, {"batch_id": batch_id, **batch.stats()})
+        while (job := await queue.get()) is not None:
+            seq += 1
+            yield sse("job", seq, asdict(job))
+        yield sse("done", seq + 1, batch.stats())
+
+    return StreamingResponse(progress(), media_type="text/event-stream")
+
+
+@app.get("/batch/{batch_id}")
+async def batch_state(batch_id: str):
+    """Reports the jobs of a running or finished batch."""
+    if batch_id in batches:
+        return batches[batch_id].state()
+    if not re.fullmatch(r"[\w-]+", batch_id):
+        raise HTTPException(status_code=404, detail="Batch not found")
+    state = writer.read(f"generated/batch/{batch_id}/batch.json")
+    if state is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return state
 
 
 @app.get("/cancel/{session_id}")
 async def cancel(session_id: str):
     """Cancels the scheduling process for a given session."""
-    if session_id not in session_schedules:
+    session = await session_store.get(session_id)
+    if session is None or session.schedule is None:
         raise HTTPException(status_code=404, detail="Session ID not found")
 
-    # Cancel the scheduling process
-    await session_schedules[session_id].cancel()
-    if session_id in data_queues:
-        await data_queues[session_id].put(None)
-
-    # Remove the schedule from memory
-    del session_schedules[session_id]
-    # Remove the data from memory
-    del session_data[session_id]
+    # Cancel the scheduling process and remove the session
+    await session_store.remove(session_id)
 
     return {"message": "Scheduling process cancelled"}
 
 
+@app.get("/sessions")
+async def sessions_stats():
+    """Reports live session counts and evictions."""
+    return session_store.stats()
+
+
+@app.get("/solver-pool")
+async def solver_pool_stats():
+    """Reports solver thread usage and queue depth."""
+    return solver_pool.stats()
+
+
+@app.get("/model-cache")
+async def model_cache_stats():
+    """Reports hit/miss counters of the compiled model cache."""
+    return model_cache.stats()
+
+
+def collect_metrics():
+    recorder = metrics.recorder()
+    stats = {**solver_pool.stats(), **session_store.stats(), **writer.stats()}
+    for name, value in stats.items():
+        recorder.gauge(f"schedule_{name}", value)
+    process = psutil.Process()
+    # MiniZinc runs its solvers as child processes, CP-SAT runs in process
+    recorder.gauge("schedule_solver_processes", len(process.children(recursive=True)))
+    recorder.gauge("schedule_resident_memory_bytes", process.memory_info().rss)
+
+
+metrics.add_collector(collect_metrics)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_text():
+    """Stage timings, solver statistics and load in Prometheus text format."""
+    return metrics.prometheus()
+
+
 if __name__ == "__main__":
     import uvicorn
 
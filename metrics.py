@@ -0,0 +1,242 @@
+import bisect
+import json
+import math
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Protocol
+
+import psutil
+
+from data import ScheduleData
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+BYTES_BUCKETS = tuple(2.0**n for n in range(20, 36, 2))
+COUNT_BUCKETS = tuple(10.0**n for n in range(1, 10))
+
+# Statistics MiniZinc reports for a solve, with the metric and unit scale they
+# are recorded as, peakMem is in megabytes
+MINIZINC_STATISTICS = {
+    "nodes": ("schedule_solver_nodes", 1),
+    "failures": ("schedule_solver_failures", 1),
+    "peakMem": ("schedule_solver_memory_bytes", 2**20),
+}
+
+
+@dataclass
+class Sample:
+    kind: str  # "histogram", "gauge" or "counter"
+    name: str
+    value: float
+    labels: dict[str, str]
+    session: str | None = None
+    timestamp: float = field(default_factory=time.time)
+
+
+class MetricsSink(Protocol):
+    def record(self, sample: Sample) -> Any: ...
+
+
+class LogSink:
+    """Writes every sample as one JSON line, including its session."""
+
+    def __init__(self, write: Callable[[str], Any] = print):
+        self.write = write
+
+    def record(self, sample: Sample):
+        self.write(
+            json.dumps(
+                {
+                    "metric": sample.name,
+                    "value": sample.value,
+                    "session": sample.session,
+                    "time": sample.timestamp,
+                    **sample.labels,
+                }
+            )
+        )
+
+
+@dataclass
+class Histogram:
+    buckets: tuple[float, ...]
+    counts: list[int]
+    sum: float = 0.0
+    count: int = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class HistogramSink:
+    """Aggregates samples in process and renders them as Prometheus text.
+
+    Sessions are dropped here to keep the number of series bounded, use a
+    `LogSink` to follow a single session.
+    """
+
+    def __init__(self):
+        self.histograms: dict[str, dict[tuple[tuple[str, str], ...], Histogram]] = {}
+        self.values: dict[str, dict[tuple[tuple[str, str], ...], float]] = {}
+        self.kinds: dict[str, str] = {}
+
+    def record(self, sample: Sample):
+        key = tuple(sorted(sample.labels.items()))
+        self.kinds[sample.name] = sample.kind
+        if sample.kind == "histogram":
+            series = self.histograms.setdefault(sample.name, {})
+            if key not in series:
+                buckets = buckets_for(sample.name)
+                series[key] = Histogram(buckets, [0] * (len(buckets) + 1))
+            series[key].observe(sample.value)
+        elif sample.kind == "counter":
+            series = self.values.setdefault(sample.name, {})
+            series[key] = series.get(key, 0.0) + sample.value
+        else:
+            self.values.setdefault(sample.name, {})[key] = sample.value
+
+    def render(self):
+        lines: list[str] = []
+        for name, series in sorted(self.histograms.items()):
+            lines.append(f"# TYPE {name} histogram")
+            for key, histogram in sorted(series.items()):
+                cumulative = 0
+                for bound, count in zip(
+                    [*histogram.buckets, math.inf], histogram.counts
+                ):
+                    cumulative += count
+                    le = "+Inf" if bound == math.inf else f"{bound:g}"
+                    lines.append(f"{name}_bucket{labels_text(key, le=le)} {cumulative}")
+                lines.append(f"{name}_sum{labels_text(key)} {histogram.sum:g}")
+                lines.append(f"{name}_count{labels_text(key)} {histogram.count}")
+        for name, values in sorted(self.values.items()):
+            lines.append(f"# TYPE {name} {self.kinds[name]}")
+            for key, value in sorted(values.items()):
+                lines.append(f"{name}{labels_text(key)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+def buckets_for(name: str):
+    if name.endswith("_seconds"):
+        return SECONDS_BUCKETS
+    if name.endswith("_bytes"):
+        return BYTES_BUCKETS
+    return COUNT_BUCKETS
+
+
+def labels_text(key: tuple[tuple[str, str], ...], **extra: str):
+    pairs = [*key, *extra.items()]
+    if not pairs:
+        return ""
+    escaped = ((k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+class Metrics:
+    """Sends samples to every sink.
+
+    Collectors run before each render, to sample values such as queue
+    lengths that are read rather than recorded as they change.
+    """
+
+    def __init__(self, sinks: list[MetricsSink] | None = None):
+        self.sinks: list[MetricsSink] = sinks if sinks is not None else []
+        self.collectors: list[Callable[[], Any]] = []
+
+    def record(self, sample: Sample):
+        for sink in self.sinks:
+            sink.record(sample)
+
+    def recorder(self, session: str | None = None, **labels: str):
+        return Recorder(self, session, labels)
+
+    def add_collector(self, collector: Callable[[], Any]):
+        self.collectors.append(collector)
+
+    def prometheus(self):
+        for collector in self.collectors:
+            collector()
+        return "".join(
+            sink.render() for sink in self.sinks if isinstance(sink, HistogramSink)
+        )
+
+
+@dataclass
+class Recorder:
+    """Records samples for one session with a fixed set of labels."""
+
+    metrics: Metrics
+    session: str | None = None
+    labels: dict[str, str] = field(default_factory=dict)
+
+    def bind(self, **labels: str):
+        return Recorder(self.metrics, self.session, {**self.labels, **labels})
+
+    def record(self, kind: str, metric: str, value: float, labels: dict[str, str]):
+        self.metrics.record(
+            Sample(kind, metric, value, {**self.labels, **labels}, self.session)
+        )
+
+    def observe(self, metric: str, value: float, **labels: str):
+        self.record("histogram", metric, value, labels)
+
+    def gauge(self, metric: str, value: float, **labels: str):
+        self.record("gauge", metric, value, labels)
+
+    def count(self, metric: str, value: float = 1, **labels: str):
+        self.record("counter", metric, value, labels)
+
+    def stage(self, stage: str, seconds: float):
+        self.observe("schedule_stage_seconds", seconds, stage=stage)
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage(stage, time.perf_counter() - start)
+
+    def solution(self, seconds: float, objective: Any, variables: dict[str, Any]):
+        """Records a new solution found `seconds` after the solve started."""
+        self.count("schedule_solutions_total")
+        self.gauge("schedule_solution_seconds", seconds)
+        if objective is not None:
+            self.gauge("schedule_objective", objective, name="objective")
+        for name in ("max_distance", "sum_distances"):
+            if name in variables:
+                self.gauge("schedule_objective", variables[name], name=name)
+
+    def solver_statistics(self, statistics: dict[str, Any]):
+        for key, (name, scale) in MINIZINC_STATISTICS.items():
+            if isinstance(statistics.get(key), (int, float)):
+                self.observe(name, statistics[key] * scale)
+
+
+def rss_bytes() -> int:
+    """Resident memory of this process, sampled around model builds.
+
+    Other threads keep allocating meanwhile, so the growth over a build is
+    approximate when several jobs build at once.
+    """
+    return psutil.Process().memory_info().rss
+
+
+def school_size(data: ScheduleData):
+    """Coarse size class of a school, small enough to use as a label."""
+    for limit in (50, 200, 500, 1000):
+        if data.num_subjects <= limit:
+            return f"<={limit}"
+    return ">1000"
+
+
+def recorder_for(data: ScheduleData, session: str | None = None):
+    return metrics.recorder(
+        session, backend=data.config.backend, size=school_size(data)
+    )
+
+
+metrics = Metrics([HistogramSink()])  # Add a LogSink() to log every sample
@@ -0,0 +1,113 @@
+import hashlib
+import os
+import shutil
+from pathlib import Path
+from typing import Any
+
+import minizinc
+
+from binary_format import update_digest
+
+
+class CachedSolution:
+    """Solution type for instances solved from a cached FlatZinc file."""
+
+    def __init__(self, **kwargs: Any):
+        self.__dict__.update(kwargs)
+
+
+class ModelCache:
+    """Content-addressed on-disk cache of flattened MiniZinc instances.
+
+    Entries are keyed on the solver, the model file and the instance data.
+    The least recently used entries are evicted once `max_entries` is exceeded.
+    """
+
+    def __init__(self, directory: str = "generated/model_cache", max_entries: int = 32):
+        self.directory = Path(directory)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, solver: minizinc.Solver, model_path: str, data: dict[str, Any]):
+        digest = hashlib.sha256()
+        digest.update(f"{solver.id}@{solver.version}\0".encode())
+        digest.update(Path(model_path).read_bytes())
+        update_digest(digest, data)
+        return digest.hexdigest()
+
+    def paths(self, key: str):
+        return self.directory / f"{key}.fzn", self.directory / f"{key}.ozn"
+
+    def instance(
+        self, solver: minizinc.Solver, model_path: str, data: dict[str, Any]
+    ) -> tuple[minizinc.Instance, dict[str, Any]]:
+        """Returns a FlatZinc instance and the extra flags needed to solve it.
+
+        Compiles and stores the instance on a cache miss. This blocks while
+        flattening, so run it off the event loop.
+        """
+        key = self.key(solver, model_path, data)
+        fzn, ozn = self.paths(key)
+
+        if fzn.exists() and ozn.exists():
+            self.hits += 1
+            os.utime(fzn)
+            os.utime(ozn)
+        else:
+            self.misses += 1
+            self.compile(solver, model_path, data, fzn, ozn)
+            self.evict()
+
+        model = minizinc.Model(fzn)
+        model.output_type = CachedSolution
+        return minizinc.Instance(solver, model), {"--ozn-file": str(ozn)}
+
+    def compile(
+        self,
+        solver: minizinc.Solver,
+        model_path: str,
+        data: dict[str, Any],
+        fzn: Path,
+        ozn: Path,
+    ):
+        instance = minizinc.Instance(solver, minizinc.Model(model_path))
+        for key, value in data.items():
+            instance[key] = value
+
+        self.directory.mkdir(exist_ok=True, parents=True)
+        with instance.flat(output_mode="json", output_objective=True) as (
+            fzn_file,
+            ozn_file,
+            _,
+        ):
+            # Copy under a temporary name first so readers never see partial files
+            for source, target in ((fzn_file.name, fzn), (ozn_file.name, ozn)):
+                tmp = target.with_suffix(target.suffix + ".tmp")
+                shutil.copyfile(source, tmp)
+                os.replace(tmp, target)
+
+    def evict(self):
+        entries = sorted(
+            self.directory.glob("*.fzn"), key=lambda path: path.stat().st_mtime
+        )
+        for fzn in entries[: max(0, len(entries) - self.max_entries)]:
+            fzn.unlink(missing_ok=True)
+            fzn.with_suffix(".ozn").unlink(missing_ok=True)
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": (
+                len(list(self.directory.glob("*.fzn")))
+                if self.directory.exists()
+                else 0
+            ),
+        }
+
+
+model_cache = ModelCache()
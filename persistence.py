@@ -0,0 +1,123 @@
+import gzip
+import json
+import mmap
+import os
+import threading
+from pathlib import Path
+from typing import Any
+
+
+class BackgroundWriter:
+    """Writes files on a background thread, off the event loop.
+
+    Only the latest content submitted for a path is written, so a burst of
+    solutions turns into one write. Bytes are written as they are, anything
+    else as JSON, serialized on the writer thread, so it must not be mutated
+    after it is submitted. Files are written next to their target and moved
+    into place, readers never see a partial file. JSON paths ending in `.gz`
+    are compressed.
+    """
+
+    def __init__(self):
+        self.pending: dict[Path, Any] = {}
+        self.writing: tuple[Path, Any] | None = None
+        self.changed = threading.Condition()
+        self.thread: threading.Thread | None = None
+        self.written = 0
+        self.coalesced = 0
+        self.failed = 0
+
+    def submit(self, path: str | Path, obj: Any):
+        path = Path(path)
+        with self.changed:
+            if path in self.pending:
+                self.coalesced += 1
+            self.pending[path] = obj
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name="background-writer", daemon=True
+                )
+                self.thread.start()
+            self.changed.notify_all()
+
+    def discard(self, path: str | Path):
+        """Drops a pending write and waits for one in progress to finish."""
+        path = Path(path)
+        with self.changed:
+            self.pending.pop(path, None)
+            self.changed.wait_for(
+                lambda: self.writing is None or self.writing[0] != path
+            )
+
+    def read(self, path: str | Path) -> Any | None:
+        """Reads a file, seeing writes that are still pending."""
+        path = Path(path)
+        with self.changed:
+            if path in self.pending:
+                return self.pending[path]
+            if self.writing is not None and self.writing[0] == path:
+                return self.writing[1]
+        if not path.exists():
+            return None
+        return read_file(path)
+
+    def flush(self, timeout: float | None = None):
+        """Waits until every submitted write is on disk."""
+        with self.changed:
+            return self.changed.wait_for(
+                lambda: not self.pending and self.writing is None, timeout
+            )
+
+    def run(self):
+        while True:
+            with self.changed:
+                self.changed.wait_for(lambda: bool(self.pending))
+                path = next(iter(self.pending))
+                self.writing = (path, self.pending.pop(path))
+            try:
+                write_file(path, self.writing[1])
+                self.written += 1
+            except (OSError, TypeError, ValueError) as e:
+                print(f"Failed to write {path}: {e}")
+                self.failed += 1
+            with self.changed:
+                self.writing = None
+                self.changed.notify_all()
+
+    def stats(self):
+        return {
+            "pending_writes": len(self.pending),
+            "written_files": self.written,
+            "coalesced_writes": self.coalesced,
+            "failed_writes": self.failed,
+        }
+
+
+def write_file(path: Path, obj: Any):
+    path.parent.mkdir(exist_ok=True, parents=True)
+    temporary = path.with_name(f".{path.name}.tmp")
+    if isinstance(obj, bytes):
+        with open(temporary, "wb") as f:
+            f.write(obj)
+    elif path.suffix == ".gz":
+        with gzip.open(temporary, "wt", encoding="utf-8") as f:
+            json.dump(obj, f)
+    else:
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(obj, f)
+    os.replace(temporary, path)
+
+
+def read_file(path: Path) -> Any:
+    """Reads JSON, or memory-maps a `.bin` file for zero-copy decoding."""
+    if path.suffix == ".bin":
+        with open(path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if path.suffix == ".gz":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return json.load(f)
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+writer = BackgroundWriter()
@@ -0,0 +1,313 @@
+import asyncio
+import hashlib
+import json
+import time
+from concurrent.futures import Executor
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Any
+
+import minizinc
+import numpy as np
+
+from binary_format import decode, dump_schedule_data
+from data import ScheduleData
+from data_minizinc import warm_start
+from metrics import Recorder, recorder_for
+from persistence import writer
+from schedule import Schedule, SolutionCallback, SolutionEvent
+from schedule_cpsat import CpSatSchedule
+from solver_pool import PositionCallback, SolverPool
+
+
+@dataclass
+class PortfolioEntry:
+    """One solver configuration raced in a portfolio.
+
+    `solver` is the MiniZinc solver used by the "minizinc" backend, e.g.
+    "gecode" or "chuffed". `parameters` are cp-sat SatParameters in text
+    format. `satisfy_first` makes the native cp-sat backend find any solution
+    before it starts optimizing.
+    """
+
+    backend: str = "cp-sat"
+    solver: str = "cp-sat"
+    random_seed: int | None = None
+    parameters: str | None = None
+    satisfy_first: bool = False
+
+    @property
+    def name(self):
+        parts = ["cp-sat" if self.backend == "cp-sat" else f"minizinc/{self.solver}"]
+        if self.random_seed is not None:
+            parts.append(f"seed={self.random_seed}")
+        if self.parameters:
+            parts.append(self.parameters)
+        if self.satisfy_first:
+            parts.append("satisfy-first")
+        return " ".join(parts)
+
+
+def default_entries() -> list[PortfolioEntry]:
+    """Native cp-sat variants, then every MiniZinc solver installed locally."""
+    entries = [
+        PortfolioEntry(),
+        PortfolioEntry(satisfy_first=True),
+        PortfolioEntry(parameters="optimize_with_core:true"),
+        PortfolioEntry(random_seed=1),
+    ]
+    for solver in ("cp-sat", "chuffed", "gecode"):
+        if solver_available(solver):
+            entries.append(PortfolioEntry("minizinc", solver))
+    return entries
+
+
+def solver_available(solver: str):
+    try:
+        minizinc.Solver.lookup(solver)
+    except (AssertionError, LookupError):
+        # No MiniZinc driver at all, or the solver isn't installed
+        return False
+    return True
+
+
+def input_fingerprint(data: ScheduleData):
+    """Hash of the input, the same for any budget and backend it is solved with."""
+    container = decode(dump_schedule_data(data))
+    meta = dict(container.meta, config=dict(container.meta["config"]))
+    del meta["budget"]
+    del meta["config"]["backend"]
+    digest = hashlib.sha256(json.dumps(meta, sort_keys=True).encode())
+    for name, section in sorted(container.sections.items()):
+        digest.update(f"{name}{section['shape']}\0".encode())
+        start = section["offset"]
+        digest.update(container.buffer[start : start + section["nbytes"]])
+    return digest.hexdigest()
+
+
+class PortfolioSchedule:
+    """Races several solver configurations on the same input.
+
+    Members share the thread allowance, one thread at least each, so with few
+    threads only the first entries run. Their solutions are merged into one
+    stream that only passes on improvements. Once a member proves optimality
+    or infeasibility the others are cancelled. The member that found the best
+    solution is recorded per input fingerprint in `winners_path` and raced
+    first the next time the same input is solved.
+    """
+
+    def __init__(
+        self,
+        schedule_data: ScheduleData,
+        entries: list[PortfolioEntry] | None = None,
+        winners_path: str = "generated/portfolio_winners.json",
+        **kwargs: Any,
+    ):
+        self.schedule_data = schedule_data
+        self.entries = entries or default_entries()
+        self.winners_path = Path(winners_path)
+        self.budget = kwargs.pop("budget", None) or schedule_data.budget
+        self.recorder: Recorder = (
+            kwargs.pop("recorder", None) or recorder_for(schedule_data)
+        ).bind(backend="portfolio")
+        self.kwargs = kwargs
+        self.previous: SolutionEvent | None = kwargs.get("previous")
+        self.members: list[tuple[PortfolioEntry, Schedule | CpSatSchedule]] = []
+        self.build_stats: dict[str, Any] = {}
+        self.task: asyncio.Task[None] | None = None
+
+    def member(self, i: int, entry: PortfolioEntry) -> Schedule | CpSatSchedule:
+        kwargs = dict(self.kwargs)
+        if kwargs.get("dump_directory") is not None:
+            # Keep the members from overwriting each other's dumps
+            kwargs["dump_directory"] = f"{kwargs['dump_directory']}/member_{i}"
+        budget = self.budget
+        if entry.random_seed is not None:
+            budget = replace(budget, random_seed=entry.random_seed)
+        recorder = self.recorder.bind(member=entry.name)
+
+        if entry.backend == "minizinc":
+            return Schedule(
+                self.schedule_data,
+                budget=budget,
+                recorder=recorder,
+                solver=entry.solver,
+                parameters=entry.parameters,
+                **kwargs,
+            )
+        return CpSatSchedule(
+            self.schedule_data,
+            budget=budget,
+            recorder=recorder,
+            parameters=entry.parameters,
+            satisfy_first=entry.satisfy_first,
+            **kwargs,
+        )
+
+    def solve(self, callback: SolutionCallback | None = None):
+        asyncio.run(self.iterate_solutions(callback))
+
+    async def solve_async(
+        self,
+        callback: SolutionCallback | None = None,
+        pool: SolverPool | None = None,
+        on_position: PositionCallback | None = None,
+    ):
+        if pool is None:
+            self.task = asyncio.create_task(self.iterate_solutions(callback))
+            return
+
+        self.task = asyncio.create_task(
+            pool.run(
+                lambda threads: self.iterate_solutions(
+                    callback, threads, pool.executor
+                ),
+                on_position,
+            )
+        )
+
+    async def iterate_solutions(
+        self,
+        callback: SolutionCallback | None = None,
+        processes: int | None = None,
+        executor: Executor | None = None,
+    ):
+        threads = [n for n in (processes, self.budget.threads) if n]
+        available = min(threads) if threads else 8
+        fingerprint = await asyncio.to_thread(input_fingerprint, self.schedule_data)
+        winners = self.winners()
+        entries = self.ranked(winners.get(fingerprint))[:available]
+        share = max(1, available // len(entries))
+        self.members = [(e, self.member(i, e)) for i, e in enumerate(entries)]
+
+        start = time.perf_counter()
+        stream = ImprovingStream(self.schedule_data, self.previous, callback)
+        winner: PortfolioEntry | None = None
+        seconds = 0.0
+        objective = None
+
+        def on_event(entry: PortfolioEntry, event: SolutionEvent | None):
+            nonlocal winner, seconds, objective
+            if event is not None and stream.offer(event):
+                winner, objective = entry, event.objective
+                seconds = time.perf_counter() - start
+
+        tasks = {
+            asyncio.create_task(
+                schedule.iterate_solutions(
+                    lambda event, entry=entry: on_event(entry, event), share, executor
+                )
+            ): schedule
+            for entry, schedule in self.members
+        }
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                # Everyone else can only tie with a proven result
+                if any(tasks[task].complete for task in done):
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        complete = any(schedule.complete for _, schedule in self.members)
+        self.build_stats = {
+            "backend": "portfolio",
+            "members": [entry.name for entry, _ in self.members],
+            "winner": winner.name if winner is not None else None,
+        }
+        print(self.build_stats)
+        if winner is not None:
+            self.recorder.count("schedule_portfolio_wins", member=winner.name)
+            winners[fingerprint] = {
+                "winner": winner.name,
+                "objective": objective,
+                "seconds": seconds,
+                "optimal": complete,
+            }
+            writer.submit(self.winners_path, winners)
+        if callback is not None:
+            callback(None)
+
+    def winners(self) -> dict[str, Any]:
+        # A copy, the writer may still hold the last submitted dict
+        return dict(writer.read(self.winners_path) or {})
+
+    def ranked(self, record: dict[str, Any] | None) -> list[PortfolioEntry]:
+        """Entries with the last winner on this input first."""
+        if record is None:
+            return list(self.entries)
+        return sorted(self.entries, key=lambda e: e.name != record["winner"])
+
+    async def cancel(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                print("Solver was cancelled.")
+
+
+class ImprovingStream:
+    """Passes on only the solutions that improve on the best one so far.
+
+    Solutions are ranked by maximum day distance, then by changes from the
+    previous solution, the order of the model objective. The rank is computed
+    from the variables because each backend scales its objective differently.
+    """
+
+    def __init__(
+        self,
+        data: ScheduleData,
+        previous: SolutionEvent | None,
+        callback: SolutionCallback | None,
+    ):
+        self.data = data
+        self.callback = callback
+        # The previous solution aligned to this input, to count changes from it
+        self.hints = (
+            warm_start(data, (previous.data, previous.variables))
+            if previous is not None
+            else None
+        )
+        self.best: tuple[int, int] | None = None
+
+    def offer(self, event: SolutionEvent):
+        """Forwards `event` if it improves on the best so far."""
+        rank = self.rank(event.variables)
+        if self.best is not None and rank >= self.best:
+            return False
+        self.best = rank
+        if self.callback is not None:
+            self.callback(event)
+        return True
+
+    def rank(self, variables: dict[str, Any]) -> tuple[int, int]:
+        data = self.data
+        distance = 0
+        if data.config.optimize_distance and variables.get("distances"):
+            distance = max(
+                (
+                    sum(d or 0 for d in day)
+                    for days in variables["distances"]
+                    for day in days
+                ),
+                default=0,
+            )
+
+        changes = 0
+        if self.hints is not None:
+            for name, previous in (
+                ("schedule_subjects", "previous__schedule_subjects"),
+                ("teacher_assignments", "previous__teacher_assignments"),
+                ("room_assignments", "previous__room_assignments"),
+            ):
+                if name in variables:
+                    changes += int(
+                        (np.asarray(variables[name]) != self.hints[previous]).sum()
+                    )
+        return distance, changes
@@ -0,0 +1,172 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+from data import ScheduleData
+from data_minizinc import Domains, presolve
+
+
+@dataclass
+class Issue:
+    check: str
+    entity: str
+    index: int
+    name: str
+    required: int
+    available: int
+
+    @property
+    def message(self):
+        return (
+            f"{self.entity} {self.name!r} fails {self.check}: "
+            f"needs {self.required}, has {self.available}"
+        )
+
+
+def precheck(data: ScheduleData) -> list[Issue]:
+    """Finds capacity violations that make the input infeasible.
+
+    The checks are necessary conditions only, so an empty report does not
+    guarantee that a timetable exists.
+    """
+    domains = presolve(data) if data.config.presolve else Domains.initial(data)
+    issues: list[Issue] = []
+
+    for s, subject in enumerate(data.subjects_data):
+        open_days = int(domains.periods[s].any(axis=1).sum())
+        # A subject is taught at most once per day
+        if subject.periods_per_week > open_days:
+            issues.append(
+                Issue(
+                    "days",
+                    "subject",
+                    s,
+                    subject.name,
+                    subject.periods_per_week,
+                    open_days,
+                )
+            )
+        teachers = int(domains.teachers[s].sum())
+        if subject.teachers_per_period > teachers:
+            issues.append(
+                Issue(
+                    "teachers_per_period",
+                    "subject",
+                    s,
+                    subject.name,
+                    subject.teachers_per_period,
+                    teachers,
+                )
+            )
+        rooms = int(domains.rooms[s].sum())
+        if data.config.schedule_rooms and subject.rooms_per_period > rooms:
+            issues.append(
+                Issue(
+                    "rooms_per_period",
+                    "subject",
+                    s,
+                    subject.name,
+                    subject.rooms_per_period,
+                    rooms,
+                )
+            )
+
+    for c, class_data in enumerate(data.classes_data):
+        subjects = [
+            s for s, subject in enumerate(data.subjects_data) if c in subject.classes
+        ]
+        required = sum(data.subjects_data[s].periods_per_week for s in subjects)
+        available = int(domains.periods[subjects].any(axis=0).sum())
+        if required > available:
+            issues.append(
+                Issue("slots", "class", c, class_data.name, required, available)
+            )
+
+    issues += check_teachers(data, domains)
+
+    if data.config.schedule_rooms:
+        issues += check_rooms(data, domains)
+
+    for q, course in enumerate(data.courses_data):
+        if course.teacher_distribution is None:
+            continue
+        required = sum(
+            data.subjects_data[s].teachers_per_period for s in course.subjects
+        )
+        at_least = sum(td.at_least for td in course.teacher_distribution)
+        at_most = sum(td.at_most for td in course.teacher_distribution)
+        if at_least > required:
+            issues.append(
+                Issue("at_least", "course", q, course.name, at_least, required)
+            )
+        if required > at_most:
+            issues.append(Issue("at_most", "course", q, course.name, required, at_most))
+
+    return issues
+
+
+def check_teachers(data: ScheduleData, domains: Domains) -> list[Issue]:
+    issues: list[Issue] = []
+    counts = domains.teachers.sum(axis=1)
+    tpp = np.array([s.teachers_per_period for s in data.subjects_data], dtype=int)
+    # Teachers are forced onto a subject when it has no spare eligible teachers
+    forced = domains.teachers & (counts == tpp)[:, None]
+    ppw = np.array([s.periods_per_week for s in data.subjects_data], dtype=int)
+    load = ppw @ forced
+
+    for course in data.courses_data:
+        for td in course.teacher_distribution or []:
+            optional = sorted(
+                data.subjects_data[s].periods_per_week
+                for s in course.subjects
+                if domains.teachers[s, td.teacher] and not forced[s, td.teacher]
+            )
+            already = sum(1 for s in course.subjects if forced[s, td.teacher])
+            load[td.teacher] += sum(optional[: max(0, td.at_least - already)])
+
+    available = data.teachers_available.sum(axis=(1, 2))
+    for t in np.nonzero(load > available)[0]:
+        issues.append(
+            Issue(
+                "load",
+                "teacher",
+                int(t),
+                data.teachers_data[t].name,
+                int(load[t]),
+                int(available[t]),
+            )
+        )
+
+    required = int(ppw @ tpp)
+    total = int(available.sum())
+    if required > total:
+        issues.append(Issue("load", "teachers", -1, "all", required, total))
+    return issues
+
+
+def check_rooms(data: ScheduleData, domains: Domains) -> list[Issue]:
+    issues: list[Issue] = []
+    counts = domains.rooms.sum(axis=1)
+    rpp = np.array([s.rooms_per_period for s in data.subjects_data], dtype=int)
+    forced = domains.rooms & (counts == rpp)[:, None]
+    ppw = np.array([s.periods_per_week for s in data.subjects_data], dtype=int)
+    load = ppw @ forced
+
+    available = data.rooms_available.sum(axis=(1, 2))
+    for r in np.nonzero(load > available)[0]:
+        issues.append(
+            Issue(
+                "load",
+                "room",
+                int(r),
+                data.rooms_data[r].name,
+                int(load[r]),
+                int(available[r]),
+            )
+        )
+
+    required = int(ppw @ rpp)
+    total = int(available.sum())
+    if required > total:
+        issues.append(Issue("load", "rooms", -1, "all", required, total))
+    return issues
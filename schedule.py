@@ -1,16 +1,25 @@
 import asyncio
-import json
+import tempfile
 import time
 from asyncio.subprocess import Process
+from concurrent.futures import Executor
+from contextlib import aclosing
+from dataclasses import dataclass
+from datetime import timedelta
+from pathlib import Path
 from tkinter import E
 from typing import Any, Callable
 
 import minizinc
 import psutil
 
-from data import ScheduleData
+from data import ScheduleData, SolveBudget
 from data_minizinc import minizinc_data
-from utils import create_file
+from metrics import Recorder, recorder_for, rss_bytes
+from model_cache import ModelCache, model_cache
+from persistence import writer
+from solution_decoder import expand_weeks
+from solver_pool import PositionCallback, SolverPool
 
 
 def kill_process_group(proc: Process):
@@ -54,49 +63,234 @@ def kill_process_tree(pid: int):
         pass  # Process already gone
 
 
+@dataclass
+class SolutionEvent:
+    """A solution handed from the solver to its consumers without serialization."""
+
+    data: ScheduleData
+    variables: dict[str, Any]
+    objective: Any = None
+
+
+SolutionCallback = Callable[[SolutionEvent | None], Any]
+
+
 class Schedule:
-    def __init__(self, schedule_data: ScheduleData):
+    def __init__(
+        self,
+        schedule_data: ScheduleData,
+        cache: ModelCache | None = model_cache,
+        budget: SolveBudget | None = None,
+        previous: SolutionEvent | None = None,
+        recorder: Recorder | None = None,
+        dump_directory: str | None = None,
+        solver: str = "cp-sat",
+        parameters: str | None = None,
+    ):
         self.schedule_data = schedule_data
-        self.data = minizinc_data(schedule_data)
-
-        with create_file("generated/minizinc_data.json") as f:
-            json.dump(self.data, f)
+        self.budget = budget or schedule_data.budget
+        # Solution to warm start from, changes to it are minimized
+        self.previous = previous
+        # Debug dumps of the solver input and latest output, off when None
+        self.dump_directory = Path(dump_directory) if dump_directory else None
+        self.data: dict[str, Any] = {}
 
-        self.solver = minizinc.Solver.lookup("cp-sat")
-        self.model = minizinc.Model("model.mzn")
-        self.instance = minizinc.Instance(self.solver, self.model)
+        self.solver_name = solver
+        self.solver = minizinc.Solver.lookup(solver)
+        # Extra cp-sat SatParameters in text format
+        self.parameters = parameters
+        self.cache = cache
+        # Holds the flattened model while solving when there is no cache
+        self.scratch: tempfile.TemporaryDirectory[str] | None = None
+        self.instance: minizinc.Instance | None = None
+        self.solve_flags: dict[str, Any] = {}
+        self.build_stats: dict[str, Any] = {}
+        self.recorder = (recorder or recorder_for(schedule_data)).bind(
+            backend="minizinc"
+        )
 
-        self.assign_data()
+        # Set once the solver proved optimality or infeasibility
+        self.complete = False
         self.task: asyncio.Task[None] | None = None
 
-    def assign_data(self):
-        for key, value in self.data.items():
-            self.instance[key] = value
+    async def prepare(self, executor: Executor | None = None):
+        loop = asyncio.get_running_loop()
+        previous = (
+            (self.previous.data, self.previous.variables)
+            if self.previous is not None
+            else None
+        )
+        with self.recorder.timer("minizinc_data"):
+            self.data = await loop.run_in_executor(
+                executor, minizinc_data, self.schedule_data, previous
+            )
+
+        if self.dump_directory is not None:
+            writer.submit(self.dump_directory / "minizinc_data.json", self.data)
+
+    def load_instance(self):
+        cache = self.cache
+        if cache is None:
+            # Flattened apart from solving as on a cache miss, so it can be measured
+            self.scratch = tempfile.TemporaryDirectory()
+            cache = ModelCache(self.scratch.name)
+        self.instance, self.solve_flags = cache.instance(
+            self.solver, "model.mzn", self.data
+        )
 
-    def solve(self, callback: Callable[[Any], Any] | None = None):
+    def solve(self, callback: SolutionCallback | None = None):
         asyncio.run(self.iterate_solutions(callback))
 
-    async def solve_async(self, callback: Callable[[Any], Any] | None = None):
-        self.task = asyncio.create_task(self.iterate_solutions(callback))
+    async def solve_async(
+        self,
+        callback: SolutionCallback | None = None,
+        pool: SolverPool | None = None,
+        on_position: PositionCallback | None = None,
+    ):
+        if pool is None:
+            self.task = asyncio.create_task(self.iterate_solutions(callback))
+            return
 
-    async def iterate_solutions(self, callback: Callable[[Any], Any] | None = None):
+        self.task = asyncio.create_task(
+            pool.run(
+                lambda threads: self.iterate_solutions(
+                    callback, threads, pool.executor
+                ),
+                on_position,
+            )
+        )
+
+    def budget_flags(self) -> dict[str, Any]:
+        flags: dict[str, Any] = {}
+        if self.budget.time_limit is not None:
+            flags["time_limit"] = timedelta(seconds=self.budget.time_limit)
+        if self.budget.random_seed is not None:
+            flags["random_seed"] = self.budget.random_seed
+        if self.solver_name != "cp-sat":
+            return flags
+        # Passed through to cp-sat as a SatParameters text proto
+        params = [self.parameters] if self.parameters else []
+        if self.budget.relative_gap is not None:
+            params.append(f"relative_gap_limit:{self.budget.relative_gap}")
+        if params:
+            flags["--params"] = " ".join(params)
+        return flags
+
+    def budget_reached(self, num_solutions: int, result: minizinc.Result):
+        if (
+            self.budget.max_solutions is not None
+            and num_solutions >= self.budget.max_solutions
+        ):
+            return True
+
+        bound = result.statistics.get("objectiveBound")
+        if (
+            self.budget.relative_gap is not None
+            and bound is not None
+            and result.objective is not None
+        ):
+            gap = abs(result.objective - bound) / max(1, abs(result.objective))
+            return gap <= self.budget.relative_gap
+
+        return False
+
+    async def iterate_solutions(
+        self,
+        callback: SolutionCallback | None = None,
+        processes: int | None = None,
+        executor: Executor | None = None,
+    ):
         print("Iterating solutions")
+        threads = [n for n in (processes, self.budget.threads) if n]
         try:
-            async for result in self.instance.solutions(
-                processes=8, intermediate_solutions=True
-            ):
-                if result.solution is not None:
-                    self.save_variables(result.solution.__dict__)
-                    if callback is not None:
-                        callback(self.solution_json(result.solution.__dict__))
-                print(result.statistics)
-                print(result.status)
+            start = time.perf_counter()
+            rss = rss_bytes()
+            await self.prepare(executor)
+            # Flattening on a cache miss is slow, keep it off the event loop
+            with self.recorder.timer("flatten"):
+                await asyncio.to_thread(self.load_instance)
+            assert self.instance is not None
+            # The flattening itself runs in a minizinc process, its output size
+            # stands in for its memory
+            memory = max(0, rss_bytes() - rss)
+            self.recorder.observe("schedule_build_memory_bytes", memory)
+            fzn = Path(self.solve_flags["--ozn-file"]).with_suffix(".fzn")
+            self.build_stats = {
+                "backend": "minizinc",
+                "build_seconds": time.perf_counter() - start,
+                "build_memory_bytes": memory,
+                "model_bytes": fzn.stat().st_size,
+            }
+            print(self.build_stats)
+            solutions = self.instance.solutions(
+                processes=min(threads) if threads else 8,
+                intermediate_solutions=True,
+                **self.budget_flags(),
+                **self.solve_flags,
+            )
+            num_solutions = 0
+            elapsed = 0.0
+            statistics: dict[str, Any] = {}
+            # Closing the generator stops the solver when the budget runs out
+            async with aclosing(solutions):
+                while True:
+                    try:
+                        # Before the first solution only the time limit applies
+                        result = await asyncio.wait_for(
+                            anext(solutions),
+                            (
+                                self.budget.no_improvement_timeout
+                                if num_solutions
+                                else None
+                            ),
+                        )
+                    except StopAsyncIteration:
+                        break
+                    except TimeoutError:
+                        print("No improvement within budget")
+                        break
+
+                    statistics = result.statistics
+                    if result.solution is not None:
+                        num_solutions += 1
+                        # The model only decides the base week
+                        variables = expand_weeks(
+                            self.schedule_data, result.solution.__dict__
+                        )
+                        elapsed = time.perf_counter() - start
+                        if num_solutions == 1:
+                            self.recorder.stage("first_solution", elapsed)
+                        self.recorder.solution(elapsed, result.objective, variables)
+                        self.save_variables(variables)
+                        if callback is not None:
+                            callback(
+                                SolutionEvent(
+                                    self.schedule_data, variables, result.objective
+                                )
+                            )
+                    print(result.statistics)
+                    print(result.status)
+                    if result.status in (
+                        minizinc.Status.OPTIMAL_SOLUTION,
+                        minizinc.Status.UNSATISFIABLE,
+                    ):
+                        self.complete = True
+                    if self.budget_reached(num_solutions, result):
+                        print("Solve budget reached")
+                        break
+            if num_solutions:
+                self.recorder.stage("best_solution", elapsed)
+            self.recorder.solver_statistics(statistics)
             if callback is not None:
                 callback(None)
         except Exception as e:
             print(e)
             if callback is not None:
                 callback(None)
+        finally:
+            if self.scratch is not None:
+                self.scratch.cleanup()
+                self.scratch = None
         print("Finished iterating solutions")
 
     async def cancel(self):
@@ -108,9 +302,9 @@ class Schedule:
                 print("Solver was cancelled.")
 
     def save_variables(self, obj: dict[str, Any]):
-        with create_file("generated/variable_values.json") as f:
-            json.dump({"input": self.schedule_data.to_json_object(), "output": obj}, f)
-        print("saved variables")
-
-    def solution_json(self, obj: dict[str, Any]):
-        return json.dumps({"input": self.schedule_data.to_json_object(), "output": obj})
+        if self.dump_directory is None:
+            return
+        writer.submit(
+            self.dump_directory / "variable_values.json",
+            {"input": self.schedule_data.to_json_object(), "output": obj},
+        )
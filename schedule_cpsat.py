@@ -0,0 +1,643 @@
+import asyncio
+import time
+from concurrent.futures import Executor
+from typing import Any
+
+import numpy as np
+from numpy.typing import NDArray
+from ortools.sat.python import cp_model
+
+from data import ScheduleData, SolveBudget
+from data_minizinc import Domains, base_week, presolve, symmetries_for, warm_start
+from metrics import Recorder, recorder_for, rss_bytes
+from schedule import SolutionCallback, SolutionEvent
+from solver_pool import PositionCallback, SolverPool
+
+
+class CpSatModel:
+    """The constraints of model.mzn built directly as a CP-SAT model.
+
+    Products of 0/1 variables are encoded as reified conjunctions and only
+    created where more than one subject competes for the same teacher, room
+    or class slot. With alternating weeks, week B reuses the literals of the
+    base week, so products and constraints it would only repeat are shared.
+    """
+
+    def __init__(
+        self,
+        data: ScheduleData,
+        previous: tuple[ScheduleData, dict[str, Any]] | None = None,
+    ):
+        self.data = data
+        self.model = cp_model.CpModel()
+        self.domains = presolve(data) if data.config.presolve else Domains.initial(data)
+        self.symmetries = symmetries_for(data, self.domains, previous)
+
+        # Lessons over the full horizon, week B mostly shares base week literals
+        self.x: dict[tuple[int, int, int], cp_model.IntVar] = {}
+        self.teachers: dict[tuple[int, int], cp_model.IntVar] = {}
+        self.rooms: dict[tuple[int, int], cp_model.IntVar] = {}
+        self.distances: dict[tuple[int, int, int], cp_model.IntVar] = {}
+        self.max_distance: cp_model.IntVar | None = None
+        self.sum_distances: cp_model.IntVar | None = None
+        # Shared literals and constraints, by the indices of their operands
+        self.conjunctions: dict[tuple[int, int], cp_model.IntVar] = {}
+        self.products: dict[tuple[int, int], cp_model.IntVar] = {}
+        self.sums: dict[tuple[Any, ...], cp_model.IntVar] = {}
+        self.posted: set[Any] = set()
+
+        self.add_subjects()
+        self.add_teachers()
+        if data.config.schedule_rooms:
+            self.add_rooms()
+        self.add_symmetry_breaking()
+        if (
+            data.config.optimize_distance
+            and data.config.schedule_rooms
+            and data.room_distances is not None
+        ):
+            self.add_distances()
+        self.add_objective(previous)
+
+        self.x_index = self.index(
+            self.x, (data.num_subjects, data.num_days, data.num_periods)
+        )
+        self.teacher_index = self.index(
+            self.teachers, (data.num_subjects, data.num_teachers)
+        )
+        self.room_index = self.index(self.rooms, (data.num_subjects, data.num_rooms))
+        self.distance_index = self.index(
+            self.distances,
+            (data.num_classes, data.num_days, max(0, data.num_periods - 1)),
+        )
+
+    @staticmethod
+    def index(variables: dict[Any, cp_model.IntVar], shape: tuple[int, ...]):
+        index = np.full(shape, -1, dtype=np.intp)
+        for key, var in variables.items():
+            index[key] = var.Index()
+        return index
+
+    def add_subjects(self):
+        data, model = self.data, self.model
+        base_slots, once_slots = base_week(data, self.domains)
+        num_base_days = base_slots.shape[1]
+        weeks = 2 if data.config.use_alternating_weeks else 1
+
+        odd = [
+            data.config.use_alternating_weeks and subject.periods_per_week % 2 == 1
+            for subject in data.subjects_data
+        ]
+        # Subjects taught the same in both weeks are decided once for both
+        for s, d, p in np.argwhere(base_slots).tolist():
+            if not odd[s]:
+                x = model.NewBoolVar(f"x[{s},{d},{p}]")
+                for w in range(weeks):
+                    self.x[s, d + w * num_base_days, p] = x
+        # Odd subjects are decided per week, all but one lesson in both
+        for s, d, p in np.argwhere(once_slots).tolist():
+            self.x[s, d, p] = model.NewBoolVar(f"x[{s},{d},{p}]")
+
+        for s, subject in enumerate(data.subjects_data):
+            if odd[s]:
+                lessons = [
+                    self.x[s, d, p] for d, p in np.argwhere(once_slots[s]).tolist()
+                ]
+                both = [
+                    self.conjunction(self.x[s, d, p], self.x[s, d + num_base_days, p])
+                    for d, p in np.argwhere(base_slots[s]).tolist()
+                ]
+                model.Add(sum(both) == subject.periods_per_week // 2)
+            else:
+                lessons = [
+                    weeks * self.x[s, d, p]
+                    for d, p in np.argwhere(base_slots[s]).tolist()
+                ]
+            model.Add(sum(lessons) == subject.periods_per_week)
+            for d in data.days:
+                self.add_at_most_one(
+                    [self.x[s, d, p] for p in data.periods if (s, d, p) in self.x]
+                )
+
+        by_class: dict[int, list[int]] = {c: [] for c in data.classes}
+        for s, subject in enumerate(data.subjects_data):
+            for c in subject.classes:
+                by_class[c].append(s)
+        for c, subjects in by_class.items():
+            for d in data.days:
+                for p in data.periods:
+                    self.add_at_most_one(
+                        [self.x[s, d, p] for s in subjects if (s, d, p) in self.x]
+                    )
+
+    def add_at_most_one(self, literals: list[cp_model.IntVar]):
+        """Posts an at most one, unless it is trivial or already posted."""
+        key = frozenset(v.Index() for v in literals)
+        if len(key) > 1 and key not in self.posted:
+            self.posted.add(key)
+            self.model.AddAtMostOne(literals)
+
+    def add_assignments(
+        self,
+        feasible: NDArray[np.bool_],
+        per_period: list[int],
+        available: NDArray[np.bool_],
+        assignments: dict[tuple[int, int], cp_model.IntVar],
+        name: str,
+    ):
+        data, model = self.data, self.model
+        for s, e in np.argwhere(feasible).tolist():
+            assignments[s, e] = model.NewBoolVar(f"{name}[{s},{e}]")
+        for s in data.subjects:
+            model.Add(
+                sum(assignments[s, e] for e in np.flatnonzero(feasible[s]))
+                == per_period[s]
+            )
+
+        for e in range(feasible.shape[1]):
+            subjects = np.flatnonzero(feasible[:, e]).tolist()
+            for d in data.days:
+                for p in data.periods:
+                    here = [s for s in subjects if (s, d, p) in self.x]
+                    if not available[e, d, p]:
+                        # Assigned entities can't be used where they are unavailable
+                        for s in here:
+                            a, x = assignments[s, e], self.x[s, d, p]
+                            key = ("unavailable", a.Index(), x.Index())
+                            if key not in self.posted:
+                                self.posted.add(key)
+                                model.AddImplication(a, x.Not())
+                        continue
+                    if len(here) < 2:
+                        continue
+                    self.add_at_most_one(
+                        [self.busy(assignments[s, e], self.x[s, d, p]) for s in here]
+                    )
+
+    def busy(self, assignment: cp_model.IntVar, x: cp_model.IntVar):
+        """A literal that is true at least when both are, shared between weeks."""
+        key = (assignment.Index(), x.Index())
+        if key not in self.products:
+            y = self.model.NewBoolVar("")
+            self.model.AddBoolOr([assignment.Not(), x.Not(), y])
+            self.products[key] = y
+        return self.products[key]
+
+    def add_teachers(self):
+        data = self.data
+        self.add_assignments(
+            self.domains.teachers,
+            [s.teachers_per_period for s in data.subjects_data],
+            data.teachers_available,
+            self.teachers,
+            "teacher",
+        )
+
+        for course in data.courses_data:
+            if course.teacher_distribution is None:
+                continue
+            at_least = [0] * data.num_teachers
+            at_most = [0] * data.num_teachers
+            for td in course.teacher_distribution:
+                at_least[td.teacher] = td.at_least
+                at_most[td.teacher] = td.at_most
+            for t in data.teachers:
+                assigned = cp_model.LinearExpr.Sum(
+                    [
+                        self.teachers[s, t]
+                        for s in course.subjects
+                        if (s, t) in self.teachers
+                    ]
+                )
+                self.model.AddLinearConstraint(assigned, at_least[t], at_most[t])
+
+    def add_rooms(self):
+        data = self.data
+        self.add_assignments(
+            self.domains.rooms,
+            [s.rooms_per_period for s in data.subjects_data],
+            data.rooms_available,
+            self.rooms,
+            "room",
+        )
+
+    def add_symmetry_breaking(self):
+        data = self.data
+        for assignments, groups in (
+            (self.teachers, self.symmetries.teachers),
+            (self.rooms, self.symmetries.rooms),
+        ):
+            for group in groups:
+                for a, b in zip(group, group[1:]):
+                    # Equivalent entities are eligible for the same subjects
+                    keys = [s for s in data.subjects if (s, a) in assignments]
+                    self.lex_greater_equal(
+                        [assignments[s, a] for s in keys],
+                        [assignments[s, b] for s in keys],
+                    )
+
+        half = data.num_days // 2
+        weeks = [0, half] if data.config.use_alternating_weeks else [0]
+        for group in self.symmetries.days:
+            for a, b in zip(group, group[1:]):
+                keys = [
+                    (s, w, p)
+                    for w in weeks
+                    for p in data.periods
+                    for s in data.subjects
+                    if (s, a + w, p) in self.x
+                ]
+                self.lex_greater_equal(
+                    [self.x[s, a + w, p] for s, w, p in keys],
+                    [self.x[s, b + w, p] for s, w, p in keys],
+                )
+
+    def lex_greater_equal(self, a: list[cp_model.IntVar], b: list[cp_model.IntVar]):
+        """Orders two vectors of 0/1 variables lexicographically, `a` >= `b`."""
+        model = self.model
+        # equal is true while all earlier positions are equal
+        equal = None
+        for i, (x, y) in enumerate(zip(a, b)):
+            prefix = [] if equal is None else [equal.Not()]
+            model.AddBoolOr([*prefix, x, y.Not()])
+            if i == len(a) - 1:
+                break
+            following = model.NewBoolVar("")
+            if equal is not None:
+                model.AddImplication(following, equal)
+            model.AddBoolOr([following.Not(), x.Not(), y])
+            model.AddBoolOr([*prefix, x, following])
+            model.AddBoolOr([*prefix, y.Not(), following])
+            equal = following
+
+    def conjunction(self, a: cp_model.IntVar, b: cp_model.IntVar):
+        key = (a.Index(), b.Index())
+        if key not in self.conjunctions:
+            z = self.model.NewBoolVar("")
+            self.model.AddBoolAnd([a, b]).OnlyEnforceIf(z)
+            self.model.AddBoolOr([a.Not(), b.Not(), z])
+            self.conjunctions[key] = z
+        return self.conjunctions[key]
+
+    def add_distances(self):
+        data, model = self.data, self.model
+        assert data.room_distances is not None
+        distances = data.room_distances
+
+        # in_room[c, d, p][r] is true when class c is in room r at (d, p)
+        in_room: dict[tuple[int, int, int], dict[int, cp_model.IntVar]] = {}
+        for c in data.classes:
+            subjects = [
+                s
+                for s, subject in enumerate(data.subjects_data)
+                if c in subject.classes and subject.rooms_per_period == 1
+            ]
+            for d in data.days:
+                for p in data.periods:
+                    rooms: dict[int, list[cp_model.IntVar]] = {}
+                    for s in subjects:
+                        if (s, d, p) not in self.x:
+                            continue
+                        for r in np.flatnonzero(self.domains.rooms[s]).tolist():
+                            rooms.setdefault(r, []).append(
+                                self.conjunction(self.rooms[s, r], self.x[s, d, p])
+                            )
+                    in_room[c, d, p] = {}
+                    for r, options in rooms.items():
+                        key = ("in_room", *(v.Index() for v in options))
+                        if key not in self.sums:
+                            self.sums[key] = model.NewBoolVar("")
+                            model.Add(self.sums[key] == sum(options))
+                        in_room[c, d, p][r] = self.sums[key]
+
+        upper = max((max(row) for row in distances), default=0)
+        day_totals = []
+        for c in data.classes:
+            for d in data.days:
+                day = []
+                for p in range(data.num_periods - 1):
+                    pairs = [
+                        (distances[r1][r2], v1, v2)
+                        for r1, v1 in in_room[c, d, p].items()
+                        for r2, v2 in in_room[c, d, p + 1].items()
+                        if distances[r1][r2]
+                    ]
+                    key = (
+                        "distance",
+                        *((k, a.Index(), b.Index()) for k, a, b in pairs),
+                    )
+                    if key not in self.sums:
+                        distance = model.NewIntVar(0, upper, f"distance[{c},{d},{p}]")
+                        model.Add(
+                            distance
+                            == sum(k * self.conjunction(a, b) for k, a, b in pairs)
+                        )
+                        self.sums[key] = distance
+                    self.distances[c, d, p] = self.sums[key]
+                    day.append(self.sums[key])
+                total = model.NewIntVar(0, upper * len(day), "")
+                model.Add(total == sum(day))
+                day_totals.append(total)
+
+        bound = upper * max(0, data.num_periods - 1)
+        self.max_distance = model.NewIntVar(0, bound, "max_distance")
+        model.AddMaxEquality(self.max_distance, day_totals or [0])
+        self.sum_distances = model.NewIntVar(
+            0, bound * len(day_totals), "sum_distances"
+        )
+        model.Add(self.sum_distances == sum(day_totals))
+
+    def add_objective(self, previous: tuple[ScheduleData, dict[str, Any]] | None):
+        data, model = self.data, self.model
+        changes: list[Any] = []
+        if previous is not None:
+            hints = warm_start(data, previous)
+            hinted: set[int] = set()
+            for variables, values in (
+                (
+                    self.x,
+                    np.asarray(hints["previous__schedule_subjects"]).transpose(2, 0, 1),
+                ),
+                (self.teachers, np.asarray(hints["previous__teacher_assignments"])),
+                (self.rooms, np.asarray(hints["previous__room_assignments"])),
+            ):
+                for key, var in variables.items():
+                    value = int(values[key])
+                    # Week B shares literals, hint each only once
+                    if var.Index() not in hinted:
+                        hinted.add(var.Index())
+                        model.AddHint(var, value)
+                    changes.append(var.Not() if value else var)
+
+        # Distance first, then the number of changes from the previous solution
+        if self.max_distance is not None:
+            model.Minimize(self.max_distance * (len(changes) + 1) + sum(changes))
+        elif changes:
+            model.Minimize(sum(changes))
+
+    def variables(self, solution: NDArray[np.int64]) -> dict[str, Any]:
+        def values(index: NDArray[np.intp]):
+            return np.where(index >= 0, solution[index], 0)
+
+        variables: dict[str, Any] = {
+            "schedule_subjects": values(self.x_index).transpose(1, 2, 0).tolist(),
+            "teacher_assignments": values(self.teacher_index).tolist(),
+            "room_assignments": values(self.room_index).tolist(),
+            "distances": values(self.distance_index).tolist(),
+        }
+        for name in ("max_distance", "sum_distances"):
+            var = getattr(self, name)
+            variables[name] = int(solution[var.Index()]) if var is not None else 0
+        return variables
+
+    def stats(self):
+        proto = self.model.Proto()
+        return {
+            "variables": len(proto.variables),
+            "constraints": len(proto.constraints),
+            # Text format, to compare with the FlatZinc size of the MiniZinc build
+            "model_bytes": len(str(proto)),
+            "symmetric_pairs": self.symmetries.num_pairs(),
+        }
+
+
+class SolutionForwarder(cp_model.CpSolverSolutionCallback):
+    """Hands solutions from the solver thread to the event loop."""
+
+    def __init__(self, schedule: "CpSatSchedule", loop: asyncio.AbstractEventLoop):
+        super().__init__()
+        self.schedule = schedule
+        self.loop = loop
+
+    def OnSolutionCallback(self):
+        assert self.schedule.model is not None
+        solution = np.asarray(self.Response().solution, dtype=np.int64)
+        variables = self.schedule.model.variables(solution)
+        objective = self.ObjectiveValue()
+        self.loop.call_soon_threadsafe(self.schedule.on_solution, variables, objective)
+
+
+class CpSatSchedule:
+    """Solves with OR-Tools CP-SAT directly, without MiniZinc flattening."""
+
+    def __init__(
+        self,
+        schedule_data: ScheduleData,
+        budget: SolveBudget | None = None,
+        previous: SolutionEvent | None = None,
+        recorder: Recorder | None = None,
+        parameters: str | None = None,
+        satisfy_first: bool = False,
+        **_: Any,
+    ):
+        self.schedule_data = schedule_data
+        self.budget = budget or schedule_data.budget
+        self.previous = previous
+        # Extra SatParameters in text format
+        self.parameters = parameters
+        # Find any solution without the objective before optimizing
+        self.satisfy_first = satisfy_first
+        self.model: CpSatModel | None = None
+        self.solver: cp_model.CpSolver | None = None
+        self.callback: SolutionCallback | None = None
+        self.num_solutions = 0
+        self.last_solution = 0.0
+        self.build_stats: dict[str, Any] = {}
+        self.recorder = (recorder or recorder_for(schedule_data)).bind(backend="cp-sat")
+        # Solve start and time of the latest solution, for metrics
+        self.start = 0.0
+        self.elapsed = 0.0
+        # Set once the solver proved optimality or infeasibility
+        self.complete = False
+        self.task: asyncio.Task[None] | None = None
+
+    def build(self):
+        start = time.perf_counter()
+        previous = (
+            (self.previous.data, self.previous.variables)
+            if self.previous is not None
+            else None
+        )
+        rss = rss_bytes()
+        with self.recorder.timer("build"):
+            self.model = CpSatModel(self.schedule_data, previous)
+        memory = max(0, rss_bytes() - rss)
+        self.recorder.observe("schedule_build_memory_bytes", memory)
+        self.build_stats = {
+            "backend": "cp-sat",
+            "build_seconds": time.perf_counter() - start,
+            "build_memory_bytes": memory,
+            **self.model.stats(),
+        }
+
+    def solve(self, callback: SolutionCallback | None = None):
+        asyncio.run(self.iterate_solutions(callback))
+
+    async def solve_async(
+        self,
+        callback: SolutionCallback | None = None,
+        pool: SolverPool | None = None,
+        on_position: PositionCallback | None = None,
+    ):
+        if pool is None:
+            self.task = asyncio.create_task(self.iterate_solutions(callback))
+            return
+
+        self.task = asyncio.create_task(
+            pool.run(
+                lambda threads: self.iterate_solutions(
+                    callback, threads, pool.executor
+                ),
+                on_position,
+            )
+        )
+
+    def on_solution(self, variables: dict[str, Any], objective: float):
+        self.num_solutions += 1
+        self.last_solution = time.monotonic()
+        self.elapsed = time.perf_counter() - self.start
+        if self.num_solutions == 1:
+            self.recorder.stage("first_solution", self.elapsed)
+        self.recorder.solution(self.elapsed, objective, variables)
+        if self.callback is not None:
+            self.callback(SolutionEvent(self.schedule_data, variables, objective))
+        if (
+            self.budget.max_solutions is not None
+            and self.num_solutions >= self.budget.max_solutions
+            and self.solver is not None
+        ):
+            print("Solve budget reached")
+            self.solver.StopSearch()
+
+    async def watch_improvement(self, timeout: float):
+        while True:
+            await asyncio.sleep(min(1.0, timeout))
+            # Before the first solution only the time limit applies
+            if self.num_solutions and time.monotonic() - self.last_solution > timeout:
+                print("No improvement within budget")
+                if self.solver is not None:
+                    self.solver.StopSearch()
+                return
+
+    async def iterate_solutions(
+        self,
+        callback: SolutionCallback | None = None,
+        processes: int | None = None,
+        executor: Executor | None = None,
+    ):
+        print("Iterating solutions")
+        self.callback = callback
+        threads = [n for n in (processes, self.budget.threads) if n]
+        watchdog = None
+        try:
+            self.start = time.perf_counter()
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.build)
+            print(self.build_stats)
+            assert self.model is not None
+
+            self.solver = cp_model.CpSolver()
+            parameters = self.solver.parameters
+            parameters.num_workers = min(threads) if threads else 8
+            if self.budget.time_limit is not None:
+                parameters.max_time_in_seconds = self.budget.time_limit
+            if self.budget.random_seed is not None:
+                parameters.random_seed = self.budget.random_seed
+            if self.budget.relative_gap is not None:
+                parameters.relative_gap_limit = self.budget.relative_gap
+            if self.parameters:
+                parameters.merge_text_format(self.parameters)
+
+            if self.budget.no_improvement_timeout is not None:
+                watchdog = asyncio.create_task(
+                    self.watch_improvement(self.budget.no_improvement_timeout)
+                )
+
+            status = cp_model.UNKNOWN
+            if self.satisfy_first and self.model.model.HasObjective():
+                await self.find_first_solution()
+            # The watchdog may have ended the search in the first phase already
+            if watchdog is None or not watchdog.done():
+                status = await asyncio.to_thread(
+                    self.solver.Solve, self.model.model, SolutionForwarder(self, loop)
+                )
+            self.complete = status in (cp_model.OPTIMAL, cp_model.INFEASIBLE)
+            # Let solutions queued by the solver thread reach the callback first
+            await asyncio.sleep(0)
+            if self.num_solutions:
+                self.recorder.stage("best_solution", self.elapsed)
+            self.recorder.observe("schedule_solver_nodes", self.solver.NumBranches())
+            self.recorder.observe(
+                "schedule_solver_failures", self.solver.NumConflicts()
+            )
+            print(self.solver.ResponseStats())
+            print(self.solver.StatusName(status))
+            if callback is not None:
+                callback(None)
+        except asyncio.CancelledError:
+            if self.solver is not None:
+                self.solver.StopSearch()
+            raise
+        except Exception as e:
+            print(e)
+            if callback is not None:
+                callback(None)
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+        print("Finished iterating solutions")
+
+    async def find_first_solution(self):
+        """Solves without the objective and hints the optimization with the result."""
+        assert self.model is not None and self.solver is not None
+        start = time.perf_counter()
+        model = self.model.model
+        feasibility = model.Clone()
+        feasibility.ClearObjective()
+        solver = cp_model.CpSolver()
+        solver.parameters.copy_from(self.solver.parameters)
+        solver.parameters.stop_after_first_solution = True
+        # Point StopSearch from the watchdog at this phase while it runs
+        main, self.solver = self.solver, solver
+        try:
+            status = await asyncio.to_thread(solver.Solve, feasibility)
+        except asyncio.CancelledError:
+            solver.StopSearch()
+            raise
+        finally:
+            self.solver = main
+        if self.budget.time_limit is not None:
+            # Both phases share the time limit
+            main.parameters.max_time_in_seconds = max(
+                0.0, self.budget.time_limit - (time.perf_counter() - start)
+            )
+        if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+            return
+
+        solution = np.asarray(solver.ResponseProto().solution, dtype=np.int64)
+        proto = model.Proto()
+        self.on_solution(
+            self.model.variables(solution), objective_value(proto, solution)
+        )
+        model.ClearHints()
+        proto.solution_hint.vars.extend(range(len(solution)))
+        proto.solution_hint.values.extend(solution.tolist())
+
+    async def cancel(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                print("Solver was cancelled.")
+
+
+def objective_value(proto: Any, solution: NDArray[np.int64]) -> float:
+    """Value of the objective of `proto` for a solution found without it."""
+    objective = proto.objective
+    total = objective.offset
+    for ref, coefficient in zip(objective.vars, objective.coeffs):
+        # Negative references stand for the negated variable
+        value = solution[ref] if ref >= 0 else -solution[-ref - 1]
+        total += coefficient * int(value)
+    return total * (objective.scaling_factor or 1)
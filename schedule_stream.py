@@ -0,0 +1,94 @@
+import base64
+import json
+from dataclasses import dataclass, field
+from typing import Any
+
+from binary_format import dump_cells
+from display_schedule import SaveSchedule
+
+Cell = tuple[Any, ...]
+
+MODES = ("full", "delta")
+SNAPSHOT_FORMATS = ("json", "binary")
+
+
+@dataclass
+class ScheduleStream:
+    """Formats solutions as SSE events for one session.
+
+    In "full" mode every solution is sent as the complete CSV. In "delta" mode
+    the first solution is sent as a `snapshot` event and later ones as `delta`
+    events holding only the (class, day, period) cells that changed. Every event
+    carries its own sequence number, queue events from `notice()` included; a
+    delta applies on top of the solution event numbered `base`. A `resync`
+    event (a fresh snapshot) is sent every `resync_interval` events or after
+    `request_resync()`.
+
+    With `snapshot_format="binary"` snapshots carry their cells as a base64
+    encoded `binary_format` buffer instead of a JSON list, see `load_cells`.
+    """
+
+    mode: str = "full"
+    snapshot_format: str = "json"
+    resync_interval: int = 50
+    seq: int = 0
+    # Sequence number of the latest solution event, deltas apply on top of it
+    solution_seq: int = 0
+    cells: dict[tuple[int, int, int], Cell] | None = field(default=None, repr=False)
+    resync_requested: bool = False
+
+    def request_resync(self):
+        self.resync_requested = True
+
+    def notice(self, event: str, data: Any) -> str:
+        """An event outside the solutions, e.g. the queue position."""
+        self.seq += 1
+        return sse(event, self.seq, data)
+
+    def event(self, saver: SaveSchedule) -> str:
+        self.seq += 1
+        base, self.solution_seq = self.solution_seq, self.seq
+
+        if self.mode != "delta":
+            return sse(None, self.seq, saver.schedule_csv())
+
+        cells = saver.schedule_cells()
+        previous = self.cells
+        self.cells = cells
+
+        if previous is None:
+            return sse("snapshot", self.seq, self.snapshot(saver, cells))
+
+        if self.resync_requested or self.seq % self.resync_interval == 0:
+            self.resync_requested = False
+            return sse("resync", self.seq, self.snapshot(saver, cells))
+
+        changed = [
+            [*key, *(cells[key] if key in cells else (None,))]
+            for key in previous.keys() | cells.keys()
+            if previous.get(key) != cells.get(key)
+        ]
+        changed.sort()
+        return sse("delta", self.seq, {"seq": self.seq, "base": base, "cells": changed})
+
+    def snapshot(
+        self, saver: SaveSchedule, cells: dict[tuple[int, int, int], Cell]
+    ) -> dict[str, Any]:
+        meta = {
+            "days": saver.data.num_days,
+            "periods": saver.data.num_periods,
+            "classes": [c.name for c in saver.data.classes_data],
+        }
+        if self.snapshot_format == "binary":
+            encoded = base64.b64encode(dump_cells(meta, cells)).decode()
+            return {"seq": self.seq, "format": "binary", "cells": encoded}
+        return {
+            "seq": self.seq,
+            **meta,
+            "cells": [[*key, *value] for key, value in sorted(cells.items())],
+        }
+
+
+def sse(event: str | None, seq: int, data: Any) -> str:
+    head = f"event: {event}\n" if event is not None else ""
+    return f"{head}id: {seq}\ndata: {json.dumps(data)}\n\n"
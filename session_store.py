@@ -0,0 +1,255 @@
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from binary_format import (
+    dump_schedule_data,
+    dump_solution,
+    load_schedule_data,
+    load_solution,
+)
+from data import ScheduleData
+from persistence import BackgroundWriter, writer
+from schedule import SolutionEvent
+from schedule_stream import ScheduleStream
+from solver_pool import QueuePosition
+from solvers import ScheduleRunner
+
+
+@dataclass
+class Session:
+    id: str
+    data: ScheduleData
+    queue: asyncio.Queue[SolutionEvent | QueuePosition | None] = field(
+        default_factory=asyncio.Queue
+    )
+    schedule: ScheduleRunner | None = None
+    stream: ScheduleStream | None = None
+    # Latest solution of this session and the one it was re-solved from
+    solution: SolutionEvent | None = None
+    previous: SolutionEvent | None = None
+    streaming: bool = False
+    last_access: float = field(default_factory=time.monotonic)
+
+    def touch(self):
+        self.last_access = time.monotonic()
+
+    @property
+    def solving(self) -> bool:
+        """Whether a solver was started for this session and hasn't finished."""
+        if self.schedule is None:
+            return False
+        # The task is created once the solve job is scheduled
+        return self.schedule.task is None or not self.schedule.task.done()
+
+    def reset(self):
+        """Forgets a finished or abandoned solve so a new one can start."""
+        self.schedule, self.stream = None, None
+        self.queue = asyncio.Queue()
+
+    async def close(self):
+        """Stops the solver if one is running and ends any open SSE stream."""
+        if self.schedule is not None:
+            await self.schedule.cancel()
+        await self.queue.put(None)
+
+
+class SessionStoreFull(Exception):
+    """Raised when a session can't be added because every other one is busy."""
+
+
+class MemorySessionStore:
+    """Keeps sessions in memory, bounded in count and idle time.
+
+    The least recently used session that is neither solving nor streaming is
+    evicted once `max_sessions` is reached, and `add()` raises SessionStoreFull
+    when there is none. Sessions idle for longer than `ttl` seconds with no
+    client attached are expired by `expire()`.
+    """
+
+    def __init__(self, max_sessions: int = 256, ttl: float = 3600):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.sessions: OrderedDict[str, Session] = OrderedDict()
+        self.evicted = 0
+        self.expired = 0
+
+    async def add(self, session: Session):
+        self.sessions[session.id] = session
+        while len(self.sessions) > self.max_sessions:
+            # Live solves and streams are never cut short to make room
+            oldest = next(
+                (
+                    s
+                    for s in self.sessions.values()
+                    if s is not session and not s.solving and not s.streaming
+                ),
+                None,
+            )
+            if oldest is None:
+                del self.sessions[session.id]
+                raise SessionStoreFull("Every session is solving or streaming")
+            del self.sessions[oldest.id]
+            self.evicted += 1
+            await self.evict(oldest)
+
+    async def evict(self, session: Session):
+        """Releases a session dropped to make room, which can't be reloaded."""
+        await session.close()
+
+    async def get(self, session_id: str) -> Session | None:
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session.touch()
+            self.sessions.move_to_end(session_id)
+        return session
+
+    async def remove(self, session_id: str):
+        session = self.sessions.pop(session_id, None)
+        if session is not None:
+            await session.close()
+
+    def save_solution(self, session: Session):
+        """Persists the latest solution of `session`, a no-op in memory."""
+
+    async def expire(self):
+        deadline = time.monotonic() - self.ttl
+        idle = [
+            s
+            for s in self.sessions.values()
+            if s.last_access < deadline and not s.streaming
+        ]
+        for session in idle:
+            self.expired += 1
+            await self.remove(session.id)
+
+    async def run_expiry(self, interval: float = 60):
+        while True:
+            await asyncio.sleep(interval)
+            await self.expire()
+
+    def stats(self):
+        return {
+            "live_sessions": len(self.sessions),
+            "solving_sessions": sum(1 for s in self.sessions.values() if s.solving),
+            "evicted_sessions": self.evicted,
+            "expired_sessions": self.expired,
+        }
+
+
+class DiskSessionStore(MemorySessionStore):
+    """Memory store that also keeps inputs and latest solutions under `directory`.
+
+    Sessions evicted from memory can be reloaded from disk, with their latest
+    solution, until their file is older than `ttl`. Files are written by a
+    `BackgroundWriter` and gzip compressed with `compress`. With `binary` they
+    use the compact `binary_format` instead of JSON and are memory-mapped when
+    reloaded.
+    """
+
+    def __init__(
+        self,
+        directory: str = "sessions",
+        max_sessions: int = 256,
+        ttl: float = 3600,
+        compress: bool = False,
+        binary: bool = False,
+        background_writer: BackgroundWriter = writer,
+    ):
+        super().__init__(max_sessions, ttl)
+        self.directory = Path(directory)
+        self.binary = binary
+        if binary:
+            self.suffix = ".bin"
+        else:
+            self.suffix = ".json.gz" if compress else ".json"
+        self.writer = background_writer
+
+    def path(self, session_id: str, kind: str = ""):
+        return self.directory / f"{session_id}{kind}{self.suffix}"
+
+    def paths(self, session_id: str):
+        return self.path(session_id), self.path(session_id, ".solution")
+
+    async def add(self, session: Session):
+        await super().add(session)
+        data = session.data
+        self.writer.submit(
+            self.path(session.id),
+            dump_schedule_data(data) if self.binary else data.to_json_object(),
+        )
+
+    async def evict(self, session: Session):
+        """Drops a session from memory only, it's reloaded from disk when needed."""
+
+    def save_solution(self, session: Session):
+        if session.solution is None:
+            return
+        variables, objective = session.solution.variables, session.solution.objective
+        # Later solutions replace this one if it is not written yet
+        self.writer.submit(
+            self.path(session.id, ".solution"),
+            (
+                dump_solution(variables, objective)
+                if self.binary
+                else {"variables": variables, "objective": objective}
+            ),
+        )
+
+    async def get(self, session_id: str) -> Session | None:
+        session = await super().get(session_id)
+        if session is not None:
+            return session
+
+        path = self.path(session_id)
+        # Session ids are server generated, reject anything that is not a plain name
+        if path.parent != self.directory:
+            return None
+        if path.exists() and time.time() - path.stat().st_mtime > self.ttl:
+            for expired in self.paths(session_id):
+                expired.unlink(missing_ok=True)
+            return None
+
+        session = await asyncio.to_thread(self.load, session_id)
+        if session is not None:
+            try:
+                await super().add(session)
+            except SessionStoreFull:
+                # Served from disk without a place in memory
+                pass
+        return session
+
+    def load(self, session_id: str):
+        input_path, solution_path = self.paths(session_id)
+        obj = self.writer.read(input_path)
+        if obj is None:
+            return None
+        data = load_schedule_data(obj) if self.binary else ScheduleData(obj)
+        session = Session(session_id, data)
+        solution = self.writer.read(solution_path)
+        if solution is None:
+            return session
+        if self.binary:
+            variables, objective = load_solution(solution)
+        else:
+            variables, objective = solution["variables"], solution["objective"]
+        session.solution = SolutionEvent(data, variables, objective)
+        return session
+
+    async def remove(self, session_id: str):
+        await super().remove(session_id)
+        for path in self.paths(session_id):
+            await asyncio.to_thread(self.writer.discard, path)
+            path.unlink(missing_ok=True)
+
+    async def expire(self):
+        await super().expire()
+        if not self.directory.exists():
+            return
+        deadline = time.time() - self.ttl
+        for path in self.directory.glob(f"*{self.suffix}"):
+            session_id = path.name.split(".")[0]
+            if path.stat().st_mtime < deadline and session_id not in self.sessions:
+                path.unlink(missing_ok=True)
@@ -0,0 +1,101 @@
+from typing import Any
+
+import numpy as np
+from numpy.typing import NDArray
+
+from data import ScheduleData
+
+
+class SolutionDecoder:
+    """Inverts the raw solution arrays into slot and assignment indexes.
+
+    Decoding touches every filled slot once, after which looking up the
+    subject, teachers or rooms of a (class, day, period) cell is constant time.
+    """
+
+    def __init__(self, data: ScheduleData, variables: dict[str, Any]):
+        self.data = data
+
+        schedule = schedule_cube(data, variables)
+        teacher_assignments = self.cube(
+            variables["teacher_assignments"], (data.num_subjects, data.num_teachers)
+        )
+        room_assignments = self.cube(
+            variables.get("room_assignments", []), (data.num_subjects, data.num_rooms)
+        )
+
+        # Subject placed at [class, day, period], -1 where the slot is empty
+        self.class_slots: NDArray[np.intp] = np.full(
+            (data.num_classes, data.num_days, data.num_periods), -1, dtype=np.intp
+        )
+        subject_classes = np.zeros((data.num_subjects, data.num_classes), np.bool_)
+        for s, subject in enumerate(data.subjects_data):
+            subject_classes[s, subject.classes] = True
+
+        days, periods, subjects = np.nonzero(schedule)
+        # (day, period, subject) of every lesson, in day and period order
+        self.lessons: list[tuple[int, int, int]] = list(
+            zip(days.tolist(), periods.tolist(), subjects.tolist())
+        )
+        entries, classes = np.nonzero(subject_classes[subjects])
+        # Assign in reverse so the lowest subject index wins on a clash
+        self.class_slots[classes[::-1], days[entries[::-1]], periods[entries[::-1]]] = (
+            subjects[entries[::-1]]
+        )
+
+        self.subject_teachers: list[list[int]] = [
+            np.flatnonzero(row).tolist() for row in teacher_assignments
+        ]
+        self.subject_rooms: list[list[int]] = [
+            np.flatnonzero(row).tolist() for row in room_assignments
+        ]
+
+    @staticmethod
+    def cube(values: Any, shape: tuple[int, ...]) -> NDArray[np.bool_]:
+        array = np.asarray(values, dtype=np.bool_)
+        if array.size == 0:
+            return np.zeros(shape, dtype=np.bool_)
+        return array.reshape(shape)
+
+    def subject_at(self, c: int, d: int, p: int) -> int | None:
+        s = int(self.class_slots[c, d, p])
+        return None if s < 0 else s
+
+    def filled_slots(self):
+        """Yields (class, day, period, subject) for every filled slot."""
+        for c, d, p in np.argwhere(self.class_slots >= 0).tolist():
+            yield c, d, p, int(self.class_slots[c, d, p])
+
+
+def schedule_cube(data: ScheduleData, variables: dict[str, Any]) -> NDArray[np.bool_]:
+    """Lessons as [day, period, subject] over all days.
+
+    Raw model.mzn output only holds the base week and the lessons taught in a
+    single week, both weeks are rebuilt from those.
+    """
+    shape = (data.num_days, data.num_periods, data.num_subjects)
+    if "schedule_subjects" in variables:
+        return SolutionDecoder.cube(variables["schedule_subjects"], shape)
+
+    weeks = 2 if data.config.use_alternating_weeks else 1
+    base_days = data.num_days // weeks
+    base = SolutionDecoder.cube(
+        variables["base_subjects"], (base_days, data.num_periods, data.num_subjects)
+    )
+    schedule = SolutionDecoder.cube(variables.get("once_subjects", []), shape).copy()
+    for w in range(weeks):
+        schedule[w * base_days : (w + 1) * base_days] |= base
+    return schedule
+
+
+def expand_weeks(data: ScheduleData, variables: dict[str, Any]) -> dict[str, Any]:
+    """Raw model.mzn output with `schedule_subjects` over all days."""
+    if "schedule_subjects" in variables:
+        return variables
+    expanded = {
+        name: value
+        for name, value in variables.items()
+        if name not in ("base_subjects", "once_subjects")
+    }
+    expanded["schedule_subjects"] = schedule_cube(data, variables).astype(int).tolist()
+    return expanded
@@ -0,0 +1,103 @@
+import asyncio
+import os
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, TypeVar
+
+T = TypeVar("T")
+
+
+@dataclass
+class QueuePosition:
+    """Place of a job in the solver queue, 0 once it is running."""
+
+    position: int
+    threads: int = 0
+
+
+PositionCallback = Callable[[QueuePosition], Any]
+
+
+@dataclass(eq=False)
+class PoolJob:
+    on_position: PositionCallback | None
+    position: int = 0
+
+
+class SolverPool:
+    """Admits solve jobs in order while capping the solver threads in use.
+
+    A job waits until threads are free, then gets a share of them that shrinks
+    as the queue behind it grows, never more than `max_job_threads`. Data
+    preparation can be pushed to `executor`, e.g. a ProcessPoolExecutor, so it
+    never runs on the event loop.
+    """
+
+    def __init__(
+        self,
+        max_threads: int | None = None,
+        max_job_threads: int | None = None,
+        executor: Executor | None = None,
+    ):
+        self.max_threads = max_threads or os.cpu_count() or 1
+        self.max_job_threads = max_job_threads or max(1, self.max_threads // 2)
+        self.executor = executor
+        self.free_threads = self.max_threads
+        self.running = 0
+        self.waiting: list[PoolJob] = []
+        self.changed = asyncio.Condition()
+
+    async def run(
+        self,
+        job: Callable[[int], Awaitable[T]],
+        on_position: PositionCallback | None = None,
+    ) -> T:
+        """Waits for admission, then runs `job` with its thread allowance."""
+        entry = PoolJob(on_position)
+        async with self.changed:
+            self.waiting.append(entry)
+            self.report()
+            try:
+                await self.changed.wait_for(
+                    lambda: self.waiting[0] is entry and self.free_threads > 0
+                )
+            except asyncio.CancelledError:
+                self.waiting.remove(entry)
+                self.report()
+                self.changed.notify_all()
+                raise
+            self.waiting.pop(0)
+            threads = self.allocate()
+            self.free_threads -= threads
+            self.running += 1
+            self.report()
+            self.changed.notify_all()
+
+        if on_position is not None:
+            on_position(QueuePosition(0, threads))
+        try:
+            return await job(threads)
+        finally:
+            async with self.changed:
+                self.free_threads += threads
+                self.running -= 1
+                self.changed.notify_all()
+
+    def allocate(self):
+        # Leave room for the jobs still waiting behind this one
+        share = self.max_threads // (1 + self.running + len(self.waiting))
+        return max(1, min(share, self.free_threads, self.max_job_threads))
+
+    def report(self):
+        for position, entry in enumerate(self.waiting, start=1):
+            if entry.on_position is not None and entry.position != position:
+                entry.position = position
+                entry.on_position(QueuePosition(position))
+
+    def stats(self):
+        return {
+            "max_threads": self.max_threads,
+            "free_threads": self.free_threads,
+            "running_jobs": self.running,
+            "queued_jobs": len(self.waiting),
+        }
@@ -0,0 +1,31 @@
+from typing import Any
+
+from data import ScheduleData
+from decomposition import DecomposedSchedule
+from heuristic import HeuristicStart
+from portfolio import PortfolioSchedule
+from schedule import Schedule
+from schedule_cpsat import CpSatSchedule
+
+ScheduleRunner = (
+    Schedule | CpSatSchedule | PortfolioSchedule | DecomposedSchedule | HeuristicStart
+)
+
+BACKENDS: dict[str, type[Schedule] | type[CpSatSchedule] | type[PortfolioSchedule]] = {
+    "minizinc": Schedule,
+    "cp-sat": CpSatSchedule,
+    "portfolio": PortfolioSchedule,
+}
+
+
+def create_schedule(data: ScheduleData, **kwargs: Any) -> ScheduleRunner:
+    """Picks the solving strategy for `data` from its config."""
+    backend = BACKENDS[data.config.backend]
+    runner: ScheduleRunner
+    if data.config.decompose and len(data.components()) > 1:
+        runner = DecomposedSchedule(data, backend, **kwargs)
+    else:
+        runner = backend(data, **kwargs)
+    if data.config.heuristic_start:
+        return HeuristicStart(data, runner, **kwargs)
+    return runner
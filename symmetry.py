@@ -0,0 +1,135 @@
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+from numpy.typing import NDArray
+
+from data import ScheduleData
+
+
+@dataclass
+class Symmetries:
+    """Groups of interchangeable teachers, rooms and days, in index order.
+
+    Swapping two members of a group turns any solution into another solution
+    with the same objective, so the solver only needs to see one of them.
+    With alternating weeks a day stands for itself and its day in week B.
+    """
+
+    teachers: list[list[int]]
+    rooms: list[list[int]]
+    days: list[list[int]]
+
+    @classmethod
+    def none(cls):
+        return cls([], [], [])
+
+    def num_pairs(self):
+        return sum(
+            len(group) - 1 for group in (*self.teachers, *self.rooms, *self.days)
+        )
+
+
+def find_symmetries(
+    data: ScheduleData,
+    periods: NDArray[np.bool_],
+    teachers: NDArray[np.bool_],
+    rooms: NDArray[np.bool_],
+) -> Symmetries:
+    """Finds entities the model can't tell apart, given the presolved domains.
+
+    Teachers are interchangeable when they share availability, eligible
+    subjects and course distribution bounds, rooms when they share
+    availability, eligible subjects and distances to every other room, and
+    days when every subject, teacher and room is available in the same periods.
+    """
+    at_least = np.zeros((data.num_courses, data.num_teachers), dtype=np.int64)
+    at_most = np.zeros((data.num_courses, data.num_teachers), dtype=np.int64)
+    for q, course in enumerate(data.courses_data):
+        if course.teacher_distribution is None:
+            continue
+        for td in course.teacher_distribution:
+            at_least[q, td.teacher] = td.at_least
+            at_most[q, td.teacher] = td.at_most
+
+    teacher_groups = groups(
+        data.teachers,
+        lambda t: (
+            data.teachers_available[t],
+            teachers[:, t],
+            at_least[:, t],
+            at_most[:, t],
+        ),
+    )
+
+    room_groups: list[list[int]] = []
+    if data.config.schedule_rooms:
+        room_groups = groups(
+            data.rooms, lambda r: (data.rooms_available[r], rooms[:, r])
+        )
+        if data.config.optimize_distance and data.room_distances is not None:
+            room_groups = split_by_distances(
+                room_groups, np.asarray(data.room_distances)
+            )
+
+    day_groups = groups(
+        range(
+            data.num_days // 2 if data.config.use_alternating_weeks else data.num_days
+        ),
+        lambda d: tuple(
+            cube[:, week_days(data, d)]
+            for cube in (
+                data.subjects_available,
+                data.teachers_available,
+                data.rooms_available,
+                periods,
+            )
+        ),
+    )
+
+    return Symmetries(teacher_groups, room_groups, day_groups)
+
+
+def week_days(data: ScheduleData, d: int):
+    if data.config.use_alternating_weeks:
+        return [d, d + data.num_days // 2]
+    return [d]
+
+
+def groups(indices: Any, signature: Any) -> list[list[int]]:
+    """Indices with equal array signatures, only groups of two or more."""
+    by_signature: dict[bytes, list[int]] = {}
+    for i in indices:
+        key = b"\0".join(np.ascontiguousarray(a).tobytes() for a in signature(i))
+        by_signature.setdefault(key, []).append(i)
+    return [group for group in by_signature.values() if len(group) > 1]
+
+
+def split_by_distances(
+    groups: list[list[int]], distances: NDArray[np.int64]
+) -> list[list[int]]:
+    """Keeps rooms together only if swapping them leaves all distances unchanged."""
+    result: list[list[int]] = []
+    for group in groups:
+        remaining = group
+        while len(remaining) > 1:
+            first = remaining[0]
+            same = [first]
+            rest = []
+            for r in remaining[1:]:
+                order = np.arange(len(distances))
+                order[[first, r]] = order[[r, first]]
+                if (distances[np.ix_(order, order)] == distances).all():
+                    same.append(r)
+                else:
+                    rest.append(r)
+            if len(same) > 1:
+                result.append(same)
+            remaining = rest
+    return result
+
+
+def pairs(groups: list[list[int]]) -> tuple[list[int], list[int]]:
+    """Consecutive members of each group, ordering a chain through the group."""
+    chained = [(a, b) for group in groups for a, b in zip(group, group[1:])]
+    return [a for a, _ in chained], [b for _, b in chained]
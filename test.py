@@ -2,11 +2,14 @@ import json
 from sys import argv
 
 from data import ScheduleData
+from persistence import writer
 from schedule import Schedule
 
 if __name__ == "__main__":
     with open(argv[1], encoding="utf-8") as f:
         data = json.load(f)
 
-    schedule = Schedule(ScheduleData(data))
+    # display_schedule.py renders the dumped solution
+    schedule = Schedule(ScheduleData(data), dump_directory="generated")
     schedule.solve()
+    writer.flush()
@@ -0,0 +1,259 @@
+"""The native CP-SAT model against the constraints and objective of model.mzn.
+
+Solutions of small generated schools are checked by a plain reimplementation
+of model.mzn, and feasibility is compared with MiniZinc where it's installed.
+"""
+
+import shutil
+from dataclasses import replace
+from typing import Any
+
+import numpy as np
+import pytest
+from ortools.sat.python import cp_model
+
+from benchmark.generator import SCALES, generate
+from data import ScheduleData, SolveBudget
+from data_minizinc import Domains, presolve, warm_start
+from schedule_cpsat import CpSatModel
+
+TIME_LIMIT = 10
+
+SCHOOLS = {
+    "plain": replace(SCALES["tiny"]),
+    "seed": replace(SCALES["tiny"], seed=1, load=0.9),
+    "sparse": replace(SCALES["tiny"], seed=2, sparsity=0.2),
+    "distance": replace(SCALES["tiny"], optimize_distance=True),
+    "transition": replace(
+        SCALES["tiny"], seed=1, optimize_distance=True, distance_encoding="transition"
+    ),
+    "teacher_distribution": replace(SCALES["tiny"], teacher_distribution=True),
+    "symmetry": replace(SCALES["tiny"], symmetry_breaking=True, pool_size=2),
+    "alternating": replace(SCALES["tiny"], days=10, alternating_weeks=True),
+    "alternating_distance": replace(
+        SCALES["tiny"], seed=2, days=10, alternating_weeks=True, optimize_distance=True
+    ),
+}
+# Previous solutions are compared cell by cell, which only lines up with the
+# model's literals without alternating weeks
+WARM_SCHOOLS = ["plain", "sparse", "distance", "teacher_distribution"]
+
+
+def school(name: str) -> ScheduleData:
+    return ScheduleData(generate(SCHOOLS[name]))
+
+
+def infeasible_school() -> ScheduleData:
+    obj = generate(SCHOOLS["plain"])
+    # A subject is taught at most once a day
+    obj["subjects"][0]["periods_per_week"] = obj["days"] + 1
+    return ScheduleData(obj)
+
+
+def solve_cpsat(
+    data: ScheduleData, previous: tuple[ScheduleData, dict[str, Any]] | None = None
+):
+    model = CpSatModel(data, previous)
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = TIME_LIMIT
+    solver.parameters.num_workers = 8
+    solver.parameters.random_seed = 0
+    status = solver.Solve(model.model)
+    variables = None
+    if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        variables = model.variables(np.asarray(solver.ResponseProto().solution))
+    return model, solver, status, variables
+
+
+def violations(data: ScheduleData, variables: dict[str, Any]) -> list[str]:
+    """The constraints of model.mzn that a solution breaks."""
+    x = np.asarray(variables["schedule_subjects"], dtype=int)
+    teachers = np.asarray(variables["teacher_assignments"], dtype=int)
+    rooms = np.asarray(variables["room_assignments"], dtype=int)
+    problems = []
+
+    for s, subject in enumerate(data.subjects_data):
+        lessons = x[:, :, s]
+        if lessons.sum() != subject.periods_per_week:
+            problems.append(f"subject {s} has {lessons.sum()} lessons")
+        if (lessons.sum(axis=1) > 1).any():
+            problems.append(f"subject {s} is taught twice a day")
+        if (lessons.astype(bool) & ~data.subjects_available[s]).any():
+            problems.append(f"subject {s} is taught when unavailable")
+        if teachers[s].sum() != subject.teachers_per_period:
+            problems.append(f"subject {s} has {teachers[s].sum()} teachers")
+        if set(np.flatnonzero(teachers[s])) - set(subject.teachers):
+            problems.append(f"subject {s} has an ineligible teacher")
+        if data.config.schedule_rooms:
+            if rooms[s].sum() != subject.rooms_per_period:
+                problems.append(f"subject {s} has {rooms[s].sum()} rooms")
+            if set(np.flatnonzero(rooms[s])) - set(subject.available_rooms):
+                problems.append(f"subject {s} has an ineligible room")
+
+    for c in data.classes:
+        subjects = [s for s, sd in enumerate(data.subjects_data) if c in sd.classes]
+        if (x[:, :, subjects].sum(axis=2) > 1).any():
+            problems.append(f"class {c} has two lessons at once")
+
+    entities = [("teacher", teachers, data.teachers_available)]
+    if data.config.schedule_rooms:
+        entities.append(("room", rooms, data.rooms_available))
+    for kind, assignments, available in entities:
+        load = np.einsum("dps,se->edp", x, assignments)
+        if (load > 1).any():
+            problems.append(f"a {kind} has two lessons at once")
+        if (load.astype(bool) & ~np.asarray(available)).any():
+            problems.append(f"a {kind} teaches when unavailable")
+
+    for course in data.courses_data:
+        if course.teacher_distribution is None:
+            continue
+        bounds = {
+            td.teacher: (td.at_least, td.at_most) for td in course.teacher_distribution
+        }
+        for t in data.teachers:
+            at_least, at_most = bounds.get(t, (0, 0))
+            if not at_least <= teachers[course.subjects, t].sum() <= at_most:
+                problems.append(f"course {course.name} breaks the distribution of {t}")
+
+    if data.config.use_alternating_weeks:
+        half = data.num_days // 2
+        for s, subject in enumerate(data.subjects_data):
+            week_a, week_b = x[:half, :, s], x[half : 2 * half, :, s]
+            if subject.periods_per_week % 2 == 0:
+                if (week_a != week_b).any():
+                    problems.append(f"subject {s} differs between the weeks")
+            elif (week_a * week_b).sum() != subject.periods_per_week // 2:
+                problems.append(f"subject {s} has too few lessons in both weeks")
+    return problems
+
+
+def class_distances(data: ScheduleData, variables: dict[str, Any]) -> np.ndarray:
+    """Distances walked by each class between consecutive periods, [C][D][P-1]."""
+    x = np.asarray(variables["schedule_subjects"], dtype=int)
+    rooms = np.asarray(variables["room_assignments"], dtype=int)
+    distances = np.zeros((data.num_classes, data.num_days, data.num_periods - 1), int)
+    for c in data.classes:
+        subjects = [
+            s
+            for s, sd in enumerate(data.subjects_data)
+            if c in sd.classes and sd.rooms_per_period == 1
+        ]
+        for d in data.days:
+            room = [None] * data.num_periods
+            for p in data.periods:
+                for s in subjects:
+                    if x[d, p, s]:
+                        room[p] = int(np.flatnonzero(rooms[s])[0])
+            for p in range(data.num_periods - 1):
+                if room[p] is not None and room[p + 1] is not None:
+                    distances[c, d, p] = data.room_distances[room[p]][room[p + 1]]
+    return distances
+
+
+def num_changes(
+    data: ScheduleData,
+    variables: dict[str, Any],
+    previous: tuple[ScheduleData, dict[str, Any]],
+) -> int:
+    """Feasible cells and assignments that differ from the previous solution."""
+    domains = presolve(data) if data.config.presolve else Domains.initial(data)
+    hints = warm_start(data, previous)
+    pairs = [
+        (
+            "schedule_subjects",
+            "previous__schedule_subjects",
+            domains.periods.transpose(1, 2, 0),
+        ),
+        ("teacher_assignments", "previous__teacher_assignments", domains.teachers),
+        ("room_assignments", "previous__room_assignments", domains.rooms),
+    ]
+    return sum(
+        int((np.asarray(variables[name]) != np.asarray(hints[hint]))[feasible].sum())
+        for name, hint, feasible in pairs
+    )
+
+
+@pytest.mark.parametrize("name", SCHOOLS)
+def test_solutions_satisfy_model(name: str):
+    data = school(name)
+    _, _, status, variables = solve_cpsat(data)
+    assert status in (cp_model.OPTIMAL, cp_model.FEASIBLE)
+    assert violations(data, variables) == []
+
+
+@pytest.mark.parametrize(
+    "name", [name for name, config in SCHOOLS.items() if config.optimize_distance]
+)
+def test_distances(name: str):
+    data = school(name)
+    model, solver, status, variables = solve_cpsat(data)
+    assert status in (cp_model.OPTIMAL, cp_model.FEASIBLE)
+
+    distances = class_distances(data, variables)
+    assert variables["distances"] == distances.tolist()
+    assert variables["max_distance"] == distances.sum(axis=2).max()
+    assert variables["sum_distances"] == distances.sum()
+    assert solver.ObjectiveValue() == variables["max_distance"]
+
+
+def test_infeasible():
+    _, _, status, _ = solve_cpsat(infeasible_school())
+    assert status == cp_model.INFEASIBLE
+
+
+@pytest.mark.parametrize("name", WARM_SCHOOLS)
+def test_changes(name: str):
+    data = school(name)
+    _, _, _, solution = solve_cpsat(data)
+    # Shifted lessons and teachers, so the solution has to move to match them
+    shifted = {
+        "schedule_subjects": np.roll(solution["schedule_subjects"], 1, axis=1),
+        "teacher_assignments": np.roll(solution["teacher_assignments"], 1, axis=1),
+        "room_assignments": solution["room_assignments"],
+    }
+    previous = (data, shifted)
+    model, solver, status, variables = solve_cpsat(data, previous)
+    assert status in (cp_model.OPTIMAL, cp_model.FEASIBLE)
+    assert violations(data, variables) == []
+
+    changes = num_changes(data, variables, previous)
+    assert changes > 0
+    weight = len(model.x) + len(model.teachers) + len(model.rooms) + 1
+    assert solver.ObjectiveValue() == variables["max_distance"] * weight + changes
+
+
+def solve_minizinc(data: ScheduleData):
+    pytest.importorskip("minizinc")
+    from schedule import Schedule
+
+    schedule = Schedule(data, cache=None, budget=SolveBudget(time_limit=TIME_LIMIT))
+    solutions = []
+    schedule.solve(lambda event: event is not None and solutions.append(event))
+    return schedule, solutions
+
+
+requires_minizinc = pytest.mark.skipif(
+    shutil.which("minizinc") is None, reason="MiniZinc is not installed"
+)
+
+
+@requires_minizinc
+@pytest.mark.parametrize("name", SCHOOLS)
+def test_minizinc_agrees(name: str):
+    data = school(name)
+    schedule, solutions = solve_minizinc(data)
+    _, _, status, variables = solve_cpsat(data)
+
+    assert solutions and variables is not None
+    assert violations(data, solutions[-1].variables) == []
+    optimal = schedule.complete and status == cp_model.OPTIMAL
+    if optimal and data.config.optimize_distance:
+        assert solutions[-1].variables["max_distance"] == variables["max_distance"]
+
+
+@requires_minizinc
+def test_minizinc_infeasible():
+    schedule, solutions = solve_minizinc(infeasible_school())
+    assert not solutions
+    assert schedule.complete
@@ -0,0 +1,99 @@
+"""Decomposed solves of schools made of several independent tiny schools."""
+
+import asyncio
+import time
+from dataclasses import replace
+from typing import Any
+
+from test_cpsat_equivalence import class_distances, violations
+
+from benchmark.generator import SCALES, generate
+from data import ScheduleData
+from decomposition import DecomposedSchedule
+from schedule_cpsat import CpSatSchedule
+
+ENTITIES = ("teachers", "classes", "rooms", "courses", "subjects")
+
+
+def disjoint_school(parts: int, time_limit: float) -> ScheduleData:
+    """Tiny schools side by side, sharing no teachers, classes or rooms."""
+    schools = [
+        generate(replace(SCALES["tiny"], seed=i, optimize_distance=True))
+        for i in range(parts)
+    ]
+    obj: dict[str, Any] = {**schools[0], **{key: [] for key in ENTITIES}}
+    num_rooms = sum(len(school["rooms"]) for school in schools)
+    # Rooms of different schools are never walked between, any distance works
+    obj["room_distances"] = [[0] * num_rooms for _ in range(num_rooms)]
+    for school in schools:
+        offset = {key: len(obj[key]) for key in ENTITIES}
+        for key in ("teachers", "classes", "rooms"):
+            obj[key] += school[key]
+        base = offset["rooms"]
+        for a, row in enumerate(school["room_distances"]):
+            obj["room_distances"][base + a][base : base + len(row)] = row
+        for course in school["courses"]:
+            course = {
+                **course,
+                "subjects": [s + offset["subjects"] for s in course["subjects"]],
+            }
+            if course.get("teacher_distribution"):
+                course["teacher_distribution"] = [
+                    {**td, "teacher": td["teacher"] + offset["teachers"]}
+                    for td in course["teacher_distribution"]
+                ]
+            obj["courses"].append(course)
+        for subject in school["subjects"]:
+            subject = {
+                **subject,
+                "classes": [c + offset["classes"] for c in subject["classes"]],
+                "teachers": [t + offset["teachers"] for t in subject["teachers"]],
+                "available_rooms": [
+                    r + offset["rooms"] for r in subject["available_rooms"]
+                ],
+            }
+            if subject.get("course") is not None:
+                subject["course"] += offset["courses"]
+            obj["subjects"].append(subject)
+    obj["config"] = {**obj["config"], "backend": "cp-sat", "decompose": True}
+    obj["budget"] = {"time_limit": time_limit}
+    return ScheduleData(obj)
+
+
+def test_streams_before_parts_finish(monkeypatch):
+    data = disjoint_school(4, time_limit=6)
+    assert len(data.components()) == 4
+
+    running, peak, finished = 0, 0, []
+    iterate_solutions = CpSatSchedule.iterate_solutions
+
+    async def tracked(self, callback=None, processes=None, executor=None):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        try:
+            await iterate_solutions(self, callback, processes, executor)
+        finally:
+            running -= 1
+            if self.budget.max_solutions != 1:
+                finished.append(time.monotonic())
+
+    monkeypatch.setattr(CpSatSchedule, "iterate_solutions", tracked)
+    events = []
+    schedule = DecomposedSchedule(data, CpSatSchedule)
+    asyncio.run(
+        schedule.iterate_solutions(
+            lambda event: events.append((time.monotonic(), event)), 2
+        )
+    )
+
+    solutions = [(at, event) for at, event in events if event is not None]
+    assert peak <= 2
+    assert solutions and finished
+    # The first merged solution doesn't wait for any part to finish optimizing
+    assert solutions[0][0] < min(finished)
+
+    best = solutions[-1][1]
+    assert violations(data, best.variables) == []
+    distances = class_distances(data, best.variables)
+    assert best.objective == distances.sum(axis=2).max()